@@ -0,0 +1,3 @@
+cd ./scuttlebutt
+python benchmarks/benchmarks.py "$@"
+cd -
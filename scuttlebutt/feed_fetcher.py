@@ -0,0 +1,295 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+"""Defines the FeedFetcher class used to fetch several feeds at once.
+
+  Feeds served over HTTP are fetched with asynchronous urlfetch calls, so a
+  single task can wait for many slow servers at the same time. Each feed is
+  parsed as soon as its response arrives, in feedparser's lean mode, because
+  only the title, link, summary and date of each entry are used, and into
+  compact entries, which take less memory and are quicker to read. The time
+  each phase of fetching and parsing a feed takes is recorded in the 'timings'
+  of its parse result.
+
+  Redirects are followed by the fetcher rather than by urlfetch, so that it
+  can tell permanent redirects from temporary ones. Where a feed was found to
+  redirect, it is fetched from where it redirected to, if that is still
+  valid, which saves the redirect hops.
+"""
+
+__author__ = ('momander@google.com (Martin Omander)',
+              'shamjeff@google.com (Jeff Sham)')
+
+from datetime import datetime
+import logging
+from StringIO import StringIO
+import time
+import urlparse
+import feedparser
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import urlfetch
+
+# App Engine allows at most this many simultaneous asynchronous urlfetch calls.
+MAX_CONCURRENT_FETCHES = 10
+# Seconds to wait for a feed server to respond.
+FETCH_DEADLINE = 30
+# Every this many fetches a feed is parsed without hints, so that a feed that
+# was fixed gets the strict parser and its declared encoding again.
+HINT_RECHECK_FETCHES = 24
+# The most redirects followed for one feed.
+MAX_REDIRECTS = 5
+# Status codes of the redirects that are followed, and of those that are
+# permanent.
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+PERMANENT_REDIRECT_CODES = (301, 308)
+
+
+class _Fetch(object):
+  """The state of the fetch of one feed, across redirects."""
+
+  def __init__(self, feed, url, redirects_avoided, conditional):
+    """Initialize the fetch.
+
+    Args:
+      feed: Feed The feed to fetch.
+      url: str The URL to fetch the feed from.
+      redirects_avoided: int The redirect hops saved by fetching url rather
+          than the feed's URL.
+      conditional: bool Whether to send the feed's validators.
+    """
+    self.feed = feed
+    self.url = url
+    self.redirects_avoided = redirects_avoided
+    self.conditional = conditional
+    # Status codes of the redirects followed.
+    self.redirects = []
+    self.started = time.time()
+
+
+class FeedFetcher(object):
+  """Fetches and parses feeds concurrently."""
+
+  def __init__(self, max_concurrent=MAX_CONCURRENT_FETCHES,
+               deadline=FETCH_DEADLINE):
+    """Initialize the fetcher.
+
+    Args:
+      max_concurrent: int The maximum number of fetches in flight at once.
+      deadline: int Seconds to wait for each response.
+    """
+    self.max_concurrent = max_concurrent
+    self.deadline = deadline
+
+  def FetchAll(self, feeds, entry_filter=None, topics_fingerprint=None):
+    """Fetches feeds concurrently and parses each one as it arrives.
+
+    Feeds that are not served over HTTP, like local files, are parsed
+    directly while the HTTP fetches are in flight.
+
+    Feeds are fetched with a conditional GET, except for those whose entries
+    were last matched against other topics than topics_fingerprint. A 304 Not
+    Modified would keep their entries from being matched against the current
+    topics.
+
+    Args:
+      feeds: list The Feed objects to fetch.
+      entry_filter: function Called with each entry while the feed is parsed,
+          returns whether to keep the entry. See feedparser.parse.
+      topics_fingerprint: str The fingerprint of the topics the entries are
+          matched against, or None to always fetch conditionally.
+
+    Yields:
+      (feed, feed_content) tuples in the order the fetches complete, where
+      feed_content is the result of feedparser.parse with timings. The
+      'fetch' timing of an HTTP feed is the time from sending its request
+      until its response is picked up, which includes any wait while the
+      feeds that arrived earlier are processed. For HTTP feeds,
+      feed_content['redirects'] lists the status codes of the redirects
+      followed, and feed_content['redirects_avoided'] counts the redirect
+      hops saved by fetching from where the feed redirected to before.
+    """
+    waiting = [f for f in feeds if self._IsHttp(f.url)]
+    pending = {}
+    self._StartFetches(waiting, pending, topics_fingerprint)
+    for feed in feeds:
+      if not self._IsHttp(feed.url):
+        etag = modified = None
+        if self._Conditional(feed, topics_fingerprint):
+          etag, modified = feed.etag, feed.last_modified
+        yield feed, feedparser.parse(feed.url, etag=etag,
+                                     modified=modified, lean=1,
+                                     hints=self.ParseHints(feed),
+                                     entry_filter=entry_filter, compact=1,
+                                     timings=1)
+    while pending:
+      rpc = apiproxy_stub_map.UserRPC.wait_any(pending.keys())
+      fetch = pending.pop(rpc)
+      location = self._RedirectLocation(rpc)
+      if location and len(fetch.redirects) < MAX_REDIRECTS:
+        fetch.redirects.append(rpc.get_result().status_code)
+        fetch.url = urlparse.urljoin(fetch.url, location)
+        self._StartFetch(fetch, pending)
+        continue
+      self._StartFetches(waiting, pending, topics_fingerprint)
+      yield fetch.feed, self._Parse(fetch, rpc, entry_filter)
+
+  def _IsHttp(self, url):
+    """Returns True if url is fetched with urlfetch."""
+    return url.startswith('http://') or url.startswith('https://')
+
+  def _StartFetches(self, waiting, pending, topics_fingerprint):
+    """Starts fetches for waiting feeds until max_concurrent are in flight.
+
+    Args:
+      waiting: list Feeds still to fetch. Started feeds are removed from it.
+      pending: dict Maps the RPCs of fetches in flight to their _Fetch.
+      topics_fingerprint: str The fingerprint of the current topics, or None.
+    """
+    now = datetime.now()
+    while waiting and len(pending) < self.max_concurrent:
+      feed = waiting.pop(0)
+      url, redirects_avoided = self.FetchUrl(feed, now)
+      conditional = self._Conditional(feed, topics_fingerprint)
+      self._StartFetch(_Fetch(feed, url, redirects_avoided, conditional),
+                       pending)
+
+  def _Conditional(self, feed, topics_fingerprint):
+    """Returns whether to fetch a feed with a conditional GET."""
+    return (topics_fingerprint is None or
+            feed.topics_fingerprint == topics_fingerprint)
+
+  def _StartFetch(self, fetch, pending):
+    """Starts fetching the current URL of a fetch.
+
+    Args:
+      fetch: _Fetch The fetch to start.
+      pending: dict Maps the RPCs of fetches in flight to their _Fetch.
+    """
+    rpc = urlfetch.create_rpc(deadline=self.deadline)
+    urlfetch.make_fetch_call(rpc, fetch.url,
+                             headers=self.RequestHeaders(fetch.feed,
+                                                         fetch.conditional),
+                             follow_redirects=False)
+    pending[rpc] = fetch
+
+  def FetchUrl(self, feed, now):
+    """Returns the URL to fetch a feed from.
+
+    That is where the feed's URL redirected to when it was last fetched, if
+    the redirect was permanent or has not expired, and the feed's URL was
+    not changed since.
+
+    Args:
+      feed: Feed The feed to fetch.
+      now: datetime The current time.
+
+    Returns:
+      A (url, redirects_avoided) tuple, where redirects_avoided is the number
+      of redirect hops saved by fetching url rather than the feed's URL.
+    """
+    if (feed.redirect_url and feed.redirect_from == feed.url and
+        (feed.redirect_expires_at is None or feed.redirect_expires_at > now)):
+      return feed.redirect_url, feed.redirect_hops
+    return feed.url, 0
+
+  def _RedirectLocation(self, rpc):
+    """Returns where a completed fetch redirects to, or None."""
+    try:
+      response = rpc.get_result()
+    except urlfetch.Error:
+      return None
+    if response.status_code not in REDIRECT_CODES:
+      return None
+    for name, value in response.headers.items():
+      if name.lower() == 'location':
+        return value
+    return None
+
+  def RequestHeaders(self, feed, conditional=True):
+    """Returns the HTTP request headers for fetching a feed.
+
+    Args:
+      feed: Feed The feed to fetch.
+      conditional: bool Whether to send the feed's validators, so that the
+          server can answer 304 Not Modified.
+
+    Returns:
+      A dictionary of header names and values.
+    """
+    headers = {
+        'User-Agent': feedparser.USER_AGENT,
+        'Accept': feedparser.ACCEPT_HEADER,
+        # feedparser decompresses the response as it parses it.
+        'Accept-Encoding': 'gzip, deflate',
+    }
+    if conditional and feed.etag:
+      headers['If-None-Match'] = feed.etag
+    if conditional and feed.last_modified:
+      headers['If-Modified-Since'] = feed.last_modified
+    return headers
+
+  def ParseHints(self, feed):
+    """Returns what earlier parses found out about a feed.
+
+    Args:
+      feed: Feed The feed to parse.
+
+    Returns:
+      The hints argument for feedparser.parse, or None to parse without hints.
+    """
+    if feed.fetch_count % HINT_RECHECK_FETCHES == 0:
+      return None
+    return {
+        'encoding': feed.parse_encoding,
+        'declared_encoding': feed.declared_encoding,
+        'loose': feed.parse_loose,
+    }
+
+  def _Parse(self, fetch, rpc, entry_filter):
+    """Parses the response of a completed fetch.
+
+    Args:
+      fetch: _Fetch The fetch that completed.
+      rpc: UserRPC The completed urlfetch RPC.
+      entry_filter: function Returns whether to keep an entry, or None.
+
+    Returns:
+      The result of feedparser.parse. If the fetch failed, the result has no
+      entries and bozo_exception is set, just like feedparser does when it
+      cannot download a feed itself.
+    """
+    feed = fetch.feed
+    try:
+      response = rpc.get_result()
+      if response.status_code in REDIRECT_CODES:
+        raise urlfetch.DownloadError('Too many redirects')
+    except urlfetch.Error, e:
+      logging.warn('Could not fetch %s: %s', fetch.url, e)
+      return self._Result(fetch, feedparser.FeedParserDict(
+          feed=feedparser.FeedParserDict(), entries=[], bozo=1,
+          bozo_exception=e, timings={'fetch': (time.time() - fetch.started,
+                                               0)}))
+    fetch_timing = (time.time() - fetch.started, len(response.content))
+    if response.status_code == 304:
+      return self._Result(fetch, feedparser.FeedParserDict(
+          feed=feedparser.FeedParserDict(), entries=[], bozo=0, status=304,
+          href=fetch.url, timings={'fetch': fetch_timing}))
+    headers = dict((k.lower(), v) for k, v in response.headers.items())
+    # Relative links are resolved against Content-Location, which is the
+    # only way to give feedparser the URL when it does not fetch the feed.
+    headers.setdefault('content-location', fetch.url)
+    feed_content = feedparser.parse(StringIO(response.content),
+                                    response_headers=headers, lean=1,
+                                    hints=self.ParseHints(feed),
+                                    entry_filter=entry_filter, compact=1,
+                                    timings=1)
+    # The parser only read the response from memory.
+    feed_content['timings']['fetch'] = fetch_timing
+    feed_content['status'] = response.status_code
+    feed_content['href'] = fetch.url
+    return self._Result(fetch, feed_content)
+
+  def _Result(self, fetch, feed_content):
+    """Adds the redirects of a fetch to its result and returns the result."""
+    feed_content['redirects'] = fetch.redirects
+    feed_content['redirects_avoided'] = fetch.redirects_avoided
+    return feed_content
@@ -0,0 +1,269 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+"""Defines the FeedScheduler class used to decide when to fetch each feed.
+
+  Each feed's publish rate is tracked as a moving average of the entries it
+  publishes per day, and the feed is scheduled so that a fetch finds about one
+  new entry, within fixed bounds. Busy feeds are fetched more often than once
+  an hour and quiet feeds much less often.
+
+  Feeds that fail to fetch are backed off exponentially, and suspended once
+  they are gone or keep failing.
+
+  Feeds are put in priority tiers by their monthly visitors. Each tier has
+  its own download queue, so feeds with many readers do not wait behind
+  small ones, and its own bound on the time between fetches, so they are
+  fetched more often.
+
+  Each feed also has a stable offset within the dispatch interval, derived
+  from its host, so that a dispatch can spread the fetches it starts over the
+  interval rather than starting them all at once.
+"""
+
+__author__ = ('momander@google.com (Martin Omander)',
+              'shamjeff@google.com (Jeff Sham)')
+
+from datetime import datetime
+from datetime import timedelta
+import hashlib
+from time import mktime
+
+# Bounds on the time between two fetches of a feed, in minutes. The dispatch
+# cron job must run at least as often as the minimum.
+MIN_FETCH_INTERVAL = 15
+MAX_FETCH_INTERVAL = 24 * 60
+# How often the dispatch cron job runs, in minutes.
+DISPATCH_INTERVAL = 15
+# The fixed polling interval used before feeds were scheduled, in minutes.
+HOURLY_FETCH_INTERVAL = 60
+# Weight of the newest observation in the publish rate moving average.
+PUBLISH_RATE_WEIGHT = 0.3
+# The longest a failing feed is backed off for, in minutes, and the number of
+# failures in a row after which it is suspended.
+MAX_BACKOFF_INTERVAL = 7 * 24 * 60
+MAX_FAILURES = 10
+# Suspended feeds are due at this time, which keeps them out of dispatch.
+SUSPENDED_UNTIL = datetime(9999, 12, 31)
+
+_MINUTES_PER_DAY = 24 * 60
+
+
+class PriorityTier(object):
+  """A band of feeds by readership, with its own queue and fetch interval."""
+
+  def __init__(self, name, min_visitors, queue, max_fetch_interval):
+    """Initialize the tier.
+
+    Args:
+      name: str The name of the tier.
+      min_visitors: int The fewest monthly visitors of a feed in the tier.
+      queue: str The name of the task queue the tier's feeds are fetched by.
+      max_fetch_interval: int The longest time between two fetches of a feed
+          in the tier, in minutes.
+    """
+    self.name = name
+    self.min_visitors = min_visitors
+    self.queue = queue
+    self.max_fetch_interval = max_fetch_interval
+
+
+# The priority tiers, busiest first. The rates of their queues in queue.yaml
+# add up to the rate of the single download queue used before.
+PRIORITY_TIERS = (
+    PriorityTier('high', 1000000, 'download-high', 60),
+    PriorityTier('medium', 10000, 'download-medium', 6 * 60),
+    PriorityTier('low', 0, 'download', MAX_FETCH_INTERVAL),
+)
+
+
+class FeedScheduler(object):
+  """Tracks feed publish rates and schedules the next fetch of each feed."""
+
+  def Reschedule(self, feed, entries, now, dispatched_at=None):
+    """Updates the publish rate of a fetched feed and schedules its next fetch.
+
+    The next fetch is due fetch_interval after the dispatch that started this
+    one. Dispatch only picks feeds that are due when it runs, so counting from
+    the time of the fetch would put off every fetch that waited in the queue
+    to the dispatch after the one it is due for.
+
+    Args:
+      feed: Feed The feed that was fetched. It is updated but not saved.
+      entries: list The entries of the parsed feed, empty if the feed was not
+          modified.
+      now: datetime The time of the fetch.
+      dispatched_at: datetime The time of the dispatch that started the fetch,
+          or None to count from the time of the fetch.
+    """
+    rate = self._ObservedPublishRate(feed, entries, now)
+    if rate is not None:
+      if feed.publish_rate is None:
+        feed.publish_rate = rate
+      else:
+        feed.publish_rate = (PUBLISH_RATE_WEIGHT * rate +
+                             (1 - PUBLISH_RATE_WEIGHT) * feed.publish_rate)
+    feed.fetch_interval = self.FetchInterval(
+        feed.publish_rate, self.Tier(feed).max_fetch_interval)
+    feed.failure_count = 0
+    feed.last_fetched_at = now
+    feed.next_fetch_at = (dispatched_at or now) + timedelta(
+        minutes=feed.fetch_interval)
+
+  def Backoff(self, feed, now, gone=False):
+    """Schedules the next fetch of a feed that failed to fetch.
+
+    The time to the next fetch doubles with every failure in a row, up to
+    MAX_BACKOFF_INTERVAL. A feed that is gone, or that failed MAX_FAILURES
+    times in a row, is suspended instead.
+
+    Args:
+      feed: Feed The feed that failed. It is updated but not saved.
+      now: datetime The time of the fetch.
+      gone: bool Whether the server said the feed is gone for good.
+    """
+    feed.failure_count += 1
+    if gone or feed.failure_count >= MAX_FAILURES:
+      feed.suspended = True
+      feed.next_fetch_at = SUSPENDED_UNTIL
+      return
+    interval = (feed.fetch_interval or HOURLY_FETCH_INTERVAL) * (
+        2 ** feed.failure_count)
+    feed.next_fetch_at = now + timedelta(
+        minutes=min(MAX_BACKOFF_INTERVAL, interval))
+
+  def Resume(self, feed, now):
+    """Makes a suspended feed due for fetching again.
+
+    Args:
+      feed: Feed The feed to resume. It is updated but not saved.
+      now: datetime The current time.
+    """
+    feed.suspended = False
+    feed.failure_count = 0
+    feed.next_fetch_at = now
+
+  def _ObservedPublishRate(self, feed, entries, now):
+    """Estimates how many entries a feed publishes per day.
+
+    The first time a feed is fetched, the rate is estimated from the span of
+    the entry dates. After that it is the number of entries dated after the
+    previous fetch, divided by the time since that fetch.
+
+    Args:
+      feed: Feed The feed that was fetched.
+      entries: list The entries of the parsed feed.
+      now: datetime The time of the fetch.
+
+    Returns:
+      Entries per day, or None if there is nothing to go on.
+    """
+    dates = [datetime.fromtimestamp(mktime(entry['updated_parsed']))
+             for entry in entries if entry.get('updated_parsed')]
+    if feed.last_fetched_at is None:
+      if len(dates) < 2:
+        return None
+      return (len(dates) - 1) / self._Days(max(dates) - min(dates))
+    elapsed = self._Days(now - feed.last_fetched_at)
+    if elapsed <= 0:
+      return None
+    new_entries = [d for d in dates if d > feed.last_fetched_at]
+    return len(new_entries) / elapsed
+
+  def _Days(self, delta):
+    """Returns a timedelta as a number of days, at least a minute long."""
+    minutes = max(delta.days * _MINUTES_PER_DAY + delta.seconds / 60.0, 1)
+    return minutes / _MINUTES_PER_DAY
+
+  def Tier(self, feed):
+    """Returns the PriorityTier of a feed, by its monthly visitors."""
+    for tier in PRIORITY_TIERS:
+      if (feed.monthly_visitors or 0) >= tier.min_visitors:
+        return tier
+    return PRIORITY_TIERS[-1]
+
+  def FetchInterval(self, publish_rate, max_interval=MAX_FETCH_INTERVAL):
+    """Returns the minutes to wait between fetches of a feed.
+
+    Args:
+      publish_rate: float Entries the feed publishes per day, or None if it is
+          unknown.
+      max_interval: int The longest interval, which depends on the feed's
+          priority tier.
+
+    Returns:
+      The interval in minutes, between MIN_FETCH_INTERVAL and max_interval.
+    """
+    if publish_rate is None:
+      return min(HOURLY_FETCH_INTERVAL, max_interval)
+    if publish_rate <= 0:
+      return max_interval
+    interval = int(_MINUTES_PER_DAY / publish_rate)
+    return max(MIN_FETCH_INTERVAL, min(max_interval, interval))
+
+  def DailyFetches(self, feeds):
+    """Compares the fetches per day of the schedule with hourly polling.
+
+    Suspended feeds are not fetched at all, so they are left out.
+
+    Args:
+      feeds: iterable The feeds to report on.
+
+    Returns:
+      A dictionary with the number of feeds, the fetches per day with fixed
+      hourly polling and with the current schedule, and the difference.
+    """
+    feed_count = 0
+    scheduled = 0.0
+    for feed in feeds:
+      if feed.suspended:
+        continue
+      feed_count += 1
+      scheduled += (float(_MINUTES_PER_DAY) /
+                    (feed.fetch_interval or HOURLY_FETCH_INTERVAL))
+    hourly = feed_count * _MINUTES_PER_DAY / HOURLY_FETCH_INTERVAL
+    return {
+        'feeds': feed_count,
+        'hourlyFetchesPerDay': hourly,
+        'scheduledFetchesPerDay': int(round(scheduled)),
+        'savedFetchesPerDay': int(round(hourly - scheduled)),
+    }
+
+  def DispatchOffset(self, feed):
+    """Returns the minute of the dispatch interval a feed is fetched in.
+
+    The offset is a hash of the feed's host, so it is the same for every
+    dispatch, and the hosts are spread evenly over the interval. All feeds
+    from one host are dispatched in the same minute, so they can be fetched
+    by the same download task.
+
+    Args:
+      feed: Feed The feed. Only its url is used.
+
+    Returns:
+      Minutes from the start of a dispatch, less than DISPATCH_INTERVAL.
+    """
+    digest = hashlib.md5(feed.host.encode('utf-8')).hexdigest()
+    return int(digest, 16) % DISPATCH_INTERVAL
+
+  def LoadProfile(self, feeds):
+    """Reports how the fetches of spread dispatch fall within the interval.
+
+    Args:
+      feeds: iterable The saved feeds to report on.
+
+    Returns:
+      A dictionary with the fetches per day started in each minute of the
+      dispatch interval, the most of those in any minute, and the fetches per
+      day that dispatching every feed at once would start in its first minute.
+    """
+    minutes = [0.0] * DISPATCH_INTERVAL
+    for feed in feeds:
+      minutes[self.DispatchOffset(feed)] += (
+          float(_MINUTES_PER_DAY) /
+          (feed.fetch_interval or HOURLY_FETCH_INTERVAL))
+    minutes = [int(round(fetches)) for fetches in minutes]
+    return {
+        'fetchesPerDayByMinute': minutes,
+        'spreadPeakFetchesPerDay': max(minutes),
+        'burstPeakFetchesPerDay': sum(minutes),
+    }
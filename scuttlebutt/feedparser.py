@@ -81,6 +81,48 @@ SANITIZE_HTML = 1
 # in entry contents, set this to 1
 PARSE_MICROFORMATS = 1
 
+# Elements that are still handled when parse() is called with lean=1.  Lean
+# parsing only fills in the feed and entry title, link, id, summary and dates;
+# every other element is skipped together with everything nested inside it,
+# and embedded markup is neither sanitized, resolved nor searched for
+# microformats.  Names are namespace prefix and local name joined by '_'.
+LEAN_ELEMENTS = set([
+    'rss', 'rdf_rdf', 'channel', 'feed', 'item', 'entry',
+    'title', 'dc_title', 'link', 'id', 'guid',
+    'description', 'dc_description', 'summary', 'abstract',
+    'content', 'content_encoded', 'body', 'xhtml_body', 'fullitem',
+    'updated', 'modified', 'dcterms_modified', 'pubdate', 'dc_date',
+    'lastbuilddate', 'published', 'dcterms_issued', 'issued',
+])
+
+# Elements of an entry that are still handled after the entry_filter passed
+# to parse() rejects it, and the keys that are kept of the rejected entry.
+# They identify and date the entry, so that callers can still tell where the
+# feed left off and how often it publishes.
+ENTRY_STUB_ELEMENTS = set([
+    'link', 'id', 'guid',
+    'updated', 'modified', 'dcterms_modified', 'pubdate', 'dc_date',
+    'published', 'dcterms_issued', 'issued',
+])
+ENTRY_STUB_KEYS = ['id', 'link', 'updated', 'updated_parsed', 'published',
+                   'published_parsed']
+
+# Elements at whose end an entry can get its title or summary.  The
+# entry_filter passed to parse() is tried after these only, and at the end of
+# the entry if it was not tried before.
+ENTRY_FILTER_ELEMENTS = set([
+    'title', 'dc_title', 'media_title',
+    'description', 'dc_description', 'abstract', 'summary', 'itunes_summary',
+    'content', 'content_encoded', 'body', 'xhtml_body', 'fullitem',
+])
+
+# Keys that a CompactEntry, returned when parse() is called with compact=1,
+# stores in slots of its own.  These are the keys that lean parsing fills in;
+# any other key costs a dict per entry, created when the first one is set.
+COMPACT_ENTRY_KEYS = ['id', 'guidislink', 'link', 'links', 'title', 'summary',
+                      'content', 'updated', 'updated_parsed', 'published',
+                      'published_parsed', 'rejected']
+
 # ---------- Python 3 modules (make it work if possible) ----------
 try:
     import rfc822
@@ -142,10 +184,12 @@ ACCEPTABLE_URI_SCHEMES = (
 
 # ---------- required modules (should come with any Python distribution) ----------
 import cgi
+import codecs
 import copy
 import datetime
 import re
 import struct
+import threading
 import time
 import types
 import urllib
@@ -164,11 +208,9 @@ except ImportError:
 
 # ---------- optional modules (feedparser will work without these, but with reduced functionality) ----------
 
-# gzip is included with most Python distributions, but may not be available if you compiled your own
-try:
-    import gzip
-except ImportError:
-    gzip = None
+# zlib, which decompresses gzip- and deflate-compressed feeds, is included
+# with most Python distributions, but may not be available if you compiled
+# your own
 try:
     import zlib
 except ImportError:
@@ -272,6 +314,22 @@ try:
 except ImportError:
     chardet = None
 
+# chardet only looks at this many bytes from the start of a document
+CHARDET_SAMPLE_SIZE = 16384
+
+# Feeds that the hints passed to parse() describe well enough are read, and
+# fed to the XML parser, this many bytes at a time
+STREAM_CHUNK_SIZE = 65536
+
+# A streamed feed that cannot be rewound is kept in memory up to this many
+# raw bytes, so that it can be parsed again the usual way if the strict parser
+# fails on it; past that, a failure keeps what was parsed so far
+MAX_STREAM_BUFFER = 1024 * 1024
+
+# Compressed feeds that decompress to more than this many bytes are given up
+# on, so that a small response cannot fill the memory
+MAX_DECOMPRESSED_SIZE = 10 * 1024 * 1024
+
 # BeautifulSoup is used to extract microformat content from HTML
 # feedparser is tested using BeautifulSoup 3.2.0
 # http://www.crummy.com/software/BeautifulSoup/
@@ -287,6 +345,7 @@ class CharacterEncodingOverride(ThingsNobodyCaresAboutButMe): pass
 class CharacterEncodingUnknown(ThingsNobodyCaresAboutButMe): pass
 class NonXMLContentType(ThingsNobodyCaresAboutButMe): pass
 class UndeclaredNamespace(Exception): pass
+class FeedTooLarge(Exception): pass
 
 SUPPORTED_VERSIONS = {'': u'unknown',
                       'rss090': u'RSS 0.90',
@@ -384,6 +443,145 @@ class FeedParserDict(dict):
     def __hash__(self):
         return id(self)
 
+class CompactEntry(object):
+    '''A smaller, faster stand-in for the FeedParserDict of an entry.
+
+    The keys in COMPACT_ENTRY_KEYS live in slots and are also attributes;
+    other keys live in a dict that only exists once one is set.  *_detail
+    dicts are packed into a tuple and only unpacked into a FeedParserDict
+    when they are read.  Keys are looked up like FeedParserDict does, aliases
+    in FeedParserDict.keymap included.
+    '''
+    __slots__ = COMPACT_ENTRY_KEYS + ['_extra', '_details']
+    keymap = FeedParserDict.keymap
+
+    def __init__(self, entry=None):
+        self._extra = None
+        self._details = None
+        if entry:
+            for key, value in dict.items(entry):
+                self[key] = value
+
+    def _lookup(self, key):
+        getter = _compact_slot_getters.get(key)
+        if getter is not None:
+            try:
+                return getter(self)
+            except AttributeError:
+                raise KeyError, key
+        if self._details and key in self._details:
+            detail = self._details[key]
+            if isinstance(detail, tuple):
+                # unpack on first use and keep it, so changes to it stick
+                detail = FeedParserDict(zip(detail[0], detail[1:]))
+                self._details[key] = detail
+            return detail
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError, key
+
+    def __getitem__(self, key):
+        getter = _compact_slot_getters.get(key)
+        if getter is not None:
+            try:
+                return getter(self)
+            except AttributeError:
+                raise KeyError, key
+        if key in ('category', 'enclosures', 'license'):
+            return self.asFeedParserDict()[key]
+        realkey = self.keymap.get(key, key)
+        if isinstance(realkey, list):
+            for k in realkey:
+                try:
+                    return self._lookup(k)
+                except KeyError:
+                    pass
+        elif realkey != key:
+            try:
+                return self._lookup(realkey)
+            except KeyError:
+                pass
+        return self._lookup(key)
+
+    def __contains__(self, key):
+        try:
+            self.__getitem__(key)
+        except KeyError:
+            return False
+        else:
+            return True
+
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        try:
+            return self.__getitem__(key)
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        key = self.keymap.get(key, key)
+        if isinstance(key, list):
+            key = key[0]
+        if key in _compact_slot_getters:
+            setattr(self, key, value)
+        elif key.endswith('_detail') and isinstance(value, dict):
+            if self._details is None:
+                self._details = {}
+            # the key order is shared by all details with the same keys
+            keys = tuple(value.keys())
+            keys = _compact_detail_layouts.setdefault(keys, keys)
+            self._details[key] = (keys,) + tuple([value[k] for k in keys])
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def setdefault(self, key, value):
+        if key not in self:
+            self[key] = value
+            return value
+        return self[key]
+
+    def __getattr__(self, key):
+        # only called for keys that are not in a slot
+        if key.startswith('__'):
+            raise AttributeError, key
+        try:
+            return self.__getitem__(key)
+        except KeyError:
+            raise AttributeError, "object has no attribute '%s'" % key
+
+    def keys(self):
+        keys = [k for k in COMPACT_ENTRY_KEYS if hasattr(self, k)]
+        if self._details:
+            keys.extend(self._details.keys())
+        if self._extra:
+            keys.extend(self._extra.keys())
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(k, self._lookup(k)) for k in self.keys()]
+
+    def asFeedParserDict(self):
+        '''Returns the entry as the FeedParserDict that parse() makes without compact.'''
+        return FeedParserDict(self.items())
+
+    def __repr__(self):
+        return 'CompactEntry(%r)' % dict(self.items())
+
+# the getters of the slot descriptors raise AttributeError for empty slots
+# without falling back to __getattr__
+_compact_slot_getters = dict([(k, getattr(CompactEntry, k).__get__)
+                              for k in COMPACT_ENTRY_KEYS])
+_compact_detail_layouts = {}
+
 _cp1252 = {
     128: unichr(8364), # euro sign
     130: unichr(8218), # single low-9 quotation mark
@@ -413,6 +611,8 @@ _cp1252 = {
     158: unichr( 382), # latin small letter z with caron
     159: unichr( 376), # latin capital letter y with diaeresis
 }
+# finds the characters in _cp1252 much faster than translate() maps them
+_cp1252_search = re.compile(u'[%s]' % u''.join(map(unichr, _cp1252.keys()))).search
 
 _urifixer = re.compile('^([A-Za-z][A-Za-z0-9+-.]*://)(/*)(.*?)')
 def _urljoin(base, uri):
@@ -526,6 +726,11 @@ class _FeedParserMixin:
         self.contentparams = FeedParserDict()
         self._summaryKey = None
         self.namespacemap = {}
+        # maps each tag seen to its element name and handlers, and each pair
+        # of base URIs joined to the result; the first is only valid as long
+        # as the namespaces in use do not change
+        self.tagcache = {}
+        self.baseuricache = {}
         self.elementstack = []
         self.basestack = []
         self.langstack = []
@@ -534,6 +739,13 @@ class _FeedParserMixin:
         self.svgOK = 0
         self.title_depth = -1
         self.depth = 0
+        self.lean = 0
+        self.skipdepth = 0
+        self.entry_filter = None
+        self.compact = 0
+        self.timings = None
+        self.entryfiltered = 0
+        self.entryrejected = 0
         if baselang:
             self.feeddata['language'] = baselang.replace('_','-')
 
@@ -559,6 +771,11 @@ class _FeedParserMixin:
         return (k, v)
 
     def unknown_starttag(self, tag, attrs):
+        # elements nested in a skipped element are only counted
+        if self.skipdepth:
+            self.skipdepth += 1
+            return
+
         # increment depth counter
         self.depth += 1
         
@@ -572,10 +789,15 @@ class _FeedParserMixin:
             baseuri = baseuri.decode(self.encoding, 'ignore')
         # ensure that self.baseuri is always an absolute URI that
         # uses a whitelisted URI scheme (e.g. not `javscript:`)
-        if self.baseuri:
-            self.baseuri = _makeSafeAbsoluteURI(self.baseuri, baseuri) or self.baseuri
-        else:
-            self.baseuri = _urljoin(self.baseuri, baseuri)
+        key = (self.baseuri, baseuri)
+        try:
+            self.baseuri = self.baseuricache[key]
+        except KeyError:
+            if self.baseuri:
+                self.baseuri = _makeSafeAbsoluteURI(self.baseuri, baseuri) or self.baseuri
+            else:
+                self.baseuri = _urljoin(self.baseuri, baseuri)
+            self.baseuricache[key] = self.baseuri
         lang = attrsD.get('xml:lang', attrsD.get('lang'))
         if lang == '':
             # xml:lang could be explicitly set to '', we need to capture that
@@ -616,13 +838,7 @@ class _FeedParserMixin:
             return self.handle_data('<%s%s>' % (tag, self.strattrs(attrs)), escape=0)
 
         # match namespaces
-        if tag.find(':') <> -1:
-            prefix, suffix = tag.split(':', 1)
-        else:
-            prefix, suffix = '', tag
-        prefix = self.namespacemap.get(prefix, prefix)
-        if prefix:
-            prefix = prefix + '_'
+        prefix, unknown_tag, starthandler, endhandler = self._dispatch(tag)
 
         # special hack for better tracking of empty textinput/image elements in illformed feeds
         if (not prefix) and tag not in ('title', 'link', 'description', 'name'):
@@ -630,14 +846,23 @@ class _FeedParserMixin:
         if (not prefix) and tag not in ('title', 'link', 'description', 'url', 'href', 'width', 'height'):
             self.inimage = 0
 
+        # in lean mode, skip elements we were not asked for
+        if self.lean and unknown_tag not in LEAN_ELEMENTS:
+            self.skipdepth = 1
+            return
+
+        # skip the rest of an entry the entry filter rejected
+        if self.entryrejected and unknown_tag not in ENTRY_STUB_ELEMENTS:
+            self.skipdepth = 1
+            return
+
         # call special handler (if defined) or default handler
-        methodname = '_start_' + prefix + suffix
         try:
-            method = getattr(self, methodname)
-            return method(attrsD)
+            if starthandler is None:
+                raise AttributeError()
+            return starthandler(self, attrsD)
         except AttributeError:
             # Since there's no handler or something has gone wrong we explicitly add the element and its attributes
-            unknown_tag = prefix + suffix
             if len(attrsD) == 0:
                 # No attributes so merge it into the encosing dictionary
                 return self.push(unknown_tag, 1)
@@ -647,26 +872,37 @@ class _FeedParserMixin:
                 context[unknown_tag] = attrsD
 
     def unknown_endtag(self, tag):
+        # end of an element nested in a skipped element
+        if self.skipdepth > 1:
+            self.skipdepth -= 1
+            return
+
         # match namespaces
-        if tag.find(':') <> -1:
-            prefix, suffix = tag.split(':', 1)
-        else:
-            prefix, suffix = '', tag
-        prefix = self.namespacemap.get(prefix, prefix)
-        if prefix:
-            prefix = prefix + '_'
-        if suffix == 'svg' and self.svgOK:
+        prefix, element, starthandler, endhandler = self._dispatch(tag)
+        if self.svgOK and element[len(prefix):] == 'svg':
             self.svgOK -= 1
 
         # call special handler (if defined) or default handler
-        methodname = '_end_' + prefix + suffix
-        try:
-            if self.svgOK:
-                raise AttributeError()
-            method = getattr(self, methodname)
-            method()
-        except AttributeError:
-            self.pop(prefix + suffix)
+        if self.skipdepth:
+            # end of the skipped element itself
+            self.skipdepth = 0
+        else:
+            try:
+                if self.svgOK or endhandler is None:
+                    raise AttributeError()
+                endhandler(self)
+            except AttributeError:
+                self.pop(element)
+
+        # filter the entry as soon as its title and summary are known; the
+        # entry is a plain FeedParserDict here, so its keys are looked up
+        # without FeedParserDict's aliases
+        if self.entry_filter and self.inentry and not self.entryfiltered \
+                and element in ENTRY_FILTER_ELEMENTS:
+            entry = self.entries[-1]
+            if dict.__contains__(entry, 'title') and \
+                    dict.__contains__(entry, 'summary'):
+                self._filterEntry()
 
         # track inline content
         if self.incontent and not self.contentparams.get('type', u'xml').endswith(u'xml'):
@@ -690,9 +926,36 @@ class _FeedParserMixin:
         
         self.depth -= 1
 
+    def _dispatch(self, tag):
+        '''Returns the namespace prefix, element name and handlers of a tag
+
+        The prefix is the standard one for the tag's namespace followed by
+        '_', or '' for the default namespace.  The handlers are the
+        _start_ and _end_ methods of the element, as functions to be called
+        with the parser, or None if there are none.
+        '''
+        try:
+            return self.tagcache[tag]
+        except KeyError:
+            pass
+        if tag.find(':') <> -1:
+            prefix, suffix = tag.split(':', 1)
+        else:
+            prefix, suffix = '', tag
+        prefix = self.namespacemap.get(prefix, prefix)
+        if prefix:
+            prefix = prefix + '_'
+        element = prefix + suffix
+        # look the handlers up on the class, so that the cache does not
+        # tie the parser to itself through bound methods
+        starthandler = getattr(self.__class__, '_start_' + element, None)
+        endhandler = getattr(self.__class__, '_end_' + element, None)
+        dispatch = self.tagcache[tag] = (prefix, element, starthandler, endhandler)
+        return dispatch
+
     def handle_charref(self, ref):
         # called for each character reference, e.g. for '&#160;', ref will be '160'
-        if not self.elementstack:
+        if not self.elementstack or self.skipdepth:
             return
         ref = ref.lower()
         if ref in ('34', '38', '39', '60', '62', 'x22', 'x26', 'x27', 'x3c', 'x3e'):
@@ -707,7 +970,7 @@ class _FeedParserMixin:
 
     def handle_entityref(self, ref):
         # called for each entity reference, e.g. for '&copy;', ref will be 'copy'
-        if not self.elementstack:
+        if not self.elementstack or self.skipdepth:
             return
         if ref in ('lt', 'gt', 'quot', 'amp', 'apos'):
             text = '&%s;' % ref
@@ -727,9 +990,10 @@ class _FeedParserMixin:
     def handle_data(self, text, escape=1):
         # called for each block of plain text, i.e. outside of any tag and
         # not containing any character or entity references
-        if not self.elementstack:
+        if not self.elementstack or self.skipdepth:
             return
-        if escape and self.contentparams.get('type') == u'application/xhtml+xml':
+        # contentparams is empty outside of content
+        if escape and self.incontent and self.contentparams.get('type') == u'application/xhtml+xml':
             text = _xmlescape(text)
         self.elementstack[-1][2].append(text)
 
@@ -790,6 +1054,8 @@ class _FeedParserMixin:
             self.namespacesInUse[self._matchnamespaces[loweruri]] = uri
         else:
             self.namespacesInUse[prefix or ''] = uri
+        # tags may now map to other elements
+        self.tagcache.clear()
 
     def resolveURI(self, uri):
         return _urljoin(self.baseuri or u'', uri)
@@ -882,14 +1148,14 @@ class _FeedParserMixin:
 
         is_htmlish = self.mapContentType(self.contentparams.get('type', u'text/html')) in self.html_types
         # resolve relative URIs within embedded markup
-        if is_htmlish and RESOLVE_RELATIVE_URIS:
+        if is_htmlish and RESOLVE_RELATIVE_URIS and not self.lean:
             if element in self.can_contain_relative_uris:
-                output = _resolveRelativeURIs(output, self.baseuri, self.encoding, self.contentparams.get('type', u'text/html'))
+                output = _timed(self.timings, 'sanitize', _resolveRelativeURIs, output, self.baseuri, self.encoding, self.contentparams.get('type', u'text/html'))
 
         # parse microformats
         # (must do this before sanitizing because some microformats
         # rely on elements that we sanitize)
-        if PARSE_MICROFORMATS and is_htmlish and element in ['content', 'description', 'summary']:
+        if PARSE_MICROFORMATS and is_htmlish and not self.lean and element in ['content', 'description', 'summary']:
             mfresults = _parseMicroformats(output, self.baseuri, self.encoding)
             if mfresults:
                 for tag in mfresults.get('tags', []):
@@ -903,9 +1169,9 @@ class _FeedParserMixin:
                     self._getContext()['vcard'] = vcard
 
         # sanitize embedded markup
-        if is_htmlish and SANITIZE_HTML:
+        if is_htmlish and SANITIZE_HTML and not self.lean:
             if element in self.can_contain_dangerous_markup:
-                output = _sanitizeHTML(output, self.encoding, self.contentparams.get('type', u'text/html'))
+                output = _timed(self.timings, 'sanitize', _sanitizeHTML, output, self.encoding, self.contentparams.get('type', u'text/html'))
 
         if self.encoding and not isinstance(output, unicode):
             output = output.decode(self.encoding, 'ignore')
@@ -919,7 +1185,7 @@ class _FeedParserMixin:
                 pass
 
         # map win-1252 extensions to the proper code points
-        if isinstance(output, unicode):
+        if isinstance(output, unicode) and _cp1252_search(output):
             output = output.translate(_cp1252)
 
         # categories/tags/keywords/whatever are handled in _end_category
@@ -933,7 +1199,8 @@ class _FeedParserMixin:
         if self.inentry and not self.insource:
             if element == 'content':
                 self.entries[-1].setdefault(element, [])
-                contentparams = copy.deepcopy(self.contentparams)
+                # contentparams only holds strings, so a shallow copy will do
+                contentparams = FeedParserDict(self.contentparams)
                 contentparams['value'] = output
                 self.entries[-1][element].append(contentparams)
             elif element == 'link':
@@ -952,8 +1219,8 @@ class _FeedParserMixin:
                 if old_value_depth is None or self.depth <= old_value_depth:
                     self.property_depth_map[self.entries[-1]][element] = self.depth
                     self.entries[-1][element] = output
-                if self.incontent:
-                    contentparams = copy.deepcopy(self.contentparams)
+                if self.incontent and not self.lean:
+                    contentparams = FeedParserDict(self.contentparams)
                     contentparams['value'] = output
                     self.entries[-1][element + '_detail'] = contentparams
         elif (self.infeed or self.insource):# and (not self.intextinput) and (not self.inimage):
@@ -966,8 +1233,8 @@ class _FeedParserMixin:
                 output = re.sub("&([A-Za-z0-9_]+);", "&\g<1>", output)
                 context[element] = output
                 context['links'][-1]['href'] = output
-            elif self.incontent:
-                contentparams = copy.deepcopy(self.contentparams)
+            elif self.incontent and not self.lean:
+                contentparams = FeedParserDict(self.contentparams)
                 contentparams['value'] = output
                 context[element + '_detail'] = contentparams
         return output
@@ -1338,6 +1605,8 @@ class _FeedParserMixin:
         self.entries.append(FeedParserDict())
         self.push('item', 0)
         self.inentry = 1
+        self.entryfiltered = 0
+        self.entryrejected = 0
         self.guidislink = 0
         self.title_depth = -1
         id = self._getAttribute(attrsD, 'rdf:about')
@@ -1350,8 +1619,27 @@ class _FeedParserMixin:
     def _end_item(self):
         self.pop('item')
         self.inentry = 0
+        # nothing is set on the entry from here on
+        self.property_depth_map.pop(self.entries[-1], None)
+        if self.entry_filter:
+            if not self.entryfiltered:
+                self._filterEntry()
+            if self.entryrejected:
+                entry = self.entries[-1]
+                stub = FeedParserDict(
+                    [(k, dict.__getitem__(entry, k)) for k in ENTRY_STUB_KEYS
+                     if dict.__contains__(entry, k)])
+                stub['rejected'] = 1
+                self.entries[-1] = stub
+                self.entryrejected = 0
+        if self.compact:
+            self.entries[-1] = CompactEntry(self.entries[-1])
     _end_entry = _end_item
 
+    def _filterEntry(self):
+        self.entryfiltered = 1
+        self.entryrejected = not self.entry_filter(self.entries[-1])
+
     def _start_dc_language(self, attrsD):
         self.push('language', 1)
     _start_language = _start_dc_language
@@ -1376,7 +1664,7 @@ class _FeedParserMixin:
 
     def _end_published(self):
         value = self.pop('published')
-        self._save('published_parsed', _parse_date(value), overwrite=True)
+        self._save('published_parsed', _timed(self.timings, 'dates', _parse_date, value), overwrite=True)
     _end_dcterms_issued = _end_published
     _end_issued = _end_published
 
@@ -1390,7 +1678,7 @@ class _FeedParserMixin:
 
     def _end_updated(self):
         value = self.pop('updated')
-        parsed_value = _parse_date(value)
+        parsed_value = _timed(self.timings, 'dates', _parse_date, value)
         self._save('updated_parsed', parsed_value, overwrite=True)
     _end_modified = _end_updated
     _end_dcterms_modified = _end_updated
@@ -1404,14 +1692,14 @@ class _FeedParserMixin:
 
     def _end_created(self):
         value = self.pop('created')
-        self._save('created_parsed', _parse_date(value), overwrite=True)
+        self._save('created_parsed', _timed(self.timings, 'dates', _parse_date, value), overwrite=True)
     _end_dcterms_created = _end_created
 
     def _start_expirationdate(self, attrsD):
         self.push('expired', 1)
 
     def _end_expirationdate(self):
-        self._save('expired_parsed', _parse_date(self.pop('expired')), overwrite=True)
+        self._save('expired_parsed', _timed(self.timings, 'dates', _parse_date, self.pop('expired')), overwrite=True)
 
     def _start_cc_license(self, attrsD):
         context = self._getContext()
@@ -1738,6 +2026,15 @@ if _XML_AVAILABLE:
             self.bozo = 0
             self.exc = None
             self.decls = {}
+            # the tag names that SAX names map to, which only change when
+            # the namespaces in use do
+            self.startnames = {}
+            self.endnames = {}
+
+        def trackNamespace(self, prefix, uri):
+            _FeedParserMixin.trackNamespace(self, prefix, uri)
+            self.startnames.clear()
+            self.endnames.clear()
 
         def startPrefixMapping(self, prefix, uri):
             if not uri:
@@ -1749,6 +2046,29 @@ if _XML_AVAILABLE:
                 self.decls['xmlns:' + prefix] = uri
 
         def startElementNS(self, name, qname, attrs):
+            try:
+                localname, barename = self.startnames[name, qname]
+            except KeyError:
+                localname, barename = self.startnames[name, qname] = self._startName(name, qname)
+            attrsD, self.decls = self.decls, {}
+            namespace = name[0]
+            if barename=='math' and namespace=='http://www.w3.org/1998/Math/MathML':
+                attrsD['xmlns']=namespace
+            if barename=='svg' and namespace=='http://www.w3.org/2000/svg':
+                attrsD['xmlns']=namespace
+
+            for (namespace, attrlocalname), attrvalue in attrs.items():
+                lowernamespace = (namespace or '').lower()
+                prefix = self._matchnamespaces.get(lowernamespace, '')
+                if prefix:
+                    attrlocalname = prefix + ':' + attrlocalname
+                attrsD[str(attrlocalname).lower()] = attrvalue
+            for qname in attrs.getQNames():
+                attrsD[str(qname).lower()] = attrs.getValueByQName(qname)
+            self.unknown_starttag(localname, attrsD.items())
+
+        def _startName(self, name, qname):
+            '''Returns the tag name of an element that starts, with and without its prefix'''
             namespace, localname = name
             lowernamespace = str(namespace or '').lower()
             if lowernamespace.find(u'backend.userland.com/rss') <> -1:
@@ -1762,7 +2082,7 @@ if _XML_AVAILABLE:
             prefix = self._matchnamespaces.get(lowernamespace, givenprefix)
             if givenprefix and (prefix == None or (prefix == '' and lowernamespace == '')) and givenprefix not in self.namespacesInUse:
                     raise UndeclaredNamespace, "'%s' is not associated with a namespace" % givenprefix
-            localname = str(localname).lower()
+            localname = barename = str(localname).lower()
 
             # qname implementation is horribly broken in Python 2.1 (it
             # doesn't report any), and slightly broken in Python 2.2 (it
@@ -1771,12 +2091,6 @@ if _XML_AVAILABLE:
             # the qnames the SAX parser gives us (if indeed it gives us any
             # at all).  Thanks to MatejC for helping me test this and
             # tirelessly telling me that it didn't work yet.
-            attrsD, self.decls = self.decls, {}
-            if localname=='math' and namespace=='http://www.w3.org/1998/Math/MathML':
-                attrsD['xmlns']=namespace
-            if localname=='svg' and namespace=='http://www.w3.org/2000/svg':
-                attrsD['xmlns']=namespace
-
             if prefix:
                 localname = prefix.lower() + ':' + localname
             elif namespace and not qname: #Expat
@@ -1784,21 +2098,20 @@ if _XML_AVAILABLE:
                      if name and value == namespace:
                          localname = name + ':' + localname
                          break
-
-            for (namespace, attrlocalname), attrvalue in attrs.items():
-                lowernamespace = (namespace or '').lower()
-                prefix = self._matchnamespaces.get(lowernamespace, '')
-                if prefix:
-                    attrlocalname = prefix + ':' + attrlocalname
-                attrsD[str(attrlocalname).lower()] = attrvalue
-            for qname in attrs.getQNames():
-                attrsD[str(qname).lower()] = attrs.getValueByQName(qname)
-            self.unknown_starttag(localname, attrsD.items())
+            return localname, barename
 
         def characters(self, text):
             self.handle_data(text)
 
         def endElementNS(self, name, qname):
+            try:
+                localname = self.endnames[name, qname]
+            except KeyError:
+                localname = self.endnames[name, qname] = self._endName(name, qname)
+            self.unknown_endtag(localname)
+
+        def _endName(self, name, qname):
+            '''Returns the tag name of an element that ends'''
             namespace, localname = name
             lowernamespace = str(namespace or '').lower()
             if qname and qname.find(':') > 0:
@@ -1813,8 +2126,7 @@ if _XML_AVAILABLE:
                      if name and value == namespace:
                          localname = name + ':' + localname
                          break
-            localname = str(localname).lower()
-            self.unknown_endtag(localname)
+            return str(localname).lower()
 
         def error(self, exc):
             self.bozo = 1
@@ -2519,9 +2831,46 @@ class _RelativeURIResolver(_BaseHTMLProcessor):
         attrs = [(key, ((tag, key) in self.relative_uris) and self.resolveURI(value) or value) for key, value in attrs]
         _BaseHTMLProcessor.unknown_starttag(self, tag, attrs)
 
+# the character and entity references that a _BaseHTMLProcessor recognizes,
+# the way sgmllib does
+_reference_pattern = re.compile(r'&(?:#(\d+|[xX][0-9a-fA-F]+);|([a-zA-Z][-.a-zA-Z0-9]*)(?:;|(?=[^a-zA-Z0-9])))')
+
+def _reconstructReference(match):
+    ref = match.group(1)
+    if ref:
+        # same as _BaseHTMLProcessor.handle_charref
+        if ref.startswith('x'):
+            value = int(ref[1:], 16)
+        else:
+            value = int(ref)
+        if value in _cp1252:
+            return '&#%s;' % hex(ord(_cp1252[value]))[1:]
+        return '&#%s;' % ref
+    # same as _BaseHTMLProcessor.handle_entityref
+    ref = match.group(2)
+    if ref in name2codepoint or ref == 'apos':
+        return '&%s;' % ref
+    return '&amp;%s' % ref
+
+def _reconstructReferences(text):
+    '''Returns text without markup as a _BaseHTMLProcessor would output it
+
+    Text without a '<' holds no tags, comments or declarations, so all that a
+    _BaseHTMLProcessor changes in it are its character and entity
+    references; doing just that is much cheaper than an sgmllib parse.
+    '''
+    if '&' not in text:
+        return text
+    text = text.replace('&#39;', "'")
+    text = text.replace('&#34;', '"')
+    return _reference_pattern.sub(_reconstructReference, text)
+
 def _resolveRelativeURIs(htmlSource, baseURI, encoding, _type):
     if not _SGML_AVAILABLE:
         return htmlSource
+    # there are no URIs to resolve in text without markup
+    if '<' not in htmlSource:
+        return _reconstructReferences(htmlSource)
 
     p = _RelativeURIResolver(baseURI, encoding, _type)
     p.feed(htmlSource)
@@ -2805,6 +3154,10 @@ class _HTMLSanitizer(_BaseHTMLProcessor):
 def _sanitizeHTML(htmlSource, encoding, _type):
     if not _SGML_AVAILABLE:
         return htmlSource
+    # there is nothing to sanitize in text without markup
+    if '<' not in htmlSource and not TIDY_MARKUP:
+        data = _reconstructReferences(htmlSource)
+        return data.strip().replace('\r\n', '\n')
     p = _HTMLSanitizer(encoding, _type)
     htmlSource = htmlSource.replace('<![CDATA[', '&lt;![CDATA[')
     p.feed(htmlSource)
@@ -3009,12 +3362,9 @@ def _build_urllib2_request(url, agent, etag, modified, referrer, auth, request_h
         request.add_header('If-Modified-Since', '%s, %02d %s %04d %02d:%02d:%02d GMT' % (short_weekdays[modified[6]], modified[2], months[modified[1] - 1], modified[0], modified[3], modified[4], modified[5]))
     if referrer:
         request.add_header('Referer', referrer)
-    if gzip and zlib:
+    if zlib:
+        # zlib decompresses both, as they are read
         request.add_header('Accept-encoding', 'gzip, deflate')
-    elif gzip:
-        request.add_header('Accept-encoding', 'gzip')
-    elif zlib:
-        request.add_header('Accept-encoding', 'deflate')
     else:
         request.add_header('Accept-encoding', '')
     if auth:
@@ -3028,10 +3378,75 @@ def _build_urllib2_request(url, agent, etag, modified, referrer, auth, request_h
     request.add_header('A-IM', 'feed') # RFC 3229 support
     return request
 
+class _LRUCache:
+    '''A mapping that holds at most maxsize items and forgets the least
+    recently used item to make room for a new one'''
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        # each link is [previous link, next link, key, value]; the root
+        # link sits between the most and the least recently used items
+        self.links = {}
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+
+    def get(self, key, default=None):
+        self.lock.acquire()
+        try:
+            link = self.links.get(key)
+            if link is None:
+                return default
+            self._unlink(link)
+            self._append(link)
+            return link[3]
+        finally:
+            self.lock.release()
+
+    def __setitem__(self, key, value):
+        self.lock.acquire()
+        try:
+            link = self.links.get(key)
+            if link is not None:
+                self._unlink(link)
+            elif len(self.links) >= self.maxsize:
+                oldest = self.root[1]
+                self._unlink(oldest)
+                del self.links[oldest[2]]
+            link = [None, None, key, value]
+            self.links[key] = link
+            self._append(link)
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.links)
+
+    def _unlink(self, link):
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+
+    def _append(self, link):
+        last = self.root[0]
+        link[0] = last
+        link[1] = self.root
+        last[1] = link
+        self.root[0] = link
+
+# Feeds are fetched over and over and mostly repeat the dates of the previous
+# fetch, so recently parsed date strings are remembered.
+DATE_CACHE_SIZE = 2048
+_date_cache = _LRUCache(DATE_CACHE_SIZE)
+_not_cached = object()
+
 _date_handlers = []
 def registerDateHandler(func):
     '''Register a date handler function (takes string, returns 9-tuple date in GMT)'''
     _date_handlers.insert(0, func)
+    # dates parsed before may parse differently now
+    _date_cache.clear()
 
 # ISO-8601 date parsing routines written by Fazal Majid.
 # The ISO 8601 standard is very convoluted and irregular - a full ISO 8601
@@ -3439,10 +3854,50 @@ def _parse_date_perforce(aDateString):
         return time.gmtime(rfc822.mktime_tz(tm))
 registerDateHandler(_parse_date_perforce)
 
+# the number of date handlers defined above; if an application registers more,
+# _parse_date stops guessing the handler from the shape of the date string
+_builtin_date_handler_count = len(_date_handlers)
+
+# Nearly every feed dates its entries in either W3DTF (2012-03-29T17:00:12Z)
+# or RFC 822 (Thu, 29 Mar 2012 17:00:12 GMT).  Strings that look like one of
+# those go straight to its handler; none of the handlers tried before it in
+# _date_handlers can parse such a string anyway.
+_w3dtf_sniffer = re.compile(r'\d{4}-\d\d')
+_rfc822_sniffer = re.compile(r'(?:[A-Za-z]{3,9},? +)?\d\d? +[A-Za-z]{3,9} +\d')
+
+def _sniff_date_handler(dateString):
+    '''Return the handler a date string is most likely meant for, or None'''
+    if len(_date_handlers) != _builtin_date_handler_count:
+        return None
+    if dateString.find('/') != -1:
+        return None
+    if _w3dtf_sniffer.match(dateString):
+        return _parse_date_w3dtf
+    if _rfc822_sniffer.match(dateString):
+        return _parse_date_rfc822
+    return None
+
 def _parse_date(dateString):
     '''Parses a variety of date formats into a 9-tuple in GMT'''
     if not dateString:
         return None
+    date9tuple = _date_cache.get(dateString, _not_cached)
+    if date9tuple is not _not_cached:
+        return date9tuple
+    date9tuple = _parse_date_uncached(dateString)
+    _date_cache[dateString] = date9tuple
+    return date9tuple
+
+def _parse_date_uncached(dateString):
+    '''Parses a date with the sniffed handler first, then with all of them'''
+    handler = _sniff_date_handler(dateString)
+    if handler is not None:
+        try:
+            date9tuple = handler(dateString)
+        except (KeyError, OverflowError, ValueError):
+            date9tuple = None
+        if date9tuple and len(date9tuple) == 9:
+            return date9tuple
     for handler in _date_handlers:
         try:
             date9tuple = handler(dateString)
@@ -3455,6 +3910,20 @@ def _parse_date(dateString):
         return date9tuple
     return None
 
+# a multiple of 4 bytes, so that a UTF-32 sample ends on a character
+# boundary; a UTF-16 sample may still end inside a surrogate pair, which
+# _decodeSample leaves out
+_XML_DECLARATION_SAMPLE_SIZE = 1024
+
+def _decodeSample(xml_data, encoding):
+    '''Decodes the start of a document to utf-8
+
+    A character cut off at the end of the sample is left out rather than
+    making the whole sample fail to decode.
+    '''
+    decoder = codecs.getincrementaldecoder(encoding)()
+    return decoder.decode(xml_data).encode('utf-8')
+
 def _getCharacterEncoding(http_headers, xml_data):
     '''Get the character encoding of the XML document
 
@@ -3521,6 +3990,9 @@ def _getCharacterEncoding(http_headers, xml_data):
     xml_encoding = u''
     true_encoding = u''
     http_content_type, http_encoding = _parseHTTPContentType(http_headers.get('content-type'))
+    # the XML declaration is all we look for, so only the start of the
+    # document needs to be decoded
+    xml_data = xml_data[:_XML_DECLARATION_SAMPLE_SIZE]
     # Must sniff for non-ASCII-compatible character encodings before
     # searching for XML declaration.  This heuristic is defined in
     # section F of the XML specification:
@@ -3534,39 +4006,39 @@ def _getCharacterEncoding(http_headers, xml_data):
         elif xml_data[:4] == _l2bytes([0x00, 0x3c, 0x00, 0x3f]):
             # UTF-16BE
             sniffed_xml_encoding = u'utf-16be'
-            xml_data = unicode(xml_data, 'utf-16be').encode('utf-8')
+            xml_data = _decodeSample(xml_data, 'utf-16be')
         elif (len(xml_data) >= 4) and (xml_data[:2] == _l2bytes([0xfe, 0xff])) and (xml_data[2:4] != _l2bytes([0x00, 0x00])):
             # UTF-16BE with BOM
             sniffed_xml_encoding = u'utf-16be'
-            xml_data = unicode(xml_data[2:], 'utf-16be').encode('utf-8')
+            xml_data = _decodeSample(xml_data[2:], 'utf-16be')
         elif xml_data[:4] == _l2bytes([0x3c, 0x00, 0x3f, 0x00]):
             # UTF-16LE
             sniffed_xml_encoding = u'utf-16le'
-            xml_data = unicode(xml_data, 'utf-16le').encode('utf-8')
+            xml_data = _decodeSample(xml_data, 'utf-16le')
         elif (len(xml_data) >= 4) and (xml_data[:2] == _l2bytes([0xff, 0xfe])) and (xml_data[2:4] != _l2bytes([0x00, 0x00])):
             # UTF-16LE with BOM
             sniffed_xml_encoding = u'utf-16le'
-            xml_data = unicode(xml_data[2:], 'utf-16le').encode('utf-8')
+            xml_data = _decodeSample(xml_data[2:], 'utf-16le')
         elif xml_data[:4] == _l2bytes([0x00, 0x00, 0x00, 0x3c]):
             # UTF-32BE
             sniffed_xml_encoding = u'utf-32be'
-            xml_data = unicode(xml_data, 'utf-32be').encode('utf-8')
+            xml_data = _decodeSample(xml_data, 'utf-32be')
         elif xml_data[:4] == _l2bytes([0x3c, 0x00, 0x00, 0x00]):
             # UTF-32LE
             sniffed_xml_encoding = u'utf-32le'
-            xml_data = unicode(xml_data, 'utf-32le').encode('utf-8')
+            xml_data = _decodeSample(xml_data, 'utf-32le')
         elif xml_data[:4] == _l2bytes([0x00, 0x00, 0xfe, 0xff]):
             # UTF-32BE with BOM
             sniffed_xml_encoding = u'utf-32be'
-            xml_data = unicode(xml_data[4:], 'utf-32be').encode('utf-8')
+            xml_data = _decodeSample(xml_data[4:], 'utf-32be')
         elif xml_data[:4] == _l2bytes([0xff, 0xfe, 0x00, 0x00]):
             # UTF-32LE with BOM
             sniffed_xml_encoding = u'utf-32le'
-            xml_data = unicode(xml_data[4:], 'utf-32le').encode('utf-8')
+            xml_data = _decodeSample(xml_data[4:], 'utf-32le')
         elif xml_data[:3] == _l2bytes([0xef, 0xbb, 0xbf]):
             # UTF-8 with BOM
             sniffed_xml_encoding = u'utf-8'
-            xml_data = unicode(xml_data[3:], 'utf-8').encode('utf-8')
+            xml_data = xml_data[3:]
         else:
             # ASCII-compatible
             pass
@@ -3600,6 +4072,17 @@ def _getCharacterEncoding(http_headers, xml_data):
         true_encoding = u'gb18030'
     return true_encoding, http_encoding, xml_encoding, sniffed_xml_encoding, acceptable_content_type
 
+_xml_declaration = re.compile('<\\?xml[^>]*?>')
+
+def _isASCIICompatible(codec_name):
+    '''Return whether ASCII bytes mean ASCII characters in an encoding
+
+    codec_name is the name of the encoding as given by codecs.lookup
+    '''
+    return (codec_name in ('ascii', 'latin-1')
+            or codec_name.startswith('iso8859-')
+            or codec_name.startswith('cp125'))
+
 def _toUTF8(data, encoding):
     '''Changes an XML data stream on the fly to specify a new encoding
 
@@ -3622,15 +4105,74 @@ def _toUTF8(data, encoding):
     elif data[:4] == _l2bytes([0xff, 0xfe, 0x00, 0x00]):
         encoding = 'utf-32le'
         data = data[4:]
-    newdata = unicode(data, encoding)
-    declmatch = re.compile('^<\?xml[^>]*?>')
     newdecl = '''<?xml version='1.0' encoding='utf-8'?>'''
-    if declmatch.search(newdata):
-        newdata = declmatch.sub(newdecl, newdata)
+    # data that is already utf-8 only needs a new XML declaration; checking
+    # that it decodes is much cheaper than decoding and encoding it again
+    codec_name = codecs.lookup(encoding).name
+    if codec_name == 'utf-8':
+        # raises UnicodeDecodeError if the data is not utf-8 after all
+        unicode(data, 'utf-8')
+        is_utf8 = 1
+    elif _isASCIICompatible(codec_name):
+        try:
+            unicode(data, 'ascii')
+        except UnicodeDecodeError:
+            is_utf8 = 0
+        else:
+            is_utf8 = 1
+    else:
+        is_utf8 = 0
+    if is_utf8:
+        newdata = data
+        newdecl = _s2bytes(newdecl)
     else:
-        newdata = newdecl + u'\n' + newdata
+        newdata = unicode(data, encoding)
+    # match() rather than search(), which would try every position in the
+    # document when there is no declaration
+    declmatch = _xml_declaration.match(newdata)
+    if declmatch:
+        newdata = newdecl + newdata[declmatch.end():]
+    else:
+        newdata = newdecl + '\n' + newdata
+    if is_utf8:
+        return newdata
     return newdata.encode('utf-8')
 
+def _resolveEncoding(data, proposed_encodings):
+    '''Converts data to utf-8 from the first encoding that fits it
+
+    data is a raw string (not Unicode)
+    proposed_encodings are tried first, in order, skipping empty ones; then
+    chardet's guess, utf-8, windows-1252 and iso-8859-2
+
+    Returns (encoding, utf-8 data), or (None, data) if no encoding fits.
+    Each encoding is tried once; a wrong one usually fails early in the data,
+    so only the encoding that fits decodes the whole document.
+    '''
+    tried_encodings = []
+    def convert(encoding):
+        if (not encoding) or (encoding in tried_encodings):
+            return None
+        tried_encodings.append(encoding)
+        try:
+            return _toUTF8(data, encoding)
+        except (UnicodeDecodeError, LookupError):
+            return None
+    for proposed_encoding in proposed_encodings:
+        newdata = convert(proposed_encoding)
+        if newdata is not None:
+            return proposed_encoding, newdata
+    fallback_encodings = [u'utf-8', u'windows-1252', u'iso-8859-2']
+    if chardet:
+        # chardet is slow, and the start of a document is plenty to go by
+        guess = chardet.detect(data[:CHARDET_SAMPLE_SIZE])['encoding']
+        fallback_encodings.insert(0, guess)
+    for proposed_encoding in fallback_encodings:
+        newdata = convert(proposed_encoding)
+        if newdata is not None:
+            return proposed_encoding, newdata
+    return None, data
+
 def _stripDoctype(data):
     '''Strips DOCTYPE from XML document, returns (rss_version, stripped_data)
 
@@ -3663,11 +4205,339 @@ def _stripDoctype(data):
 
     return version, data, dict(replacement and [(k.decode('utf-8'), v.decode('utf-8')) for k, v in safe_pattern.findall(replacement)])
 
-def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, referrer=None, handlers=None, request_headers=None, response_headers=None):
+def _addTiming(timings, phase, seconds, count):
+    '''Adds to the time spent in a phase of parsing and the amount it handled'''
+    total, handled = timings.get(phase, (0.0, 0))
+    timings[phase] = (total + seconds, handled + count)
+
+def _timed(timings, phase, function, *args):
+    '''Calls function and adds the time it took to a phase of timings
+
+    Without timings, function is just called.  The count of the phase goes up
+    by the length of the result if it is a string, which makes it the number
+    of bytes or characters handled, and by one call otherwise.
+    '''
+    if timings is None:
+        return function(*args)
+    start = time.time()
+    output = function(*args)
+    if isinstance(output, basestring):
+        count = len(output)
+    else:
+        count = 1
+    _addTiming(timings, phase, time.time() - start, count)
+    return output
+
+class _GzipDecompressor:
+    '''Decompresses gzip data of one or more members, like GzipFile reads it
+
+    A zlib decompressor stops at the end of the first member and leaves the
+    rest in unused_data, so a new one is started on each following member.
+    Zero bytes padding the data after a member are ignored.
+    '''
+    def __init__(self):
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data, max_length=0):
+        output = self.decompressor.decompress(data, max_length)
+        while self.decompressor.unused_data and \
+                not (max_length and len(output) >= max_length):
+            data = self.decompressor.unused_data.lstrip(_s2bytes('\0'))
+            if not data:
+                break
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            output += self.decompressor.decompress(data, max_length and max_length - len(output))
+        return output
+
+    def flush(self):
+        return self.decompressor.flush()
+
+def _makeDecompressor(http_headers):
+    '''Returns a zlib decompressor for the Content-Encoding of a feed, or None'''
+    content_encoding = http_headers.get('content-encoding', '')
+    if not zlib:
+        return None
+    if 'gzip' in content_encoding:
+        return _GzipDecompressor()
+    if 'deflate' in content_encoding:
+        return zlib.decompressobj()
+    return None
+
+def _decompress(decompressor, chunk, decoded_size):
+    '''Decompresses the next chunk of a feed
+
+    decoded_size is the number of bytes the feed already decompressed to.
+    Raises FeedTooLarge as soon as the feed decompresses to more than
+    MAX_DECOMPRESSED_SIZE bytes, without decompressing the rest of chunk.
+    An empty chunk flushes the decompressor.
+    '''
+    if chunk:
+        output = decompressor.decompress(chunk, MAX_DECOMPRESSED_SIZE - decoded_size + 1)
+    else:
+        output = decompressor.flush()
+    if decoded_size + len(output) > MAX_DECOMPRESSED_SIZE:
+        raise FeedTooLarge('feed decompresses to more than %d bytes' % MAX_DECOMPRESSED_SIZE)
+    return output
+
+def _readFeed(f, data, decompressor, result, timings):
+    '''Reads the rest of a feed, decompressing it as it is read
+
+    data is what was already read of f.  Sets 'bytes_received' and
+    'bytes_decoded' in result to the size of the feed as it was read and
+    after decompression.  Returns the whole decompressed feed, or None with
+    bozo set if it could not be read or decompressed, or decompresses to
+    more than MAX_DECOMPRESSED_SIZE bytes.
+    '''
+    try:
+        if decompressor is None:
+            data += _timed(timings, 'fetch', f.read)
+            result['bytes_received'] = result['bytes_decoded'] = len(data)
+            return data
+        received = decoded = 0
+        parts = []
+        chunk = data
+        while 1:
+            received += len(chunk)
+            part = _timed(timings, 'decompress', _decompress, decompressor, chunk, decoded)
+            decoded += len(part)
+            parts.append(part)
+            if not chunk:
+                break
+            chunk = _timed(timings, 'fetch', f.read, STREAM_CHUNK_SIZE)
+    except Exception, e:
+        # IOError and socket errors can occur while reading, zlib.error if
+        # the data is damaged; some feeds claim to be compressed but they're
+        # not, so we get garbage
+        result['bozo'] = 1
+        result['bozo_exception'] = e
+        return None
+    result['bytes_received'] = received
+    result['bytes_decoded'] = decoded
+    return _s2bytes('').join(parts)
+
+def _makeStrictParser(baseuri, baselang, lean, entry_filter, compact, timings):
+    '''Returns a _StrictFeedParser and the SAX parser that drives it'''
+    feedparser = _StrictFeedParser(baseuri, baselang, 'utf-8')
+    feedparser.lean = lean
+    feedparser.entry_filter = entry_filter
+    feedparser.compact = compact
+    feedparser.timings = timings
+    saxparser = xml.sax.make_parser(PREFERRED_XML_PARSERS)
+    saxparser.setFeature(xml.sax.handler.feature_namespaces, 1)
+    try:
+        # disable downloading external doctype references, if possible
+        saxparser.setFeature(xml.sax.handler.feature_external_ges, 0)
+    except xml.sax.SAXNotSupportedException:
+        pass
+    saxparser.setContentHandler(feedparser)
+    saxparser.setErrorHandler(feedparser)
+    return feedparser, saxparser
+
+def _streamEncoding(hints):
+    '''Returns the encoding to stream a feed in, or None not to stream it
+
+    Feeds are only streamed when the last parse found the encoding and the
+    strict parser accepted the feed, and when the encoding is utf-8 or
+    ASCII-compatible, so that chunks can be converted one at a time.
+    '''
+    if not (_XML_AVAILABLE and zlib and hints.get('encoding')) or hints.get('loose'):
+        return None
+    try:
+        codec_name = codecs.lookup(hints['encoding']).name
+    except LookupError:
+        return None
+    if codec_name == 'utf-8' or _isASCIICompatible(codec_name):
+        return codec_name
+    return None
+
+def _parseStream(f, data, stream_encoding, http_headers, hints, result, baseuri, baselang, lean, entry_filter, compact, timings):
+    '''Parses a feed as it is read, in the encoding given by the hints
+
+    f is the open feed and data the first STREAM_CHUNK_SIZE bytes read from
+    it; the rest is read, decompressed, converted to utf-8 and fed to the
+    strict parser a chunk at a time, so that the whole document is never in
+    memory.
+
+    Returns None once the feed is parsed into result.  If the feed turns out
+    not to be in the hinted encoding, or the strict parser fails on it,
+    returns the whole raw feed so that it can be parsed the usual way; f is
+    rewound to get it if it can be, otherwise the raw chunks are kept for it,
+    up to MAX_STREAM_BUFFER bytes.  If the strict parser fails after that,
+    result gets what was parsed so far and the error as bozo_exception.
+
+    If timings is not None, the time spent reading, decompressing, converting
+    and parsing the chunks is added to it.
+    '''
+    decompressor = _makeDecompressor(http_headers)
+    sizes = {'received': 0, 'decoded': 0}
+    try:
+        start = f.tell() - len(data)
+        f.seek(start)
+        f.seek(start + len(data))
+        raw = None
+    except (AttributeError, IOError):
+        raw = [data]
+    # whether raw was dropped for growing past MAX_STREAM_BUFFER
+    state = {'dropped': 0}
+    def giveUp():
+        if raw is None:
+            f.seek(start)
+            return f.read()
+        return _s2bytes('').join(raw) + f.read()
+    def chunks():
+        # yields the decompressed feed, starting with data
+        chunk = data
+        while 1:
+            sizes['received'] += len(chunk)
+            if decompressor:
+                part = _timed(timings, 'decompress', _decompress, decompressor, chunk, sizes['decoded'])
+            else:
+                part = chunk
+            sizes['decoded'] += len(part)
+            yield part
+            if not chunk:
+                break
+            chunk = _timed(timings, 'fetch', f.read, STREAM_CHUNK_SIZE)
+            if raw is not None and not state['dropped']:
+                raw.append(chunk)
+
+    try:
+        body = chunks()
+        # the head of the feed runs up to its first element, so that it
+        # holds the XML declaration and the doctype
+        head = _s2bytes('')
+        for chunk in body:
+            head += chunk
+            if re.search(_s2bytes('<\w'), head):
+                break
+        declared_encoding, http_encoding, xml_encoding, sniffed_xml_encoding, acceptable_content_type = \
+            _getCharacterEncoding(http_headers, head)
+        if declared_encoding != hints.get('declared_encoding'):
+            return giveUp()
+        if head[:3] == _l2bytes([0xef, 0xbb, 0xbf]):
+            if stream_encoding != 'utf-8':
+                return giveUp()
+            head = head[3:]
+        elif sniffed_xml_encoding:
+            # a byte order mark or the shape of the first bytes say that the
+            # feed is in an encoding that is not ASCII-compatible
+            return giveUp()
+        version, head, entities = _stripDoctype(head)
+        declmatch = _xml_declaration.match(head)
+        newdecl = _s2bytes('''<?xml version='1.0' encoding='utf-8'?>''')
+        if declmatch:
+            head = newdecl + head[declmatch.end():]
+        else:
+            head = newdecl + _s2bytes('\n') + head
+
+        if stream_encoding == 'utf-8':
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            def toUTF8(chunk):
+                # raises UnicodeDecodeError if the chunk is not utf-8
+                decoder.decode(chunk)
+                return chunk
+        else:
+            def toUTF8(chunk):
+                try:
+                    unicode(chunk, 'ascii')
+                except UnicodeDecodeError:
+                    return unicode(chunk, stream_encoding).encode('utf-8')
+                return chunk
+        feedparser, saxparser = _makeStrictParser(baseuri, baselang, lean, entry_filter, compact, timings)
+        if not hasattr(saxparser, 'feed'):
+            return giveUp()
+        # parsing is timed apart, so that it counts entries rather than the
+        # chunks fed to the parser
+        feedtimings = None
+        if timings is not None:
+            feedtimings = {'parse': (0.0, 0)}
+        _timed(feedtimings, 'parse', saxparser.feed, _timed(timings, 'encoding', toUTF8, head))
+        for chunk in body:
+            _timed(feedtimings, 'parse', saxparser.feed, _timed(timings, 'encoding', toUTF8, chunk))
+            if raw is not None and not state['dropped'] and sizes['received'] > MAX_STREAM_BUFFER:
+                # the encoding is settled by now, and only a feed that is
+                # not well-formed would need the raw chunks again
+                del raw[:]
+                state['dropped'] = 1
+        if stream_encoding == 'utf-8':
+            decoder.decode(_s2bytes(''), True)
+        _timed(feedtimings, 'parse', saxparser.close)
+        failure = None
+    except (xml.sax.SAXParseException, UnicodeDecodeError, zlib.error, FeedTooLarge), failure:
+        if not state['dropped']:
+            return giveUp()
+    if timings is not None:
+        _addTiming(timings, 'parse', feedtimings['parse'][0], len(feedparser.entries))
+
+    if http_headers and (not acceptable_content_type):
+        if 'content-type' in http_headers:
+            bozo_message = '%s is not an XML media type' % http_headers['content-type']
+        else:
+            bozo_message = 'no Content-type specified'
+        result['bozo'] = 1
+        result['bozo_exception'] = NonXMLContentType(bozo_message)
+    result['encoding'] = declared_encoding
+    if hints['encoding'] != declared_encoding:
+        result['bozo'] = 1
+        result['bozo_exception'] = CharacterEncodingOverride( \
+            'document declared as %s, but parsed as %s' % \
+            (declared_encoding, hints['encoding']))
+        result['encoding'] = hints['encoding']
+    if failure is not None:
+        result['bozo'] = 1
+        result['bozo_exception'] = failure
+    result['feed'] = feedparser.feeddata
+    result['entries'] = feedparser.entries
+    result['version'] = version or feedparser.version
+    result['namespaces'] = feedparser.namespacesInUse
+    result['hints'] = {'encoding': hints['encoding'],
+                       'declared_encoding': declared_encoding,
+                       'loose': int(failure is not None)}
+    result['bytes_received'] = sizes['received']
+    result['bytes_decoded'] = sizes['decoded']
+    return None
+
+def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, referrer=None, handlers=None, request_headers=None, response_headers=None, lean=0, hints=None, entry_filter=None, compact=0, timings=0):
     '''Parse a feed from a URL, file, stream, or string.
 
     request_headers, if given, is a dict from http header name to value to add
     to the request; this overrides internally generated values.
+
+    lean, if true, only parses the elements in LEAN_ELEMENTS and leaves
+    embedded markup as it is, for callers that need little more than the
+    title, link, summary and dates of each entry.
+
+    hints, if given, is the 'hints' dict of the result of an earlier parse of
+    the same feed.  It holds the encoding the feed was parsed in
+    ('encoding'), which is tried first as long as the feed declares the same
+    encoding as before ('declared_encoding'), and whether the strict XML
+    parser failed on the feed ('loose'), in which case it is not tried.
+
+    entry_filter, if given, is called with each entry as soon as its title
+    and summary are known (or at its end, if it lacks either) and returns
+    whether to keep it.  The rest of a rejected entry is skipped, except for
+    the elements in ENTRY_STUB_ELEMENTS, and only the keys in ENTRY_STUB_KEYS
+    are kept of it, along with 'rejected'.
+
+    compact, if true, returns each entry as a CompactEntry instead of a
+    FeedParserDict, which takes less memory and is quicker to read from.
+
+    Feeds longer than STREAM_CHUNK_SIZE whose hints say that the strict
+    parser accepts them, in a utf-8 or ASCII-compatible encoding, are parsed
+    as they are read instead of being read into memory first.  Other feeds
+    are read into memory, but gzip- and deflate-compressed feeds are
+    decompressed as they are read, up to MAX_DECOMPRESSED_SIZE bytes.  Either
+    way, the result says how many bytes were read ('bytes_received') and how
+    many they decompressed to ('bytes_decoded').
+
+    timings, if true, adds a 'timings' dict to the result that maps each phase
+    of the parse that ran to the wall time it took in seconds and the amount
+    it handled: 'fetch' (bytes read), 'decompress' (bytes after
+    decompression), 'encoding' (bytes of utf-8), 'parse' (entries), and,
+    within 'parse', 'sanitize' (characters of sanitized markup) and 'dates'
+    (dates parsed).  A streamed feed is read, decompressed and converted a
+    chunk at a time between the calls to the parser, and each phase gets the
+    time of its own part.
     '''
 
     if handlers is None:
@@ -3676,21 +4546,36 @@ def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, refer
         request_headers = {}
     if response_headers is None:
         response_headers = {}
+    if hints is None:
+        hints = {}
+    stream_encoding = _streamEncoding(hints)
 
     result = FeedParserDict()
     result['feed'] = FeedParserDict()
     result['entries'] = []
     result['bozo'] = 0
+    if timings:
+        timings = result['timings'] = {}
+        start = time.time()
+    else:
+        timings = None
     if not isinstance(handlers, list):
         handlers = [handlers]
     try:
         f = _open_resource(url_file_stream_or_string, etag, modified, agent, referrer, handlers, request_headers)
-        data = f.read()
+        # the rest is read once the headers say how to decompress it
+        data = f.read(STREAM_CHUNK_SIZE)
+        if len(data) < STREAM_CHUNK_SIZE:
+            # that was all of it
+            stream_encoding = None
+        if timings is not None:
+            _addTiming(timings, 'fetch', time.time() - start, len(data))
     except Exception, e:
         result['bozo'] = 1
         result['bozo_exception'] = e
         data = None
         f = None
+        stream_encoding = None
 
     if hasattr(f, 'headers'):
         result['headers'] = dict(f.headers)
@@ -3706,29 +4591,6 @@ def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, refer
     else:
         http_headers = {}
 
-    # if feed is gzip-compressed, decompress it
-    if f and data and http_headers:
-        if gzip and 'gzip' in http_headers.get('content-encoding', ''):
-            try:
-                data = gzip.GzipFile(fileobj=_StringIO(data)).read()
-            except (IOError, struct.error), e:
-                # IOError can occur if the gzip header is bad
-                # struct.error can occur if the data is damaged
-                # Some feeds claim to be gzipped but they're not, so
-                # we get garbage.  Ideally, we should re-request the
-                # feed without the 'Accept-encoding: gzip' header,
-                # but we don't.
-                result['bozo'] = 1
-                result['bozo_exception'] = e
-                data = None
-        elif zlib and 'deflate' in http_headers.get('content-encoding', ''):
-            try:
-                data = zlib.decompress(data)
-            except zlib.error, e:
-                result['bozo'] = 1
-                result['bozo_exception'] = e
-                data = None
-
     # save HTTP headers
     if http_headers:
         if 'etag' in http_headers:
@@ -3750,12 +4612,35 @@ def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, refer
         result['status'] = 200
     if hasattr(f, 'status'):
         result['status'] = f.status
+
+    # ensure that baseuri is an absolute uri using an acceptable URI scheme
+    contentloc = http_headers.get('content-location', u'')
+    href = result.get('href', u'')
+    baseuri = _makeSafeAbsoluteURI(href, contentloc) or _makeSafeAbsoluteURI(contentloc) or href
+
+    baselang = http_headers.get('content-language', None)
+    if not isinstance(baselang, unicode) and baselang is not None:
+        baselang = baselang.decode('utf-8', 'ignore')
+
+    # parse the feed as it is read if the hints allow; this returns the whole
+    # feed, to be parsed below, if they turn out to be wrong
+    if stream_encoding and result.get('status', 0) != 304:
+        data = _parseStream(f, data, stream_encoding, http_headers, hints, result, baseuri, baselang, lean, entry_filter, compact, timings)
+
+    # read the rest of the feed, decompressing it as it is read if it is
+    # gzip- or deflate-compressed
+    if data is not None:
+        data = _readFeed(f, data, _makeDecompressor(http_headers), result, timings)
+
     if hasattr(f, 'close'):
         f.close()
 
     if data is None:
         return result
 
+    if timings is not None:
+        start = time.time()
+
     # there are four encodings to keep track of:
     # - http_encoding is the encoding declared in the Content-Type HTTP header
     # - xml_encoding is the encoding declared in the <?xml declaration
@@ -3771,17 +4656,7 @@ def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, refer
         result['bozo'] = 1
         result['bozo_exception'] = NonXMLContentType(bozo_message)
 
-    if data is not None:
-        result['version'], data, entities = _stripDoctype(data)
-
-    # ensure that baseuri is an absolute uri using an acceptable URI scheme
-    contentloc = http_headers.get('content-location', u'')
-    href = result.get('href', u'')
-    baseuri = _makeSafeAbsoluteURI(href, contentloc) or _makeSafeAbsoluteURI(contentloc) or href
-
-    baselang = http_headers.get('content-language', None)
-    if not isinstance(baselang, unicode) and baselang is not None:
-        baselang = baselang.decode('utf-8', 'ignore')
+    result['version'], data, entities = _stripDoctype(data)
 
     # if server sent 304, we're done
     if result.get('status', 0) == 304:
@@ -3790,70 +4665,16 @@ def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, refer
             'so the server sent no data.  This is a feature, not a bug!'
         return result
 
-    # if there was a problem downloading, we're done
-    if data is None:
-        return result
-
     # determine character encoding
-    use_strict_parser = 0
-    known_encoding = 0
-    tried_encodings = []
     # try: HTTP encoding, declared XML encoding, encoding sniffed from BOM
-    for proposed_encoding in (result['encoding'], xml_encoding, sniffed_xml_encoding):
-        if not proposed_encoding:
-            continue
-        if proposed_encoding in tried_encodings:
-            continue
-        tried_encodings.append(proposed_encoding)
-        try:
-            data = _toUTF8(data, proposed_encoding)
-        except (UnicodeDecodeError, LookupError):
-            pass
-        else:
-            known_encoding = use_strict_parser = 1
-            break
-    # if no luck and we have auto-detection library, try that
-    if (not known_encoding) and chardet:
-        proposed_encoding = chardet.detect(data)['encoding']
-        if proposed_encoding and (proposed_encoding not in tried_encodings):
-            tried_encodings.append(proposed_encoding)
-            try:
-                data = _toUTF8(data, proposed_encoding)
-            except (UnicodeDecodeError, LookupError):
-                pass
-            else:
-                known_encoding = use_strict_parser = 1
-    # if still no luck and we haven't tried utf-8 yet, try that
-    if (not known_encoding) and (u'utf-8' not in tried_encodings):
-        proposed_encoding = u'utf-8'
-        tried_encodings.append(proposed_encoding)
-        try:
-            data = _toUTF8(data, proposed_encoding)
-        except UnicodeDecodeError:
-            pass
-        else:
-            known_encoding = use_strict_parser = 1
-    # if still no luck and we haven't tried windows-1252 yet, try that
-    if (not known_encoding) and (u'windows-1252' not in tried_encodings):
-        proposed_encoding = u'windows-1252'
-        tried_encodings.append(proposed_encoding)
-        try:
-            data = _toUTF8(data, proposed_encoding)
-        except UnicodeDecodeError:
-            pass
-        else:
-            known_encoding = use_strict_parser = 1
-    # if still no luck and we haven't tried iso-8859-2 yet, try that.
-    if (not known_encoding) and (u'iso-8859-2' not in tried_encodings):
-        proposed_encoding = u'iso-8859-2'
-        tried_encodings.append(proposed_encoding)
-        try:
-            data = _toUTF8(data, proposed_encoding)
-        except UnicodeDecodeError:
-            pass
-        else:
-            known_encoding = use_strict_parser = 1
-    # if still no luck, give up
+    declared_encoding = result['encoding']
+    proposed_encodings = (declared_encoding, xml_encoding, sniffed_xml_encoding)
+    # unless the last parse found that these were wrong
+    if hints.get('encoding') and hints.get('declared_encoding') == declared_encoding:
+        proposed_encodings = (hints['encoding'],) + proposed_encodings
+    proposed_encoding, data = _resolveEncoding(data, proposed_encodings)
+    known_encoding = use_strict_parser = proposed_encoding is not None
+    # if nothing worked, give up
     if not known_encoding:
         result['bozo'] = 1
         result['bozo_exception'] = CharacterEncodingUnknown( \
@@ -3867,21 +4688,19 @@ def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, refer
             'document declared as %s, but parsed as %s' % \
             (result['encoding'], proposed_encoding))
         result['encoding'] = proposed_encoding
+    if timings is not None:
+        _addTiming(timings, 'encoding', time.time() - start, len(data))
+        start = time.time()
 
     if not _XML_AVAILABLE:
         use_strict_parser = 0
+    # the strict parser failed on this feed last time; don't bother
+    loose = hints.get('loose', 0)
+    if loose:
+        use_strict_parser = 0
     if use_strict_parser:
         # initialize the SAX parser
-        feedparser = _StrictFeedParser(baseuri, baselang, 'utf-8')
-        saxparser = xml.sax.make_parser(PREFERRED_XML_PARSERS)
-        saxparser.setFeature(xml.sax.handler.feature_namespaces, 1)
-        try:
-            # disable downloading external doctype references, if possible
-            saxparser.setFeature(xml.sax.handler.feature_external_ges, 0)
-        except xml.sax.SAXNotSupportedException:
-            pass
-        saxparser.setContentHandler(feedparser)
-        saxparser.setErrorHandler(feedparser)
+        feedparser, saxparser = _makeStrictParser(baseuri, baselang, lean, entry_filter, compact, timings)
         source = xml.sax.xmlreader.InputSource()
         source.setByteStream(_StringIO(data))
         try:
@@ -3890,11 +4709,22 @@ def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, refer
             result['bozo'] = 1
             result['bozo_exception'] = feedparser.exc or e
             use_strict_parser = 0
+            loose = 1
     if not use_strict_parser and _SGML_AVAILABLE:
         feedparser = _LooseFeedParser(baseuri, baselang, 'utf-8', entities)
+        feedparser.lean = lean
+        feedparser.entry_filter = entry_filter
+        feedparser.compact = compact
+        feedparser.timings = timings
         feedparser.feed(data.decode('utf-8', 'replace'))
+    if timings is not None:
+        _addTiming(timings, 'parse', time.time() - start, len(feedparser.entries))
     result['feed'] = feedparser.feeddata
     result['entries'] = feedparser.entries
     result['version'] = result['version'] or feedparser.version
     result['namespaces'] = feedparser.namespacesInUse
+    if known_encoding:
+        result['hints'] = {'encoding': proposed_encoding,
+                           'declared_encoding': declared_encoding,
+                           'loose': loose}
     return result
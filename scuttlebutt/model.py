@@ -5,26 +5,97 @@
 __author__ = ('momander@google.com (Martin Omander)',
               'shamjeff@google.com (Jeff Sham)')
 
+import hashlib
+import urlparse
 from google.appengine.ext import db
 
+# Ports that are implied by the URL scheme and dropped from canonical URLs.
+_DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
 
 class Feed(db.Model):
   """Represents an RSS Feed."""
   name = db.StringProperty()
   url = db.StringProperty()
-  monthly_visitors = db.IntegerProperty(indexed=False)
+  # Indexed for the projection query of RssService.Dispatch.
+  monthly_visitors = db.IntegerProperty()
+  # Validators from the last response, sent back on the next fetch so the
+  # server can answer 304 Not Modified.
+  etag = db.StringProperty(indexed=False)
+  last_modified = db.StringProperty(indexed=False)
+  fetch_count = db.IntegerProperty(default=0, indexed=False)
+  not_modified_count = db.IntegerProperty(default=0, indexed=False)
+  # Bytes of all fetched responses as they were received and after
+  # decompression; the difference is the bandwidth compression saved.
+  bytes_received = db.IntegerProperty(default=0, indexed=False)
+  bytes_decoded = db.IntegerProperty(default=0, indexed=False)
+  # Where url redirected to and over how many hops, maintained by RssService.
+  # The feed is fetched from redirect_url instead of url as long as url is
+  # still redirect_from, until redirect_expires_at, or for good if the
+  # redirects were all permanent and it is None.
+  redirect_from = db.StringProperty(indexed=False)
+  redirect_url = db.StringProperty(indexed=False)
+  redirect_hops = db.IntegerProperty(default=0, indexed=False)
+  redirect_expires_at = db.DateTimeProperty(indexed=False)
+  redirects_avoided = db.IntegerProperty(default=0, indexed=False)
+  # Fingerprints of the entries in the last fetch, and of the topics they were
+  # matched against. Entries whose fingerprint is unchanged are skipped.
+  entry_fingerprints = db.StringListProperty(indexed=False)
+  topics_fingerprint = db.StringProperty(indexed=False)
+  # The date and link of the newest entry processed. Entries are expected
+  # newest first, so older entries are not looked at again unless
+  # scan_all_entries is set.
+  high_water_updated = db.DateTimeProperty(indexed=False)
+  high_water_link = db.StringProperty(indexed=False)
+  scan_all_entries = db.BooleanProperty(default=False, indexed=False)
+  # What the last parse found out about the feed, passed back to feedparser as
+  # hints: the encoding that worked, the encoding the feed declared, and
+  # whether the strict XML parser failed on it.
+  parse_encoding = db.StringProperty(indexed=False)
+  declared_encoding = db.StringProperty(indexed=False)
+  parse_loose = db.BooleanProperty(default=False, indexed=False)
+  # Moving averages of the seconds each phase of fetching and parsing the feed
+  # takes, maintained by RssService. timing_seconds[i] is the average for
+  # timing_phases[i].
+  timing_phases = db.StringListProperty(indexed=False)
+  timing_seconds = db.ListProperty(float, indexed=False)
+  # Failed fetches in a row and the last failure. Failing feeds are backed
+  # off by FeedScheduler, and suspended feeds are not fetched until resumed.
+  failure_count = db.IntegerProperty(default=0, indexed=False)
+  last_failure = db.StringProperty(indexed=False)
+  suspended = db.BooleanProperty(default=False)
+  # Fetch schedule, maintained by FeedScheduler. New feeds are due at once.
+  publish_rate = db.FloatProperty(indexed=False)
+  fetch_interval = db.IntegerProperty(indexed=False)
+  last_fetched_at = db.DateTimeProperty(indexed=False)
+  next_fetch_at = db.DateTimeProperty(auto_now_add=True)
 
   @property
   def articles(self):
     """Get articles for that feed."""
     return Article.gql('WHERE feeds = :1', self.key())
 
+  @property
+  def host(self):
+    """The lower-cased host the feed is fetched from."""
+    return urlparse.urlsplit(self.url or '')[1].lower()
+
   def ToDict(self):
     """Returns a dictionary representation of the object."""
     d = {}
     d['name'] = self.name
     d['url'] = self.url
     d['monthlyVisitors'] = self.monthly_visitors
+    d['fetchCount'] = self.fetch_count
+    d['notModifiedCount'] = self.not_modified_count
+    d['bytesReceived'] = self.bytes_received
+    d['bytesDecoded'] = self.bytes_decoded
+    d['redirectUrl'] = self.redirect_url
+    d['redirectsAvoided'] = self.redirects_avoided
+    d['failureCount'] = self.failure_count
+    d['lastFailure'] = self.last_failure
+    d['suspended'] = self.suspended
+    d['timings'] = dict(zip(self.timing_phases, self.timing_seconds))
     d['id'] = int(self.key().id())
     return d
 
@@ -51,8 +122,12 @@ class Topic(db.Model):
 
 
 class Article(db.Model):
-  """Represents an article extracted from a feed."""
-  url = db.StringProperty()
+  """Represents an article extracted from a feed.
+
+  Articles are keyed by a hash of their canonicalized URL (see KeyNameForUrl),
+  so looking up the article for a URL is a key get rather than a query.
+  """
+  url = db.StringProperty(indexed=False)
   title = db.StringProperty()
   potential_readers = db.IntegerProperty()
   summary = db.TextProperty(indexed=False)
@@ -60,13 +135,55 @@ class Article(db.Model):
   topics = db.ListProperty(db.Key)
   feeds = db.ListProperty(db.Key)
 
+  @staticmethod
+  def CanonicalizeUrl(url):
+    """Returns a canonical form of url, used to identify articles.
+
+    The scheme and host are lower-cased, default ports and fragments are
+    dropped and an empty path is replaced by '/'.
+
+    Args:
+      url: str The URL of an article.
+
+    Returns:
+      The canonical URL.
+    """
+    scheme, netloc, path, query, _ = urlparse.urlsplit(url.strip())
+    scheme = scheme.lower()
+    netloc = netloc.lower()
+    if ':' in netloc:
+      host, port = netloc.rsplit(':', 1)
+      if _DEFAULT_PORTS.get(scheme) == port:
+        netloc = host
+    return urlparse.urlunsplit((scheme, netloc, path or '/', query, ''))
+
+  @classmethod
+  def KeyNameForUrl(cls, url):
+    """Returns the key name of the article for url.
+
+    Args:
+      url: str The URL of an article.
+
+    Returns:
+      A key name derived from a hash of the canonicalized URL.
+    """
+    canonical_url = cls.CanonicalizeUrl(url)
+    if isinstance(canonical_url, unicode):
+      canonical_url = canonical_url.encode('utf-8')
+    return 'url:' + hashlib.sha1(canonical_url).hexdigest()
+
+  @classmethod
+  def KeyForUrl(cls, url):
+    """Returns the key of the article for url."""
+    return db.Key.from_path(cls.kind(), cls.KeyNameForUrl(url))
+
   def ToDict(self):
     """Returns a dictionary representation of the object."""
     d = {}
     d['url'] = self.url
     d['title'] = self.title
     d['updated'] = self.updated.isoformat()
-    d['id'] = int(self.key().id())
+    d['id'] = self.key().id_or_name()
     d['readership'] = self.potential_readers
     d['source_id'] = int(self.feeds[0].id())
     return d
@@ -158,6 +158,36 @@ class TopicsHandler(webapp.RequestHandler):
     self.response.out.write(memcache.get(CACHE_KEY))
 
 
+class FetchScheduleHandler(webapp.RequestHandler):
+  """Handler class to report how often feeds are fetched."""
+
+  def get(self):
+    s = ScuttlebuttService()
+    CACHE_KEY = 'fetch_schedule'
+    if not memcache.get(CACHE_KEY):
+      logging.info('Populating cache.')
+      result = s.GetFetchSchedule()
+      memcache.add(CACHE_KEY, simplejson.dumps(result), 600)
+    logging.info('Using cache.')
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.out.write(memcache.get(CACHE_KEY))
+
+
+class LoadProfileHandler(webapp.RequestHandler):
+  """Handler class to report how fetches are spread over each dispatch."""
+
+  def get(self):
+    s = ScuttlebuttService()
+    CACHE_KEY = 'load_profile'
+    if not memcache.get(CACHE_KEY):
+      logging.info('Populating cache.')
+      result = s.GetLoadProfile()
+      memcache.add(CACHE_KEY, simplejson.dumps(result), 600)
+    logging.info('Using cache.')
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.out.write(memcache.get(CACHE_KEY))
+
+
 def main():
   """Initiates main application."""
   application = webapp.WSGIApplication([
@@ -166,6 +196,8 @@ def main():
       ('/api/topics', AllTopicsHandler),
       ('/api/sources', SourcesHandler),
       ('/api/topic_stats/(\d+)/?', TopicsHandler),
+      ('/api/fetch_schedule', FetchScheduleHandler),
+      ('/api/load_profile', LoadProfileHandler),
   ], debug=True)
   util.run_wsgi_app(application)
 
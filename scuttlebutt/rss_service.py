@@ -3,7 +3,7 @@
 """Defines the RssService class used to fetch feeds.
 
   Use the dispatch method to queue up a set of download tasks.
-  Use the download method to fetch and store articles from a feed.
+  Use the download method to fetch and store articles from a batch of feeds.
 """
 
 __author__ = ('momander@google.com (Martin Omander)',
@@ -11,66 +11,675 @@ __author__ = ('momander@google.com (Martin Omander)',
 
 from datetime import datetime
 from datetime import timedelta
+import hashlib
 import logging
-import string
 from StringIO import StringIO
+import time
 from time import mktime
 import feedparser
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 from google.appengine.ext import db
+import feed_fetcher
+from feed_fetcher import FeedFetcher
+import feed_scheduler
+from feed_scheduler import FeedScheduler
 from model import Article
 from model import Feed
 from model import Topic
+from topic_matcher import TopicMatcher
+
+# The datastore allows at most this many entity groups in a cross-group
+# transaction.
+_MAX_TRANSACTION_GROUPS = 25
+_XG_TRANSACTION = db.create_transaction_options(xg=True)
+# The number of feeds fetched concurrently by one download task.
+DEFAULT_BATCH_SIZE = 10
+# The number of feeds dispatch reads at a time.
+DISPATCH_PAGE_SIZE = 1000
+# The feed properties dispatch reads: the host, the priority tier and whether
+# the feed is suspended. They must all be indexed, see index.yaml.
+DISPATCH_PROPERTIES = ('url', 'monthly_visitors', 'suspended')
+# Seconds a dispatch request may spend before handing over to a continuation
+# task, well within the request deadline.
+DISPATCH_TIME_BUDGET = 20
+# Weight of the newest fetch in the moving averages of the time each phase of
+# fetching and parsing a feed takes.
+TIMING_WEIGHT = 0.3
+# How long a feed is fetched from where a temporary redirect sent it.
+TEMPORARY_REDIRECT_TTL = timedelta(days=1)
+# Seconds a dispatched feed is leased for, unless its download finishes
+# first. Later dispatches skip leased feeds.
+DISPATCH_LEASE_TIME = 3600
+_LEASE_KEY_PREFIX = 'dispatch_lease:'
+# Memcache counter of the redirect hops downloads avoided since the last
+# dispatch, see _ReportRedirectsAvoided.
+_REDIRECTS_AVOIDED_KEY = 'redirects_avoided'
+
+
+class _MatchCache(object):
+  """Remembers the topics of the entries let through while a feed is parsed.
+
+  Filter is passed to the parser as the entry filter, and the cache is then
+  used in place of the TopicMatcher, so that the entries that mention a topic
+  are not matched a second time.
+  """
+
+  def __init__(self, matcher):
+    """Initialize the cache.
+
+    Args:
+      matcher: TopicMatcher The matcher for all topics.
+    """
+    self.matcher = matcher
+    self.fingerprint = matcher.fingerprint
+    # Maps the (title, summary) of each entry let through to its topics.
+    self.topics = {}
+
+  def Filter(self, entry):
+    """Returns whether an entry mentions any topic, remembering the topics."""
+    texts = (entry.get('title', u''), entry.get('summary', u''))
+    topics = self.matcher.Match(*texts)
+    if topics:
+      self.topics[texts] = topics
+    return bool(topics)
+
+  def Match(self, *texts):
+    """Finds the topics mentioned in texts, like TopicMatcher.Match."""
+    topics = self.topics.get(texts)
+    if topics is None:
+      topics = self.matcher.Match(*texts)
+    return topics
+
+  def Clear(self):
+    """Forgets the entries seen so far, once their feed is processed."""
+    self.topics.clear()
 
 
 class RssService(object):
   """This class does download and dispatch of tasks for feed fetching."""
 
-  def __init__(self, taskqueue=None):
+  def __init__(self, taskqueue=None, fetcher=None):
     """Initialize the service."""
     self.taskqueue = taskqueue
+    self.fetcher = fetcher or FeedFetcher()
+    self.scheduler = FeedScheduler()
+
+  def Dispatch(self, batch_size=DEFAULT_BATCH_SIZE, now=None, cursor=None,
+               spread=False):
+    """Creates download tasks for the feeds that are due to be fetched.
 
-  def Dispatch(self):
-    """Creates a download task for each feed in the datastore."""
-    for feed in Feed.all():
-      self.taskqueue.Download(feed.key().id())
+    Feeds that are backing off after failed fetches are not due until the
+    backoff is over, and suspended feeds are skipped. Dispatched feeds are
+    leased until their download finishes, so that a feed whose download task
+    is still waiting in the queue is not dispatched again.
 
-  def Download(self, feed_id):
-    """Creates a download task for each feed in the datastore.
+    A new dispatch, as opposed to a continuation, first logs the redirect
+    hops that downloads avoided since the previous one.
+
+    Due feeds are scanned a page at a time with a projection query, which
+    reads only the properties dispatch needs from the index rather than whole
+    feeds, and the download tasks for a page are enqueued together. If the
+    scan takes longer than DISPATCH_TIME_BUDGET, the rest is left to a
+    continuation task, so the time a dispatch request takes does not grow
+    with the number of feeds. Within a page, feeds are grouped by host, so
+    that feeds from the same host are fetched together by the same task.
+
+    The download tasks of each feed go to the queue of its priority tier, see
+    FeedScheduler.Tier, and the busiest tiers are enqueued first.
+
+    With spread, the download task of each feed is delayed by the feed's
+    offset within the dispatch interval, see FeedScheduler.DispatchOffset.
+    Feeds from the same host share an offset, so they still share tasks.
+    The fetches and writes of a dispatch are then spread evenly over the
+    interval rather than all starting at once, and each feed keeps being
+    fetched in the same minute of the interval. The next fetch is still
+    scheduled from the time of the dispatch, so the offset and the time the
+    task waited do not add up from one fetch to the next.
 
     Args:
-      feed_id: str The id for the feed to fetch.
+      batch_size: int The number of feeds each download task fetches.
+      now: datetime Current point in time, defaults to the current time.
+      cursor: str Cursor where a previous dispatch request stopped.
+      spread: bool Whether to spread the fetches over the dispatch interval.
     """
-    feed = Feed.get_by_id(feed_id)
-    feed_content = feedparser.parse(feed.url)
-    found_articles = False
-    for topic in Topic.all():
-      for entry in feed_content['entries']:
-        found_articles = True
-        if (self._Match(entry['title'], topic.name) or
-            self._Match(entry['summary'], topic.name)):
-          # Create a new Article, or update existing one.
-          a = None
-          articles = Article.all().filter('url = ', entry['link']).fetch(1)
-          if articles:
-            a = articles[0]
-          else:
-            a = Article()
-          # Tie the article to the feed it was downloaded from.
-          if feed.key() not in a.feeds:
-            a.feeds.append(feed.key())
-          if topic.key() not in a.topics:
-            a.topics.append(topic.key())
-          # Set other article properties, and save it.
-          a.url = entry['link']
-          a.title = entry['title']
-          a.summary = entry['summary']
-          a.potential_readers = feed.monthly_visitors
-          a.updated = datetime.fromtimestamp(mktime(entry['updated_parsed']))
-          a.put()
-          logging.info('Saved article with title %s.', a.title)
-    if not found_articles:
+    start = time.time()
+    now = (now or datetime.now()).replace(microsecond=0)
+    if not cursor:
+      self._ReportRedirectsAvoided()
+    tiers = list(feed_scheduler.PRIORITY_TIERS)
+    query = Feed.all(projection=DISPATCH_PROPERTIES).filter(
+        'next_fetch_at <=', now)
+    if cursor:
+      query.with_cursor(cursor)
+    while True:
+      feeds = query.fetch(DISPATCH_PAGE_SIZE)
+      groups = {}
+      for feed in self._Lease([feed for feed in feeds if not feed.suspended]):
+        offset = 0
+        if spread:
+          offset = self.scheduler.DispatchOffset(feed)
+        tier = tiers.index(self.scheduler.Tier(feed))
+        groups.setdefault((offset, tier), []).append(feed)
+      try:
+        for offset, tier in sorted(groups):
+          self.taskqueue.Download(
+              self._Batches(groups[(offset, tier)], batch_size), offset * 60,
+              tiers[tier].queue, now)
+          del groups[(offset, tier)]
+      finally:
+        # Feeds whose download task could not be enqueued are due for the
+        # next dispatch.
+        for group in groups.values():
+          self._Release(group)
+      if len(feeds) < DISPATCH_PAGE_SIZE:
+        return
+      query.with_cursor(query.cursor())
+      if time.time() - start >= DISPATCH_TIME_BUDGET:
+        logging.info('Continuing dispatch in a new task.')
+        self.taskqueue.Dispatch(batch_size, now, query.cursor(), spread)
+        return
+
+  def _ReportRedirectsAvoided(self):
+    """Logs and resets the redirect hops avoided since the last dispatch.
+
+    Download tasks add up the hops in a memcache counter, so that the figure
+    covers all downloads between two dispatches. The counter is decremented
+    rather than deleted, so that hops added meanwhile are not lost.
+
+    Returns:
+      The number of hops avoided, or None if the counter is missing.
+    """
+    avoided = memcache.get(_REDIRECTS_AVOIDED_KEY)
+    if avoided is None:
+      return None
+    logging.info('Avoided %d redirect hops since the last dispatch.', avoided)
+    if avoided:
+      memcache.decr(_REDIRECTS_AVOIDED_KEY, avoided)
+    return avoided
+
+  def _Lease(self, feeds):
+    """Leases the feeds that are not leased yet and returns them.
+
+    The leases live in memcache. If memcache is unavailable or evicts a
+    lease, a feed may be dispatched twice, and Download skips the fetch that
+    is no longer due.
+
+    Args:
+      feeds: list The feeds about to be dispatched.
+
+    Returns:
+      The feeds that were leased, in the same order.
+    """
+    keys = [str(feed.key().id()) for feed in feeds]
+    leased = memcache.get_multi(keys, key_prefix=_LEASE_KEY_PREFIX)
+    feeds = [feed for feed, key in zip(feeds, keys) if key not in leased]
+    memcache.set_multi(dict((str(feed.key().id()), 1) for feed in feeds),
+                       time=DISPATCH_LEASE_TIME, key_prefix=_LEASE_KEY_PREFIX)
+    return feeds
+
+  def _Release(self, feeds):
+    """Releases the leases of feeds, see _Lease."""
+    memcache.delete_multi([str(feed.key().id()) for feed in feeds],
+                          key_prefix=_LEASE_KEY_PREFIX)
+
+  def _Batches(self, feeds, batch_size):
+    """Returns the feed ids of feeds in batches, grouped by host."""
+    feeds = sorted(feeds, key=lambda feed: feed.host)
+    feed_ids = [feed.key().id() for feed in feeds]
+    return [feed_ids[i:i + batch_size]
+            for i in range(0, len(feed_ids), batch_size)]
+
+  def Download(self, feed_ids, dispatched_at=None):
+    """Fetches feeds and stores the articles that mention any topic.
+
+    The feeds are fetched concurrently, and each feed is processed as soon as
+    it arrives. Feeds that fail to fetch or are not feeds are backed off, see
+    _FetchFailure. An error while processing a fetched feed is our own bug
+    rather than the feed's, so it is logged and raised, and the task is
+    retried, without counting against the feed.
+
+    Feeds that are no longer due at the time of the dispatch were fetched
+    since, by another download task, and are skipped. That task holds their
+    dispatch leases, so only the leases of the feeds this task fetches are
+    released, once it is done or has failed.
+
+    Args:
+      feed_ids: list The ids of the feeds to fetch.
+      dispatched_at: datetime The time of the dispatch that queued the
+          download, which the next fetches are scheduled from. None to
+          schedule them from the time of the fetch.
+    """
+    feeds = [feed for feed in Feed.get_by_id(feed_ids)
+             if feed and not (dispatched_at and
+                              feed.next_fetch_at > dispatched_at)]
+    try:
+      # Entries that mention no topic are cut short while the feed is
+      # parsed.
+      matcher = _MatchCache(TopicMatcher(Topic.all()))
+      redirects_avoided = 0
+      for feed, feed_content in self.fetcher.FetchAll(feeds, matcher.Filter,
+                                                      matcher.fingerprint):
+        redirects_avoided += feed_content.get('redirects_avoided', 0)
+        try:
+          self._ProcessFeed(feed, feed_content, matcher, dispatched_at)
+        except Exception:
+          logging.exception('Failed to process feed %s.', feed.url)
+          raise
+        matcher.Clear()
+      if redirects_avoided:
+        memcache.incr(_REDIRECTS_AVOIDED_KEY, redirects_avoided,
+                      initial_value=0)
+    finally:
+      self._Release(feeds)
+
+  def _ProcessFeed(self, feed, feed_content, matcher, dispatched_at=None):
+    """Stores the articles of a fetched feed that mention any topic.
+
+    The feed is fetched with a conditional GET, and nothing but its schedule
+    is updated if the server reports that it has not changed since the last
+    download. Otherwise processing is a collect-then-write pipeline: all new
+    and edited entries are matched against the topics first, the existing
+    articles for the matches are then looked up in bulk, and all new and
+    updated articles are written in batches.
+
+    Args:
+      feed: Feed The feed that was fetched.
+      feed_content: dict The parsed feed.
+      matcher: _MatchCache The matcher for all topics.
+      dispatched_at: datetime The time of the dispatch that queued the
+          download, or None.
+    """
+    now = datetime.now()
+    feed.fetch_count += 1
+    feed.bytes_received += feed_content.get('bytes_received', 0)
+    feed.bytes_decoded += feed_content.get('bytes_decoded', 0)
+    self._RecordTimings(feed, feed_content.get('timings'))
+    avoided = feed_content.get('redirects_avoided', 0)
+    feed.redirects_avoided += avoided
+    failure = self._FetchFailure(feed_content)
+    if failure:
+      # Where the feed redirected to before no longer works, and where it
+      # redirects to now is not worth remembering.
+      if avoided:
+        self._ForgetRedirect(feed)
+      self._BackOff(feed, now, failure,
+                    gone=feed_content.get('status') == 410)
+      feed.put()
+      return
+    self._RememberRedirects(feed, feed_content, now)
+    if feed_content.get('status') == 304:
+      logging.info('Feed %s not modified since last fetch.', feed.url)
+      feed.not_modified_count += 1
+      self.scheduler.Reschedule(feed, [], now, dispatched_at)
+      feed.put()
+      return
+    entries = feed_content['entries']
+    if not entries:
       logging.warn('Found no articles!')
+    # Entries that were already matched against the same topics are skipped:
+    # those at or below the feed's high-water mark without even looking at
+    # them, and those that are unchanged since the last download. Entries
+    # that mention no topic were rejected by the parser, which only kept
+    # their link and dates.
+    seen = set()
+    recent_entries = entries
+    if feed.topics_fingerprint == matcher.fingerprint:
+      seen = set(feed.entry_fingerprints)
+      recent_entries = self._EntriesAboveHighWaterMark(feed, entries)
+    recent_entries = [entry for entry in recent_entries
+                      if not entry.get('rejected')]
+    fingerprints = [self._EntryFingerprint(entry) for entry in recent_entries]
+    changed_entries = [entry for entry, fingerprint
+                       in zip(recent_entries, fingerprints)
+                       if fingerprint not in seen]
+    logging.info('Skipped %d unchanged or unmatched entries.',
+                 len(entries) - len(changed_entries))
+    matches = self._MatchEntries(changed_entries, matcher)
+    self._StoreArticles(feed, matches)
+    # Only remember what was fetched once the articles are stored, or a retry
+    # of a failed download would skip them.
+    feed.etag = feed_content.get('etag')
+    feed.last_modified = feed_content.get('modified')
+    hints = feed_content.get('hints')
+    if hints:
+      feed.parse_encoding = hints['encoding']
+      feed.declared_encoding = hints['declared_encoding']
+      feed.parse_loose = bool(hints['loose'])
+    feed.entry_fingerprints = fingerprints
+    feed.topics_fingerprint = matcher.fingerprint
+    self._RaiseHighWaterMark(feed, entries)
+    self.scheduler.Reschedule(feed, entries, now, dispatched_at)
+    feed.put()
+
+  def _FetchFailure(self, feed_content):
+    """Returns why fetching a feed failed, or None if it did not fail.
+
+    A fetch fails if the server returns an error status, if the feed could
+    not be downloaded, or if what was downloaded is not a feed.
+
+    Args:
+      feed_content: dict The parsed feed.
+    """
+    status = feed_content.get('status')
+    if status == 304:
+      return None
+    if status >= 400:
+      return 'HTTP status %d' % status
+    if not feed_content.get('version') and not feed_content.get('entries'):
+      return str(feed_content.get('bozo_exception') or 'Not a feed')
+    return None
+
+  def _BackOff(self, feed, now, failure, gone=False):
+    """Records why a feed failed and puts off its next fetch.
+
+    Args:
+      feed: Feed The feed that failed. It is updated but not saved.
+      now: datetime The time of the fetch.
+      failure: str Why the feed failed.
+      gone: bool Whether the server said the feed is gone for good.
+    """
+    # A string property holds at most 500 characters.
+    feed.last_failure = failure[:500]
+    self.scheduler.Backoff(feed, now, gone=gone)
+    if feed.suspended:
+      logging.warn('Suspended feed %s: %s', feed.url, failure)
+    else:
+      logging.warn('Backing off feed %s until %s: %s', feed.url,
+                   feed.next_fetch_at, failure)
+
+  def _RememberRedirects(self, feed, feed_content, now):
+    """Remembers where a feed redirected to, so later fetches go there.
+
+    A redirect is remembered for good if all the hops to where the feed was
+    fetched from were permanent, and for TEMPORARY_REDIRECT_TTL otherwise.
+    If the feed was fetched from its own URL and did not redirect, the
+    redirect is forgotten. Only called for fetches that did not fail.
+
+    Args:
+      feed: Feed The feed that was fetched. It is updated but not saved.
+      feed_content: dict The parsed feed, with the redirects followed and
+          avoided as returned by FeedFetcher.
+      now: datetime The time of the fetch.
+    """
+    if 'redirects' not in feed_content:
+      return
+    redirects = feed_content['redirects']
+    avoided = feed_content.get('redirects_avoided', 0)
+    if redirects:
+      permanent = not avoided or feed.redirect_expires_at is None
+      for code in redirects:
+        if code not in feed_fetcher.PERMANENT_REDIRECT_CODES:
+          permanent = False
+      feed.redirect_from = feed.url
+      feed.redirect_url = feed_content['href']
+      feed.redirect_hops = avoided + len(redirects)
+      feed.redirect_expires_at = None
+      if not permanent:
+        feed.redirect_expires_at = now + TEMPORARY_REDIRECT_TTL
+      logging.info('Feed %s redirects to %s.', feed.url, feed.redirect_url)
+    elif not avoided:
+      self._ForgetRedirect(feed)
+
+  def _ForgetRedirect(self, feed):
+    """Makes later fetches of a feed start from its own URL again.
+
+    Args:
+      feed: Feed The feed. It is updated but not saved.
+    """
+    feed.redirect_from = None
+    feed.redirect_url = None
+    feed.redirect_hops = 0
+    feed.redirect_expires_at = None
+
+  def _RecordTimings(self, feed, timings):
+    """Logs how long each phase of fetching and parsing a feed took.
+
+    The times are also folded into the feed's moving averages, so that the
+    feeds whose downloads are slow, and the phase that makes them slow, can
+    be found later.
+
+    Args:
+      feed: Feed The feed that was fetched. It is updated but not saved.
+      timings: dict Maps each phase to its seconds and the amount of data it
+          handled, as returned by feedparser.parse. None if not recorded.
+    """
+    if not timings:
+      return
+    phases = sorted(timings)
+    logging.info('Timings for %s: %s', feed.url, ', '.join(
+        '%s %.1f ms (%d)' % (phase, timings[phase][0] * 1000,
+                             timings[phase][1]) for phase in phases))
+    averages = dict(zip(feed.timing_phases, feed.timing_seconds))
+    for phase in phases:
+      seconds = timings[phase][0]
+      if phase in averages:
+        seconds = (TIMING_WEIGHT * seconds +
+                   (1 - TIMING_WEIGHT) * averages[phase])
+      averages[phase] = seconds
+    feed.timing_phases = sorted(averages)
+    feed.timing_seconds = [averages[phase] for phase in feed.timing_phases]
+
+  def _EntriesAboveHighWaterMark(self, feed, entries):
+    """Returns the entries that are newer than the feed's high-water mark.
+
+    Entries are expected newest first, and processing stops at the first entry
+    that is older than the mark, or is the entry that set it. Feeds that have
+    scan_all_entries set, or whose entries are not sorted by date, are always
+    processed in full.
+
+    Args:
+      feed: Feed The feed that was fetched.
+      entries: list The entries of the parsed feed.
+
+    Returns:
+      The leading entries that have not been processed before.
+    """
+    if feed.scan_all_entries or feed.high_water_updated is None:
+      return entries
+    dates = [self._EntryUpdated(entry) for entry in entries]
+    if None in dates or dates != sorted(dates, reverse=True):
+      logging.info('Entries of feed %s are not sorted by date.', feed.url)
+      return entries
+    for i, (entry, updated) in enumerate(zip(entries, dates)):
+      if (updated < feed.high_water_updated or
+          (updated == feed.high_water_updated and
+           entry.get('link') == feed.high_water_link)):
+        return entries[:i]
+    return entries
+
+  def _RaiseHighWaterMark(self, feed, entries):
+    """Moves the feed's high-water mark to its newest entry.
+
+    Args:
+      feed: Feed The feed that was fetched. It is updated but not saved.
+      entries: list The entries of the parsed feed.
+    """
+    for entry in entries:
+      updated = self._EntryUpdated(entry)
+      if updated and (feed.high_water_updated is None or
+                      updated > feed.high_water_updated):
+        feed.high_water_updated = updated
+        feed.high_water_link = entry.get('link')
+
+  def _EntryUpdated(self, entry):
+    """Returns the updated time of an entry as a datetime, or None."""
+    if not entry.get('updated_parsed'):
+      return None
+    return datetime.fromtimestamp(mktime(entry['updated_parsed']))
+
+  def _EntryFingerprint(self, entry):
+    """Returns a compact hash of the parts of an entry that are stored.
+
+    Args:
+      entry: dict An entry of a parsed feed.
+
+    Returns:
+      A 16 character hex string.
+    """
+    parts = [entry.get(field) or u'' for field in
+             ('link', 'title', 'summary', 'updated')]
+    return hashlib.md5(u'\0'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+  def _MatchEntries(self, entries, matcher):
+    """Finds the topics mentioned by each feed entry.
+
+    Args:
+      entries: list The entries of a parsed feed.
+      matcher: TopicMatcher The matcher for all topics, or a _MatchCache.
+
+    Returns:
+      A list of (entry, topics) tuples for the entries that mention at least
+      one topic. An article listed more than once in the feed, possibly under
+      differently spelled URLs, is returned once with the topics of all its
+      occurrences. Entries without a link cannot be stored and are left out.
+    """
+    matches = []
+    matches_by_key_name = {}
+    for entry in entries:
+      if not entry.get('link', u''):
+        continue
+      topics = matcher.Match(entry.get('title', u''),
+                             entry.get('summary', u''))
+      if not topics:
+        continue
+      key_name = Article.KeyNameForUrl(entry['link'])
+      if key_name in matches_by_key_name:
+        index = matches_by_key_name[key_name]
+        topics = matches[index][1] + [t for t in topics
+                                      if t not in matches[index][1]]
+        matches[index] = (entry, topics)
+      else:
+        matches_by_key_name[key_name] = len(matches)
+        matches.append((entry, topics))
+    return matches
+
+  def _StoreArticles(self, feed, matches):
+    """Creates or updates the articles for matched entries in batches.
+
+    Articles are keyed by their URL, so each batch is a single get and a single
+    put inside a cross-group transaction. Two tasks storing the same article
+    at the same time therefore can neither create duplicates nor lose each
+    other's topics and feeds.
+
+    Args:
+      feed: Feed The feed the entries were downloaded from.
+      matches: list The (entry, topics) tuples returned by _MatchEntries.
+    """
+    for i in range(0, len(matches), _MAX_TRANSACTION_GROUPS):
+      articles = db.run_in_transaction_options(
+          _XG_TRANSACTION, self._UpsertArticles, feed,
+          matches[i:i + _MAX_TRANSACTION_GROUPS])
+      for a in articles:
+        logging.info('Saved article with title %s.', a.title)
+
+  def _UpsertArticles(self, feed, matches):
+    """Creates or updates the articles for matched entries.
+
+    Must be run in a transaction spanning the articles' entity groups.
+
+    Args:
+      feed: Feed The feed the entries were downloaded from.
+      matches: list The (entry, topics) tuples to store.
+
+    Returns:
+      The list of stored articles.
+    """
+    keys = [Article.KeyForUrl(entry['link']) for entry, _ in matches]
+    articles = []
+    for key, existing, (entry, topics) in zip(keys, db.get(keys), matches):
+      # Create a new Article, or update existing one.
+      a = existing or Article(key_name=key.name())
+      # Tie the article to the feed it was downloaded from.
+      if feed.key() not in a.feeds:
+        a.feeds.append(feed.key())
+      for topic in topics:
+        if topic.key() not in a.topics:
+          a.topics.append(topic.key())
+      # Set other article properties.
+      a.url = entry['link']
+      a.title = entry.get('title', u'')
+      a.summary = entry.get('summary', u'')
+      a.potential_readers = feed.monthly_visitors
+      a.updated = self._EntryUpdated(entry)
+      articles.append(a)
+    db.put(articles)
+    return articles
+
+  def MigrateArticleKeys(self, cursor=None, batch_size=100):
+    """Rekeys one batch of articles stored with datastore assigned ids.
+
+    Each article is merged into the article keyed by its URL, which is created
+    if needed, and the old article is deleted. Running a batch twice is
+    harmless, so the migration can simply be restarted if a task fails.
+
+    Args:
+      cursor: str Cursor where the previous batch ended, or None to start.
+      batch_size: int The number of articles to examine.
+
+    Returns:
+      The cursor for the next batch, or None if all articles were examined.
+    """
+    query = Article.all()
+    if cursor:
+      query.with_cursor(cursor)
+    batch = query.fetch(batch_size)
+    old_articles = [a for a in batch if a.key().name() is None and a.url]
+    for i in range(0, len(old_articles), _MAX_TRANSACTION_GROUPS):
+      db.run_in_transaction_options(
+          _XG_TRANSACTION, self._MergeArticles,
+          old_articles[i:i + _MAX_TRANSACTION_GROUPS])
+      db.delete(old_articles[i:i + _MAX_TRANSACTION_GROUPS])
+    logging.info('Rekeyed %d of %d articles.', len(old_articles), len(batch))
+    if len(batch) < batch_size:
+      return None
+    return query.cursor()
+
+  def UpgradeFeeds(self, cursor=None, batch_size=100):
+    """Rewrites one batch of feeds with the current Feed model.
+
+    Properties added to Feed since a feed was stored get their default values
+    written and indexed, which makes the feed visible to queries on them.
+
+    Args:
+      cursor: str Cursor where the previous batch ended, or None to start.
+      batch_size: int The number of feeds to rewrite.
+
+    Returns:
+      The cursor for the next batch, or None if all feeds were rewritten.
+    """
+    query = Feed.all()
+    if cursor:
+      query.with_cursor(cursor)
+    batch = query.fetch(batch_size)
+    db.put(batch)
+    logging.info('Upgraded %d feeds.', len(batch))
+    if len(batch) < batch_size:
+      return None
+    return query.cursor()
+
+  def _MergeArticles(self, old_articles):
+    """Merges articles into the articles keyed by their URLs.
+
+    Must be run in a transaction spanning the URL keyed articles' entity
+    groups.
+
+    Args:
+      old_articles: list Articles stored with datastore assigned ids.
+    """
+    merged = {}
+    for old in old_articles:
+      key = Article.KeyForUrl(old.url)
+      a = merged.get(key) or db.get(key)
+      if a is None:
+        a = Article(key_name=key.name(), url=old.url, title=old.title,
+                    summary=old.summary, updated=old.updated,
+                    potential_readers=old.potential_readers)
+      a.feeds.extend([k for k in old.feeds if k not in a.feeds])
+      a.topics.extend([k for k in old.topics if k not in a.topics])
+      a.potential_readers = max(a.potential_readers, old.potential_readers)
+      merged[key] = a
+    db.put(merged.values())
 
   def ComputeTopicStats(self, now):
     """Fetch aggregated stats for all topics.
@@ -100,15 +709,3 @@ class RssService(object):
                                          last_weeks_count)) / last_weeks_count
 
       topic.put()
-
-  def _Match(self, text, search_term):
-    """Looks for match of search_term in text.
-
-    Args:
-      text: str The text to find match in.
-      search_term: str The string to match.
-
-    Returns:
-      True if a match is found.
-    """
-    return string.find(text.upper(), search_term.upper()) > -1
@@ -8,6 +8,7 @@ __author__ = ('momander@google.com (Martin Omander)',
 import datetime
 import logging
 from google.appengine.api import memcache
+from feed_scheduler import FeedScheduler
 from model import Article
 from model import Feed
 from model import Topic
@@ -118,6 +119,55 @@ class ScuttlebuttService(object):
         articles_list, key=lambda a: a['readership'], reverse=True)
     return articles_list[offset : offset+limit]
 
+  def GetFetchSchedule(self):
+    """Gets the number of feed fetches per day under the current schedule.
+
+    Returns:
+      A dictionary comparing the fetches per day with fixed hourly polling,
+      see FeedScheduler.DailyFetches.
+    """
+    return FeedScheduler().DailyFetches(Feed.all())
+
+  def GetLoadProfile(self):
+    """Gets how spread dispatch spreads the fetches over the dispatch interval.
+
+    Returns:
+      A dictionary with the fetches per day started in each minute of the
+      dispatch interval, see FeedScheduler.LoadProfile.
+    """
+    return FeedScheduler().LoadProfile(
+        Feed.all().filter('suspended =', False))
+
+  def GetSuspendedFeeds(self):
+    """Gets the feeds that are no longer fetched because they failed.
+
+    Returns:
+      A list of dictionary representations of the suspended feeds, with the
+      number of failures in a row and the last failure.
+    """
+    return [feed.ToDict() for feed
+            in Feed.all().filter('suspended =', True).order('name')]
+
+  def ResumeFeed(self, feed_id, now):
+    """Makes a suspended feed due for fetching again.
+
+    Args:
+      feed_id: int The id of the feed to resume.
+      now: datetime The current time.
+
+    Returns:
+      The resumed feed.
+
+    Raises:
+      Exception if there is no feed with the id.
+    """
+    feed = Feed.get_by_id(feed_id)
+    if not feed:
+      raise Exception('No feed with id %d.' % feed_id)
+    FeedScheduler().Resume(feed, now)
+    feed.put()
+    return feed
+
   def GetDailyTopicStats(self, topic_id, today):
     """Gets the daily aggregated article count.
 
@@ -7,27 +7,80 @@ __author__ = ('momander@google.com (Martin Omander)',
 
 import datetime
 import logging
+from time import mktime
 from google.appengine.api import taskqueue
 from google.appengine.ext import db
 from google.appengine.ext import webapp
 from google.appengine.ext.db import Error
 from google.appengine.ext.webapp import util
+import helpers
 from model import Article
+from rss_service import DEFAULT_BATCH_SIZE
 from rss_service import RssService
+from scuttlebutt_service import ScuttlebuttService
+import simplejson
 
 
 class TaskQueueWrapper(object):
   """Wrapper around the app engine task queue."""
 
-  def Download(self, feed_id):
-    """Puts a download task into the task queue.
+  def Download(self, feed_id_batches, countdown=0, queue_name='download',
+               dispatched_at=None):
+    """Puts download tasks into the task queue, with few RPCs.
 
     Args:
-      feed_id: str The id of the feed to fetch.
+      feed_id_batches: list The lists of feed ids for each task to fetch.
+      countdown: int Seconds to wait before running the tasks.
+      queue_name: str The queue to put the tasks in.
+      dispatched_at: datetime The time of the dispatch, which the next
+          fetches of the feeds are scheduled from.
     """
-    url = '/task/download?feedId=%s' % feed_id
-    # Use the default queue.
-    taskqueue.add(url=url, method='GET', queue_name='download')
+    tasks = []
+    for feed_ids in feed_id_batches:
+      url = '/task/download?feedIds=%s' % ','.join(map(str, feed_ids))
+      if dispatched_at:
+        url += '&dispatchedAt=%d' % mktime(dispatched_at.timetuple())
+      tasks.append(taskqueue.Task(url=url, method='GET', countdown=countdown))
+    queue = taskqueue.Queue(queue_name)
+    for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+      queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+
+  def Dispatch(self, batch_size, now, cursor, spread=False):
+    """Puts a task to continue a dispatch into the task queue.
+
+    Args:
+      batch_size: int The number of feeds each download task fetches.
+      now: datetime The point in time the dispatch started at.
+      cursor: str The cursor where the dispatch continues.
+      spread: bool Whether the dispatch spreads the fetches over the dispatch
+          interval.
+    """
+    params = {
+        'batchSize': batch_size,
+        'now': int(mktime(now.timetuple())),
+        'cursor': cursor,
+    }
+    if spread:
+      params['spread'] = 1
+    taskqueue.add(url='/task/dispatch', params=params, method='GET')
+
+  def MigrateArticleKeys(self, cursor):
+    """Puts a task to rekey the next batch of articles into the task queue.
+
+    Args:
+      cursor: str The cursor where the next batch starts.
+    """
+    taskqueue.add(url='/task/migrate_article_keys', params={'cursor': cursor},
+                  method='GET')
+
+  def UpgradeFeeds(self, cursor):
+    """Puts a task to rewrite the next batch of feeds into the task queue.
+
+    Args:
+      cursor: str The cursor where the next batch starts.
+    """
+    taskqueue.add(url='/task/upgrade_feeds', params={'cursor': cursor},
+                  method='GET')
 
 
 class DispatchHandler(webapp.RequestHandler):
@@ -36,18 +89,32 @@ class DispatchHandler(webapp.RequestHandler):
   def get(self):
     """Handle HTTP Get to schedule download tasks."""
     s = RssService(TaskQueueWrapper())
-    s.Dispatch()
+    batch_size = helpers.GetIntParam(self.request, 'batchSize',
+                                     default=DEFAULT_BATCH_SIZE)
+    # Continuation tasks carry the time the dispatch started at, so that all
+    # pages are read with the same query.
+    now = None
+    if self.request.get('now'):
+      now = datetime.datetime.fromtimestamp(int(self.request.get('now')))
+    s.Dispatch(batch_size, now, self.request.get('cursor') or None,
+               bool(self.request.get('spread')))
     self.response.out.write('Dispatched.')
 
 
 class DownloadHandler(webapp.RequestHandler):
-  """Handler class for fetching of a single feed."""
+  """Handler class for fetching a batch of feeds."""
 
   def get(self):
-    """Handle HTTP Get to download a feed."""
+    """Handle HTTP Get to download feeds."""
     s = RssService()
-    feed_id = int(self.request.get('feedId'))
-    s.Download(feed_id)
+    # Tasks queued before feeds were batched have a single feedId.
+    feed_ids = self.request.get('feedIds') or self.request.get('feedId')
+    dispatched_at = None
+    if self.request.get('dispatchedAt'):
+      dispatched_at = datetime.datetime.fromtimestamp(
+          int(self.request.get('dispatchedAt')))
+    s.Download([int(feed_id) for feed_id in feed_ids.split(',')],
+               dispatched_at)
     self.response.out.write('Downloaded.')
 
 
@@ -70,6 +137,63 @@ class DeleteArticlesHandler(webapp.RequestHandler):
       article.delete()
 
 
+class UpgradeFeedsHandler(webapp.RequestHandler):
+  """Handler class to rewrite all feeds with the current Feed model.
+
+  Properties added to Feed since a feed was stored get their default values
+  written and indexed, which makes the feed visible to queries on them. One
+  batch of feeds is rewritten per task.
+  """
+
+  def get(self):
+    """Handle HTTP Get to rewrite a batch of feeds."""
+    s = RssService(TaskQueueWrapper())
+    cursor = s.UpgradeFeeds(self.request.get('cursor') or None)
+    if cursor:
+      s.taskqueue.UpgradeFeeds(cursor)
+    self.response.headers['Content-Type'] = 'text/plain'
+    self.response.out.write(cursor and 'Upgraded batch.' or 'Upgrade done.')
+
+
+class MigrateArticleKeysHandler(webapp.RequestHandler):
+  """Handler class to rekey articles by their URLs, one batch per task."""
+
+  def get(self):
+    """Handle HTTP Get to rekey a batch of articles."""
+    s = RssService(TaskQueueWrapper())
+    cursor = s.MigrateArticleKeys(self.request.get('cursor') or None)
+    if cursor:
+      s.taskqueue.MigrateArticleKeys(cursor)
+    self.response.headers['Content-Type'] = 'text/plain'
+    self.response.out.write(cursor and 'Migrated batch.' or 'Migration done.')
+
+
+class SuspendedFeedsHandler(webapp.RequestHandler):
+  """Handler class to list the feeds that were suspended after failures."""
+
+  def get(self):
+    """Handle HTTP Get to list suspended feeds as JSON."""
+    s = ScuttlebuttService()
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.out.write(simplejson.dumps(s.GetSuspendedFeeds()))
+
+
+class ResumeFeedHandler(webapp.RequestHandler):
+  """Handler class to fetch a suspended feed again."""
+
+  def get(self):
+    """Handle HTTP Get to resume the feed given by feedId."""
+    s = ScuttlebuttService()
+    feed_id = helpers.GetIntParam(self.request, 'feedId')
+    self.response.headers['Content-Type'] = 'text/plain'
+    try:
+      feed = s.ResumeFeed(feed_id, datetime.datetime.now())
+      self.response.out.write('Resumed feed %s.' % feed.url)
+    except Exception, e:
+      self.response.set_status(404)
+      self.response.out.write(str(e))
+
+
 class SetReadershipForAllArticlesHandler(webapp.RequestHandler):
   """Handler class to set readership for articles."""
 
@@ -77,8 +201,8 @@ class SetReadershipForAllArticlesHandler(webapp.RequestHandler):
     """Handle HTTP Get set readership for articles."""
     jobs_dispatched = 0
     for article in Article.all():
-      url = '/task/set_article_readerhip?article_id=%s' % article.key().id()
-      taskqueue.add(url=url, method='GET')
+      taskqueue.add(url='/task/set_article_readership',
+                    params={'article_key': str(article.key())}, method='GET')
       jobs_dispatched += 1
     self.response.headers['Content-Type'] = 'text/plain'
     self.response.out.write(
@@ -90,8 +214,8 @@ class SetArticleReadershipHandler(webapp.RequestHandler):
 
   def get(self):
     """Handle HTTP Get set readership for an article."""
-    article_id = int(self.request.get('article_id'))
-    article = Article.get_by_id(article_id)
+    article_key = self.request.get('article_key')
+    article = Article.get(article_key)
     max_visitors = 0
     for feed_key in article.feeds:
       try:
@@ -104,7 +228,7 @@ class SetArticleReadershipHandler(webapp.RequestHandler):
     article.put()
     self.response.headers['Content-Type'] = 'text/plain'
     self.response.out.write(
-        'Set potential_readers=%s for article %s' % (max_visitors, article_id))
+        'Set potential_readers=%s for article %s' % (max_visitors, article_key))
 
 
 def main():
@@ -114,6 +238,10 @@ def main():
       ('/task/download', DownloadHandler),
       ('/task/compute_stats', ComputeStatsHandler),
       ('/task/delete_articles', DeleteArticlesHandler),
+      ('/task/migrate_article_keys', MigrateArticleKeysHandler),
+      ('/task/upgrade_feeds', UpgradeFeedsHandler),
+      ('/task/suspended_feeds', SuspendedFeedsHandler),
+      ('/task/resume_feed', ResumeFeedHandler),
       ('/task/set_readership_for_all_articles',
        SetReadershipForAllArticlesHandler),
       ('/task/set_article_readership', SetArticleReadershipHandler),
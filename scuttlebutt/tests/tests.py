@@ -6,16 +6,30 @@ __author__ = ('momander@google.com (Martin Omander)',
               'shamjeff@google.com (Jeff Sham)')
 
 import datetime
+import gzip
+from StringIO import StringIO
 import unittest
+import xml.sax
+import zlib
+import feed_fetcher
+from feed_fetcher import FeedFetcher
+import feed_scheduler
+from feed_scheduler import FeedScheduler
 import feedparser
+from google.appengine.api import taskqueue as taskqueue_api
+from google.appengine.api import urlfetch
+from google.appengine.datastore import datastore_stub_util
 from google.appengine.ext import testbed
 import helpers
 from model import Article
 from model import Feed
 from model import Topic
+import rss_service
 from rss_service import RssService
 import pymock
 from scuttlebutt_service import ScuttlebuttService
+import topic_matcher
+from topic_matcher import TopicMatcher
 
 
 class RssServiceTests(pymock.PyMockTestCase):
@@ -25,10 +39,13 @@ class RssServiceTests(pymock.PyMockTestCase):
     """Set up for App Engine service stubs and PyMock."""
     super(RssServiceTests, self).setUp()
 
-    # Create test bed and service stubs.
+    # Create test bed and service stubs. Articles are stored in cross-group
+    # transactions, which need the High Replication datastore.
     self.testbed = testbed.Testbed()
     self.testbed.activate()
-    self.testbed.init_datastore_v3_stub()
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+    self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+    self.testbed.init_memcache_stub()
     self.testbed.init_urlfetch_stub()
 
   def tearDown(self):
@@ -46,17 +63,279 @@ class RssServiceTests(pymock.PyMockTestCase):
     f2.name = 'USA Today'
     f2.url = 'http://usatoday.com/rss.xml'
     f2.put()
+    # New feeds are due at once.
+    NOW = datetime.datetime.now() + datetime.timedelta(seconds=1)
     taskqueue = self.mock()
     # Set expectations.
-    taskqueue.Download(f1.key().id())
-    taskqueue.Download(f2.key().id())
+    taskqueue.Download([[f1.key().id(), f2.key().id()]], 0, 'download',
+                       NOW.replace(microsecond=0))
     # Run test.
     self.replay()
     s = RssService(taskqueue)
-    s.Dispatch()
+    s.Dispatch(now=NOW)
     # Validate.
     self.verify()
 
+  def testDispatchInBatches(self):
+    """Test that RssService puts batch_size feeds in each task."""
+    feed_ids = []
+    for i in range(3):
+      f = Feed()
+      f.name = 'Feed %d' % i
+      f.url = 'http://google.com/rss%d.xml' % i
+      f.put()
+      feed_ids.append(f.key().id())
+    NOW = datetime.datetime.now() + datetime.timedelta(seconds=1)
+    taskqueue = self.mock()
+    # Set expectations.
+    taskqueue.Download([feed_ids[:2], feed_ids[2:]], 0, 'download',
+                       NOW.replace(microsecond=0))
+    # Run test.
+    self.replay()
+    s = RssService(taskqueue)
+    s.Dispatch(batch_size=2, now=NOW)
+    # Validate.
+    self.verify()
+
+  def testDispatchOnlyDueFeeds(self):
+    """Test that RssService dispatches only feeds that are due."""
+    NOW = datetime.datetime(2012, 3, 30, 12)
+    f1 = Feed()
+    f1.name = 'Google'
+    f1.url = 'http://google.com/rss.xml'
+    f1.next_fetch_at = NOW - datetime.timedelta(minutes=1)
+    f1.put()
+    f2 = Feed()
+    f2.name = 'USA Today'
+    f2.url = 'http://usatoday.com/rss.xml'
+    f2.next_fetch_at = NOW + datetime.timedelta(minutes=1)
+    f2.put()
+    taskqueue = self.mock()
+    # Set expectations.
+    taskqueue.Download([[f1.key().id()]], 0, 'download', NOW)
+    # Run test.
+    self.replay()
+    s = RssService(taskqueue)
+    s.Dispatch(now=NOW)
+    # Validate.
+    self.verify()
+
+  def testDispatchGroupsFeedsByHost(self):
+    """Test that feeds from the same host are fetched by the same task."""
+    NOW = datetime.datetime(2012, 3, 30, 12)
+    feed_ids = {}
+    hosts = ('google.com', 'usatoday.com', 'GOOGLE.com', 'usatoday.com')
+    for i, host in enumerate(hosts):
+      f = Feed()
+      f.name = host
+      f.url = 'http://%s/rss%d.xml' % (host, i)
+      f.next_fetch_at = NOW
+      f.put()
+      feed_ids.setdefault(host.lower(), []).append(f.key().id())
+    taskqueue = RecordingTaskQueue()
+    s = RssService(taskqueue)
+    s.Dispatch(batch_size=2, now=NOW)
+    self.assertEqual([('Download', [feed_ids['google.com'],
+                                    feed_ids['usatoday.com']])],
+                     taskqueue.calls)
+
+  def testDispatchContinuesInNewTask(self):
+    """Test that a long dispatch hands over to a continuation task."""
+    NOW = datetime.datetime(2012, 3, 30, 12)
+    feed_ids = []
+    for i in range(3):
+      f = Feed()
+      f.name = 'Feed %d' % i
+      f.url = 'http://google.com/rss%d.xml' % i
+      f.next_fetch_at = NOW
+      f.put()
+      feed_ids.append(f.key().id())
+    taskqueue = RecordingTaskQueue()
+    original_budget = rss_service.DISPATCH_TIME_BUDGET
+    original_page_size = rss_service.DISPATCH_PAGE_SIZE
+    rss_service.DISPATCH_TIME_BUDGET = 0
+    rss_service.DISPATCH_PAGE_SIZE = 2
+    try:
+      s = RssService(taskqueue)
+      s.Dispatch(batch_size=1, now=NOW)
+      self.assertEqual([('Download', [feed_ids[:1], feed_ids[1:2]])],
+                       taskqueue.calls[:1])
+      self.assertEqual(1, len(taskqueue.calls[1:]))
+      method, (batch_size, now, cursor, spread) = taskqueue.calls[1]
+      self.assertEqual(('Dispatch', 1, NOW, False),
+                       (method, batch_size, now, spread))
+      taskqueue.calls = []
+      s.Dispatch(batch_size, now, cursor)
+      self.assertEqual([('Download', [feed_ids[2:]])], taskqueue.calls)
+    finally:
+      rss_service.DISPATCH_TIME_BUDGET = original_budget
+      rss_service.DISPATCH_PAGE_SIZE = original_page_size
+
+  def testDispatchSpread(self):
+    """Test that spread dispatch delays each feed by its stable offset."""
+    NOW = datetime.datetime(2012, 3, 30, 12)
+    scheduler = FeedScheduler()
+    offsets = {}
+    hosts = {}
+    for i in range(20):
+      f = Feed()
+      f.name = 'Feed %d' % i
+      f.url = 'http://host%d.com/rss%d.xml' % (i % 10, i)
+      f.next_fetch_at = NOW
+      f.put()
+      offset = scheduler.DispatchOffset(f)
+      offsets.setdefault(offset * 60, []).append(f.key().id())
+      hosts.setdefault(f.host, []).append(f.key().id())
+    taskqueue = RecordingTaskQueue()
+    RssService(taskqueue).Dispatch(batch_size=10, now=NOW, spread=True)
+    self.assertEqual(sorted(offsets), taskqueue.countdowns)
+    self.assertTrue(len(offsets) > 1)
+    for countdown, (method, batches) in zip(taskqueue.countdowns,
+                                            taskqueue.calls):
+      self.assertEqual('Download', method)
+      self.assertEqual(sorted(offsets[countdown]),
+                       sorted(sum(batches, [])))
+    # The feeds of each host are fetched by the same task.
+    batches = sum([batches for unused_method, batches in taskqueue.calls], [])
+    for feed_ids in hosts.values():
+      self.assertTrue([batch for batch in batches
+                       if set(feed_ids) <= set(batch)])
+
+  def testDispatchByPriorityTier(self):
+    """Test that feeds go to the queue of their tier, busiest first."""
+    NOW = datetime.datetime(2012, 3, 30, 12)
+    feed_ids = {}
+    for visitors in (None, 50000, 35000000, 100):
+      f = Feed()
+      f.name = 'Feed %s' % visitors
+      f.url = 'http://google.com/rss%s.xml' % visitors
+      f.monthly_visitors = visitors
+      f.next_fetch_at = NOW
+      f.put()
+      feed_ids[visitors] = f.key().id()
+    taskqueue = RecordingTaskQueue()
+    RssService(taskqueue).Dispatch(now=NOW)
+    self.assertEqual(['download-high', 'download-medium', 'download'],
+                     taskqueue.queue_names)
+    self.assertEqual([('Download', [[feed_ids[35000000]]]),
+                      ('Download', [[feed_ids[50000]]]),
+                      ('Download', [sorted([feed_ids[None], feed_ids[100]])])],
+                     [(method, [sorted(batch) for batch in batches])
+                      for method, batches in taskqueue.calls])
+
+  def testDownloadSchedulesFromDispatch(self):
+    """Test that a fetch that waited in the queue is not put off."""
+    D1 = datetime.datetime(2012, 3, 30, 12)
+    f1 = Feed()
+    f1.name = 'Google'
+    f1.url = 'http://google.com/rss.xml'
+    f1.next_fetch_at = D1
+    f1.put()
+    not_modified = feedparser.FeedParserDict(status=304, entries=[])
+    taskqueue = RecordingTaskQueue()
+    s = RssService(taskqueue, FakeFetcher({f1.url: not_modified}))
+    s.Dispatch(now=D1)
+    self.assertEqual(D1, taskqueue.dispatched_at)
+    # The download task runs long after the dispatch, yet the feed is due
+    # for the dispatch one fetch interval later.
+    s.Download([f1.key().id()], taskqueue.dispatched_at)
+    f1 = Feed.get_by_id(f1.key().id())
+    interval = datetime.timedelta(minutes=f1.fetch_interval)
+    self.assertEqual(D1 + interval, f1.next_fetch_at)
+    self.assertTrue(f1.last_fetched_at > D1 + interval)
+    taskqueue.calls = []
+    s.Dispatch(now=D1 + interval - datetime.timedelta(minutes=15))
+    self.assertEqual([], taskqueue.calls)
+    s.Dispatch(now=D1 + interval)
+    self.assertEqual([('Download', [[f1.key().id()]])], taskqueue.calls)
+
+  def testDispatchLeasesFeeds(self):
+    """Test that a feed is not dispatched again while it waits in the queue."""
+    D1 = datetime.datetime(2012, 3, 30, 12)
+    f1 = Feed()
+    f1.name = 'Google'
+    f1.url = 'http://google.com/rss.xml'
+    f1.next_fetch_at = D1
+    f1.put()
+    not_modified = feedparser.FeedParserDict(status=304, entries=[])
+    taskqueue = RecordingTaskQueue()
+    s = RssService(taskqueue, FakeFetcher({f1.url: not_modified}))
+    s.Dispatch(now=D1)
+    self.assertEqual([('Download', [[f1.key().id()]])], taskqueue.calls)
+    # The feed is still due at the next dispatch, but it is leased.
+    taskqueue.calls = []
+    D2 = D1 + datetime.timedelta(minutes=15)
+    s.Dispatch(now=D2)
+    self.assertEqual([], taskqueue.calls)
+    # The download releases the lease, and a download task for the feed
+    # that was queued by another dispatch does not fetch it again.
+    s.Download([f1.key().id()], D1)
+    s.Download([f1.key().id()], D2)
+    f1 = Feed.get_by_id(f1.key().id())
+    self.assertEqual(1, f1.fetch_count)
+    s.Dispatch(now=f1.next_fetch_at)
+    self.assertEqual([('Download', [[f1.key().id()]])], taskqueue.calls)
+
+  def testDispatchReleasesLeases(self):
+    """Test that leases are released when enqueueing or fetching fails."""
+    D1 = datetime.datetime(2012, 3, 30, 12)
+    f1 = Feed()
+    f1.name = 'Google'
+    f1.url = 'http://google.com/rss.xml'
+    f1.next_fetch_at = D1
+    f1.put()
+    class FailingTaskQueue(RecordingTaskQueue):
+      def Download(self, *args):
+        raise taskqueue_api.TransientError()
+    class FailingFetcher(object):
+      def FetchAll(self, feeds, entry_filter=None, topics_fingerprint=None):
+        raise urlfetch.DeadlineExceededError()
+    self.assertRaises(taskqueue_api.TransientError,
+                      RssService(FailingTaskQueue()).Dispatch, now=D1)
+    taskqueue = RecordingTaskQueue()
+    s = RssService(taskqueue, FailingFetcher())
+    s.Dispatch(now=D1)
+    self.assertEqual([('Download', [[f1.key().id()]])], taskqueue.calls)
+    self.assertRaises(urlfetch.DeadlineExceededError,
+                      s.Download, [f1.key().id()], D1)
+    taskqueue.calls = []
+    s.Dispatch(now=D1)
+    self.assertEqual([('Download', [[f1.key().id()]])], taskqueue.calls)
+    # A download task that skips the feed, because another task fetched it
+    # since, leaves the lease of the other task alone.
+    f1.next_fetch_at = D1 + datetime.timedelta(minutes=1)
+    f1.put()
+    s.Download([f1.key().id()], D1)
+    taskqueue.calls = []
+    s.Dispatch(now=f1.next_fetch_at)
+    self.assertEqual([], taskqueue.calls)
+
+  def testDispatchSpreadSchedulesFromDispatch(self):
+    """Test that the spread offset does not put off the next fetch."""
+    D1 = datetime.datetime(2012, 3, 30, 12)
+    not_modified = feedparser.FeedParserDict(status=304, entries=[])
+    results = {}
+    feed_ids = []
+    for i in range(5):
+      f = Feed()
+      f.name = 'Feed %d' % i
+      f.url = 'http://google.com/rss%d.xml' % i
+      f.next_fetch_at = D1
+      f.put()
+      results[f.url] = not_modified
+      feed_ids.append(f.key().id())
+    taskqueue = RecordingTaskQueue()
+    s = RssService(taskqueue, FakeFetcher(results))
+    s.Dispatch(now=D1, spread=True)
+    # Each download task runs after its countdown, but the feeds are due one
+    # fetch interval after the dispatch.
+    for unused_method, batches in taskqueue.calls:
+      for batch in batches:
+        s.Download(batch, taskqueue.dispatched_at)
+    for f in Feed.get_by_id(feed_ids):
+      interval = datetime.timedelta(minutes=f.fetch_interval)
+      self.assertEqual(D1 + interval, f.next_fetch_at)
+
   def testDownload(self):
     """Test a feed download."""
     f1 = Feed()
@@ -74,7 +353,7 @@ class RssServiceTests(pymock.PyMockTestCase):
     t2.put()
 
     s = RssService()
-    s.Download(f1.key().id())
+    s.Download([f1.key().id()])
     articles = Article.all().order('-title').fetch(limit=1000)
     self.assertEqual(2, len(articles))
     # Examine first article.
@@ -118,13 +397,429 @@ class RssServiceTests(pymock.PyMockTestCase):
     t2.put()
 
     s = RssService()
-    s.Download(f1.key().id())
-    s.Download(f1.key().id())
+    s.Download([f1.key().id()])
+    s.Download([f1.key().id()])
     articles = Article.all().order('-title').fetch(limit=1000)
     self.assertEqual(2, len(articles))
     self.assertEqual(1, len(articles[0].feeds))
     self.assertEqual(1, len(articles[1].feeds))
 
+  def testDownloadArticleWithSeveralTopics(self):
+    """Test that an article matching several topics is stored once."""
+    f1 = Feed()
+    f1.name = 'Google Developer Blog'
+    f1.url = '../test_data/google_developer_blog_rss.xml'
+    f1.put()
+
+    t1 = Topic()
+    t1.name = 'campus London'
+    t1.put()
+
+    t2 = Topic()
+    t2.name = 'startups'
+    t2.put()
+
+    s = RssService()
+    s.Download([f1.key().id()])
+    articles = Article.all().filter('topics =', t1.key()).fetch(limit=1000)
+    self.assertEqual(1, len(articles))
+    self.assertTrue(t2.key() in articles[0].topics)
+    self.assertEqual(1, len(articles[0].feeds))
+
+  def testDownloadKeysArticlesByUrl(self):
+    """Test that downloaded articles are keyed by their URL."""
+    f1 = Feed()
+    f1.name = 'Google Developer Blog'
+    f1.url = '../test_data/google_developer_blog_rss.xml'
+    f1.put()
+
+    t1 = Topic()
+    t1.name = 'campus London'
+    t1.put()
+
+    s = RssService()
+    s.Download([f1.key().id()])
+    url = ('http://feedproxy.google.com/~r/blogspot/MKuf/~3/'
+           'ESbFwlkhCNU/lets-fill-london-with-startups.html')
+    article = Article.get(Article.KeyForUrl(url))
+    self.assertEqual(url, article.url)
+    self.assertEqual([t1.key()], article.topics)
+
+  def testMigrateArticleKeys(self):
+    """Test that articles with ids are merged into articles keyed by URL."""
+    t1 = Topic(name='Chrome')
+    t1.put()
+    t2 = Topic(name='Android')
+    t2.put()
+    f1 = Feed(name='Google', url='http://google.com/rss.xml')
+    f1.put()
+    for topic in (t1, t2):
+      a = Article()
+      a.url = 'http://Google.com:80/1#comments'
+      a.title = 'News 1!'
+      a.updated = datetime.datetime(2012, 1, 15, 12)
+      a.topics.append(topic.key())
+      a.feeds.append(f1.key())
+      a.put()
+    a = Article()
+    a.url = 'http://google.com/2'
+    a.title = 'News 2!'
+    a.put()
+
+    s = RssService()
+    cursor = s.MigrateArticleKeys(batch_size=2)
+    self.assertNotEqual(None, cursor)
+    while cursor:
+      cursor = s.MigrateArticleKeys(cursor, batch_size=2)
+    articles = Article.all().fetch(limit=1000)
+    self.assertEqual(2, len(articles))
+    article = Article.get(Article.KeyForUrl('http://google.com/1'))
+    self.assertEqual('News 1!', article.title)
+    self.assertEqual([t1.key(), t2.key()], article.topics)
+    self.assertEqual([f1.key()], article.feeds)
+    article = Article.get(Article.KeyForUrl('http://google.com/2'))
+    self.assertEqual('News 2!', article.title)
+
+  def testUpgradeFeeds(self):
+    """Test that feeds are rewritten in batches."""
+    for i in range(3):
+      Feed(name='Feed %d' % i, url='http://google.com/rss%d.xml' % i).put()
+    s = RssService()
+    cursor = s.UpgradeFeeds(batch_size=2)
+    self.assertNotEqual(None, cursor)
+    self.assertEqual(None, s.UpgradeFeeds(cursor, batch_size=2))
+    self.assertEqual(3, Feed.all().count())
+
+  def testMatchCacheRemembersFilteredEntries(self):
+    """Test that entries let through the filter are not matched again."""
+    t1 = Topic(name='Chrome')
+    cache = rss_service._MatchCache(TopicMatcher([t1]))
+    self.assertTrue(cache.Filter(feedparser.FeedParserDict(
+        title=u'Chrome 1', summary=u'News')))
+    self.assertFalse(cache.Filter(feedparser.FeedParserDict(
+        title=u'Android 1', summary=u'News')))
+    # Only the entry that was let through is remembered.
+    cache.matcher = None
+    self.assertEqual([t1], cache.Match(u'Chrome 1', u'News'))
+    self.assertEqual(1, len(cache.topics))
+    cache.Clear()
+    self.assertEqual({}, cache.topics)
+
+  def testDownloadNotModified(self):
+    """Test that download stops when the feed was not modified."""
+    f1 = Feed()
+    f1.name = 'Google'
+    f1.url = 'http://google.com/rss.xml'
+    f1.etag = u'"abc"'
+    f1.put()
+    not_modified = feedparser.FeedParserDict(status=304, entries=[])
+
+    s = RssService(fetcher=FakeFetcher({f1.url: not_modified}))
+    s.Download([f1.key().id()])
+    f1 = Feed.get_by_id(f1.key().id())
+    self.assertEqual(1, f1.fetch_count)
+    self.assertEqual(1, f1.not_modified_count)
+    self.assertEqual(u'"abc"', f1.etag)
+    # The fetcher is told which topics entries are matched against, so that
+    # it does not fetch conditionally when the topics changed.
+    self.assertEqual(TopicMatcher([]).fingerprint,
+                     s.fetcher.topics_fingerprint)
+
+  def testDownloadBatch(self):
+    """Test that download processes every feed in a batch."""
+    f1 = Feed()
+    f1.name = 'Google Developer Blog'
+    f1.url = '../test_data/google_developer_blog_rss.xml'
+    f1.put()
+    f2 = Feed()
+    f2.name = 'Google'
+    f2.url = 'http://google.com/rss.xml'
+    f2.put()
+
+    t1 = Topic()
+    t1.name = 'campus London'
+    t1.put()
+
+    fetcher = FakeFetcher({
+        f1.url: feedparser.parse(f1.url),
+        f2.url: feedparser.FeedParserDict(status=304, entries=[]),
+    })
+    s = RssService(fetcher=fetcher)
+    s.Download([f1.key().id(), f2.key().id()])
+    self.assertEqual(1, Article.all().count())
+    self.assertEqual(1, Feed.get_by_id(f2.key().id()).not_modified_count)
+
+  def testDownloadSkipsUnchangedEntries(self):
+    """Test that entries seen in the last download are not stored again."""
+    f1 = Feed()
+    f1.name = 'Google Developer Blog'
+    f1.url = '../test_data/google_developer_blog_rss.xml'
+    f1.put()
+
+    t1 = Topic()
+    t1.name = 'campus London'
+    t1.put()
+
+    s = RssService()
+    s.Download([f1.key().id()])
+    # Only the entry that mentions the topic gets past the parser.
+    self.assertEqual(1, len(Feed.get_by_id(f1.key().id()).entry_fingerprints))
+    article = Article.all().get()
+    article.title = 'Edited'
+    article.put()
+    # The entry is unchanged, so the article is left alone.
+    s.Download([f1.key().id()])
+    self.assertEqual('Edited', Article.get(article.key()).title)
+    # A new topic means that all entries must be matched again.
+    t2 = Topic()
+    t2.name = 'Cheryl Oakes'
+    t2.put()
+    s.Download([f1.key().id()])
+    self.assertEqual(2, Article.all().count())
+    self.assertNotEqual('Edited', Article.get(article.key()).title)
+
+  def testDownloadStopsAtHighWaterMark(self):
+    """Test that entries at or below the high-water mark are not processed."""
+    MAR28 = datetime.datetime(2012, 3, 28)
+    MAR29 = datetime.datetime(2012, 3, 29)
+    MAR30 = datetime.datetime(2012, 3, 30)
+    t1 = Topic()
+    t1.name = 'Chrome'
+    t1.put()
+    f1 = Feed()
+    f1.name = 'Google'
+    f1.url = 'http://google.com/rss.xml'
+    f1.high_water_updated = MAR29
+    f1.high_water_link = 'http://google.com/2'
+    f1.topics_fingerprint = TopicMatcher([t1]).fingerprint
+    f1.put()
+    entries = []
+    # The second entry has the same date as the mark but a different link, so
+    # it is still processed.
+    for i, updated in enumerate([MAR30, MAR29, MAR29, MAR28]):
+      entries.append(feedparser.FeedParserDict(
+          title='Chrome %d' % i, summary='', link='http://google.com/%d' % i,
+          updated_parsed=updated.timetuple()))
+    feed_content = feedparser.FeedParserDict(entries=entries)
+
+    s = RssService(fetcher=FakeFetcher({f1.url: feed_content}))
+    s.Download([f1.key().id()])
+    articles = Article.all().order('title').fetch(limit=1000)
+    self.assertEqual(['Chrome 0', 'Chrome 1'], [a.title for a in articles])
+    f1 = Feed.get_by_id(f1.key().id())
+    self.assertEqual(MAR30, f1.high_water_updated)
+    self.assertEqual('http://google.com/0', f1.high_water_link)
+    # The safety override processes all entries.
+    f1.scan_all_entries = True
+    f1.put()
+    s.Download([f1.key().id()])
+    self.assertEqual(4, Article.all().count())
+
+  def testDownloadRemembersParseHints(self):
+    """Test that what feedparser found out is kept for the next download."""
+    f1 = Feed()
+    f1.name = 'Google Developer Blog'
+    f1.url = '../test_data/google_developer_blog_rss.xml'
+    f1.put()
+
+    s = RssService()
+    s.Download([f1.key().id()])
+    f1 = Feed.get_by_id(f1.key().id())
+    # The test feed starts with a blank line, which the strict parser rejects.
+    self.assertTrue(f1.parse_loose)
+    self.assertEqual('utf-8', f1.parse_encoding)
+    self.assertEqual({'encoding': 'utf-8', 'declared_encoding': 'utf-8',
+                      'loose': True}, s.fetcher.ParseHints(f1))
+
+  def testDownloadCountsBytes(self):
+    """Test that the bytes received and decompressed add up per feed."""
+    f1 = Feed()
+    f1.name = 'Google'
+    f1.url = 'http://google.com/rss.xml'
+    f1.put()
+    not_modified = feedparser.FeedParserDict(status=304, entries=[],
+                                             bytes_received=100,
+                                             bytes_decoded=400)
+
+    s = RssService(fetcher=FakeFetcher({f1.url: not_modified}))
+    s.Download([f1.key().id()])
+    s.Download([f1.key().id()])
+    f1 = Feed.get_by_id(f1.key().id())
+    self.assertEqual(200, f1.bytes_received)
+    self.assertEqual(800, f1.bytes_decoded)
+
+  def testDownloadRemembersRedirects(self):
+    """Test that feeds are fetched from where they redirect to."""
+    f1 = Feed()
+    f1.name = 'Google'
+    f1.url = 'http://google.com/rss.xml'
+    f1.put()
+    new_url = 'http://www.google.com/rss.xml'
+    result = feedparser.FeedParserDict(status=304, entries=[], href=new_url,
+                                       redirects=[301, 308],
+                                       redirects_avoided=0)
+
+    s = RssService(fetcher=FakeFetcher({f1.url: result}))
+    s.Download([f1.key().id()])
+    f1 = Feed.get_by_id(f1.key().id())
+    self.assertEqual(new_url, f1.redirect_url)
+    self.assertEqual(2, f1.redirect_hops)
+    self.assertEqual(None, f1.redirect_expires_at)
+    # The next fetch goes straight to the new URL.
+    result['redirects'] = []
+    result['redirects_avoided'] = 2
+    s.Download([f1.key().id()])
+    f1 = Feed.get_by_id(f1.key().id())
+    self.assertEqual(new_url, f1.redirect_url)
+    self.assertEqual(2, f1.redirects_avoided)
+    # A temporary redirect from there is only followed for a while.
+    result['redirects'] = [302]
+    result['href'] = 'http://www.google.com/tmp.xml'
+    s.Download([f1.key().id()])
+    f1 = Feed.get_by_id(f1.key().id())
+    self.assertEqual('http://www.google.com/tmp.xml', f1.redirect_url)
+    self.assertEqual(3, f1.redirect_hops)
+    self.assertTrue(f1.redirect_expires_at)
+    # The redirect is forgotten if fetching from there fails.
+    del result['status']
+    result['redirects'] = []
+    result['redirects_avoided'] = 3
+    result['bozo'] = 1
+    s.Download([f1.key().id()])
+    f1 = Feed.get_by_id(f1.key().id())
+    self.assertEqual(None, f1.redirect_url)
+    # A redirect to where fetching fails is not remembered.
+    result['status'] = 404
+    result['redirects'] = [301]
+    result['redirects_avoided'] = 0
+    s.Download([f1.key().id()])
+    f1 = Feed.get_by_id(f1.key().id())
+    self.assertEqual(None, f1.redirect_url)
+    self.assertEqual(7, f1.redirects_avoided)
+
+  def testDispatchReportsRedirectsAvoided(self):
+    """Test that redirects avoided are added up between dispatches."""
+    NOW = datetime.datetime(2012, 3, 30, 12)
+    f1 = Feed()
+    f1.name = 'Google'
+    f1.url = 'http://google.com/rss.xml'
+    f1.next_fetch_at = NOW + datetime.timedelta(days=1)
+    f1.put()
+    result = feedparser.FeedParserDict(status=304, entries=[],
+                                       href='http://www.google.com/rss.xml',
+                                       redirects=[], redirects_avoided=2)
+
+    s = RssService(RecordingTaskQueue(), FakeFetcher({f1.url: result}))
+    self.assertEqual(None, s._ReportRedirectsAvoided())
+    s.Download([f1.key().id()])
+    s.Download([f1.key().id()])
+    self.assertEqual(4, s._ReportRedirectsAvoided())
+    self.assertEqual(0, s._ReportRedirectsAvoided())
+    # A new dispatch reports and resets the count.
+    s.Download([f1.key().id()])
+    s.Dispatch(now=NOW)
+    self.assertEqual(0, s._ReportRedirectsAvoided())
+
+  def testDownloadBacksOffFailingFeeds(self):
+    """Test that feeds that fail to fetch are backed off or suspended."""
+    NOW = datetime.datetime(2012, 3, 30, 12)
+    f1 = Feed()
+    f1.name = 'Google'
+    f1.url = 'http://google.com/rss.xml'
+    f1.put()
+    f2 = Feed()
+    f2.name = 'Gone'
+    f2.url = 'http://gone.com/rss.xml'
+    f2.put()
+    not_found = feedparser.FeedParserDict(status=404, entries=[], bozo=0)
+    gone = feedparser.FeedParserDict(status=410, entries=[], bozo=0)
+
+    s = RssService(fetcher=FakeFetcher({f1.url: not_found, f2.url: gone}))
+    s.Download([f1.key().id(), f2.key().id()])
+    f1 = Feed.get_by_id(f1.key().id())
+    self.assertEqual(1, f1.failure_count)
+    self.assertEqual('HTTP status 404', f1.last_failure)
+    self.assertFalse(f1.suspended)
+    self.assertTrue(f1.next_fetch_at > NOW)
+    f2 = Feed.get_by_id(f2.key().id())
+    self.assertTrue(f2.suspended)
+    suspended = ScuttlebuttService().GetSuspendedFeeds()
+    self.assertEqual([f2.name], [f['name'] for f in suspended])
+    # Neither feed is due, and a suspended feed stays out of dispatch even
+    # when it is due.
+    f2.next_fetch_at = NOW
+    f2.put()
+    taskqueue = RecordingTaskQueue()
+    RssService(taskqueue).Dispatch(now=NOW)
+    self.assertEqual([], taskqueue.calls)
+    ScuttlebuttService().ResumeFeed(f2.key().id(), NOW)
+    RssService(taskqueue).Dispatch(now=NOW)
+    self.assertEqual([('Download', [[f2.key().id()]])], taskqueue.calls)
+
+  def testDownloadRaisesProcessingErrors(self):
+    """Test that an error while processing a feed is not held against it."""
+    NOW = datetime.datetime(2012, 3, 30, 12)
+    f1 = Feed()
+    f1.name = 'Google'
+    f1.url = 'http://google.com/rss.xml'
+    f1.next_fetch_at = NOW
+    f1.put()
+    # A parse result without entries breaks processing.
+    broken = feedparser.FeedParserDict(version='rss20', bozo=0)
+
+    s = RssService(fetcher=FakeFetcher({f1.url: broken}))
+    self.assertRaises(KeyError, s.Download, [f1.key().id()])
+    f1 = Feed.get_by_id(f1.key().id())
+    self.assertEqual(0, f1.failure_count)
+    self.assertFalse(f1.suspended)
+    self.assertEqual(NOW, f1.next_fetch_at)
+
+  def testDownloadEntriesWithMissingFields(self):
+    """Test that entries without a title, summary or link are handled."""
+    f1 = Feed()
+    f1.name = 'Google'
+    f1.url = 'http://google.com/rss.xml'
+    f1.put()
+    t1 = Topic()
+    t1.name = 'Chrome'
+    t1.put()
+    result = feedparser.FeedParserDict(version='rss20', bozo=0, entries=[
+        feedparser.FeedParserDict(title=u'Chrome 18',
+                                  link=u'http://google.com/1'),
+        feedparser.FeedParserDict(summary=u'Chrome 19',
+                                  link=u'http://google.com/2'),
+        feedparser.FeedParserDict(title=u'Chrome 20'),
+    ])
+
+    s = RssService(fetcher=FakeFetcher({f1.url: result}))
+    s.Download([f1.key().id()])
+    articles = sorted(Article.all().fetch(limit=10), key=lambda a: a.url)
+    self.assertEqual([u'http://google.com/1', u'http://google.com/2'],
+                     [a.url for a in articles])
+    self.assertEqual([u'', u'Chrome 19'], [a.summary for a in articles])
+    self.assertEqual([u'Chrome 18', u''], [a.title for a in articles])
+    self.assertEqual(0, Feed.get_by_id(f1.key().id()).failure_count)
+
+  def testDownloadAveragesTimings(self):
+    """Test that the parse timings are kept as moving averages per feed."""
+    f1 = Feed()
+    f1.name = 'Google'
+    f1.url = 'http://google.com/rss.xml'
+    f1.put()
+    not_modified = feedparser.FeedParserDict(status=304, entries=[],
+                                             timings={'fetch': (2.0, 0)})
+
+    s = RssService(fetcher=FakeFetcher({f1.url: not_modified}))
+    s.Download([f1.key().id()])
+    f1 = Feed.get_by_id(f1.key().id())
+    self.assertEqual({'fetch': 2.0}, f1.ToDict()['timings'])
+    not_modified['timings'] = {'fetch': (1.0, 0), 'parse': (0.5, 0)}
+    s.Download([f1.key().id()])
+    f1 = Feed.get_by_id(f1.key().id())
+    timings = f1.ToDict()['timings']
+    self.assertAlmostEqual(1.7, timings['fetch'])
+    self.assertAlmostEqual(0.5, timings['parse'])
+
   def testComputeTopicStatsSimple(self):
     JAN15_NOON = datetime.datetime(2012, 1, 15, 12)
     JAN15_1PM = datetime.datetime(2012, 1, 15, 13)
@@ -215,6 +910,493 @@ class RssServiceTests(pymock.PyMockTestCase):
     self.assertAlmostEqual(-0.666, t.weekOnWeekChange, 0.001)
 
 
+class FeedFetcherTests(unittest.TestCase):
+  """Tests for FeedFetcher."""
+
+  def setUp(self):
+    """Set up for App Engine service stubs."""
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_urlfetch_stub()
+
+  def tearDown(self):
+    """Clean up testbed."""
+    self.testbed.deactivate()
+
+  def testRequestHeadersSendValidators(self):
+    """Test that feeds are fetched with a conditional GET."""
+    f = Feed(name='Google', url='http://google.com/rss.xml')
+    headers = FeedFetcher().RequestHeaders(f)
+    self.assertFalse('If-None-Match' in headers)
+    self.assertFalse('If-Modified-Since' in headers)
+    f.etag = u'"abc"'
+    f.last_modified = 'Thu, 29 Mar 2012 17:00:12 GMT'
+    headers = FeedFetcher().RequestHeaders(f)
+    self.assertEqual(u'"abc"', headers['If-None-Match'])
+    self.assertEqual('Thu, 29 Mar 2012 17:00:12 GMT',
+                     headers['If-Modified-Since'])
+
+  def testRequestHeadersSkipValidatorsForNewTopics(self):
+    """Test that a feed matched against other topics is fetched in full."""
+    f = Feed(name='Google', url='http://google.com/rss.xml', etag=u'"abc"',
+             last_modified='Thu, 29 Mar 2012 17:00:12 GMT',
+             topics_fingerprint='old')
+    fetcher = FeedFetcher()
+    self.assertFalse(fetcher._Conditional(f, 'new'))
+    headers = fetcher.RequestHeaders(f, conditional=False)
+    self.assertFalse('If-None-Match' in headers)
+    self.assertFalse('If-Modified-Since' in headers)
+    self.assertTrue(fetcher._Conditional(f, 'old'))
+    self.assertTrue(fetcher._Conditional(f, None))
+
+  def testRequestHeadersAcceptCompression(self):
+    """Test that feeds are fetched compressed when the server can."""
+    f = Feed(name='Google', url='http://google.com/rss.xml')
+    headers = FeedFetcher().RequestHeaders(f)
+    self.assertEqual('gzip, deflate', headers['Accept-Encoding'])
+
+  def testParseHintsAreRechecked(self):
+    """Test that feeds are parsed without hints every so often."""
+    f = Feed(name='Google', url='http://google.com/rss.xml',
+             parse_encoding='windows-1252', declared_encoding='utf-8',
+             parse_loose=True, fetch_count=1)
+    fetcher = FeedFetcher()
+    self.assertTrue(fetcher.ParseHints(f)['loose'])
+    f.fetch_count = feed_fetcher.HINT_RECHECK_FETCHES
+    self.assertEqual(None, fetcher.ParseHints(f))
+
+  def testFetchUrlSkipsRedirects(self):
+    """Test that feeds are fetched from where they redirected to."""
+    NOW = datetime.datetime(2012, 3, 30, 12)
+    f = Feed(name='Google', url='http://google.com/rss.xml')
+    fetcher = FeedFetcher()
+    self.assertEqual((f.url, 0), fetcher.FetchUrl(f, NOW))
+    f.redirect_from = f.url
+    f.redirect_url = 'http://www.google.com/rss.xml'
+    f.redirect_hops = 2
+    self.assertEqual(('http://www.google.com/rss.xml', 2),
+                     fetcher.FetchUrl(f, NOW))
+    f.redirect_expires_at = NOW
+    self.assertEqual((f.url, 0), fetcher.FetchUrl(f, NOW))
+    f.redirect_expires_at = None
+    f.url = 'http://google.com/atom.xml'
+    self.assertEqual((f.url, 0), fetcher.FetchUrl(f, NOW))
+
+  def testFetchLocalFile(self):
+    """Test that feeds that are not served over HTTP are parsed directly."""
+    f = Feed(name='Google Developer Blog',
+             url='../test_data/google_developer_blog_rss.xml')
+    results = list(FeedFetcher().FetchAll([f]))
+    self.assertEqual(1, len(results))
+    self.assertEqual(f, results[0][0])
+    self.assertEqual(25, len(results[0][1]['entries']))
+
+
+class FeedParserTests(unittest.TestCase):
+  """Tests for the changes to the bundled feedparser."""
+
+  def testLeanParse(self):
+    """Test that a lean parse keeps the entry fields RssService uses."""
+    url = '../test_data/google_developer_blog_rss.xml'
+    full = feedparser.parse(url)
+    lean = feedparser.parse(url, lean=1)
+    self.assertEqual(len(full['entries']), len(lean['entries']))
+    for full_entry, lean_entry in zip(full['entries'], lean['entries']):
+      for field in ('title', 'link', 'id', 'updated_parsed'):
+        self.assertEqual(full_entry[field], lean_entry[field])
+      self.assertTrue(lean_entry['summary'])
+      self.assertFalse('author' in lean_entry)
+      self.assertFalse('tags' in lean_entry)
+      self.assertFalse('title_detail' in lean_entry)
+    self.assertEqual(full['feed']['title'], lean['feed']['title'])
+
+  def testEntryFilter(self):
+    """Test that rejected entries are cut down to their link and dates."""
+    url = '../test_data/google_developer_blog_rss.xml'
+    full = feedparser.parse(url)
+    mentions_startups = lambda entry: 'startups' in entry['summary']
+    filtered = feedparser.parse(url, entry_filter=mentions_startups)
+    self.assertEqual(len(full['entries']), len(filtered['entries']))
+    kept = [e for e in filtered['entries'] if not e.get('rejected')]
+    self.assertEqual([e for e in full['entries'] if mentions_startups(e)],
+                     kept)
+    self.assertEqual(2, len(kept))
+    for full_entry, entry in zip(full['entries'], filtered['entries']):
+      self.assertEqual(full_entry['link'], entry['link'])
+      self.assertEqual(full_entry['updated_parsed'], entry['updated_parsed'])
+      if entry.get('rejected'):
+        self.assertFalse('summary' in entry)
+
+  def testCompactEntries(self):
+    """Test that compact entries hold the same data as FeedParserDicts."""
+    url = '../test_data/google_developer_blog_rss.xml'
+    full = feedparser.parse(url)
+    compact = feedparser.parse(url, compact=1)
+    self.assertEqual(len(full['entries']), len(compact['entries']))
+    for full_entry, entry in zip(full['entries'], compact['entries']):
+      self.assertTrue(isinstance(entry, feedparser.CompactEntry))
+      self.assertEqual(full_entry, entry.asFeedParserDict())
+      self.assertEqual(full_entry['title'], entry.title)
+      self.assertEqual(full_entry['description'], entry['description'])
+      self.assertEqual(full_entry['title_detail'], entry['title_detail'])
+      self.assertEqual(full_entry.get('category'), entry.get('category'))
+      self.assertFalse('comments' in entry)
+      self.assertEqual(None, entry.get('comments'))
+      self.assertRaises(AttributeError, getattr, entry, 'comments')
+
+  def testTagsFollowNamespaceChanges(self):
+    """Test that a prefix declared again maps to its new namespace."""
+    data = ('<?xml version="1.0" encoding="utf-8"?>'
+            '<rss version="2.0"><channel>'
+            '<item xmlns:a="http://example.com/other">'
+            '<a:creator>Other</a:creator></item>'
+            '<item xmlns:a="http://purl.org/dc/elements/1.1/">'
+            '<a:creator>Writer</a:creator></item>'
+            '</channel></rss>')
+    # A leading newline sends the feed to the loose parser.
+    for feed in (data, '\n' + data):
+      entries = feedparser.parse(feed)['entries']
+      self.assertEqual('Other', entries[0]['a_creator'])
+      self.assertFalse('author' in entries[0])
+      self.assertEqual('Writer', entries[1]['author'])
+
+  def testParseHints(self):
+    """Test that parse hints are returned and skip the strict parser."""
+    url = '../test_data/google_developer_blog_rss.xml'
+    first = feedparser.parse(url)
+    self.assertEqual({'encoding': 'utf-8', 'declared_encoding': 'utf-8',
+                      'loose': 1}, first['hints'])
+    second = feedparser.parse(url, hints=first['hints'])
+    self.assertEqual(first['hints'], second['hints'])
+    self.assertEqual(first['entries'], second['entries'])
+    # A feed the strict parser accepts is not sent to the loose parser.
+    strict = feedparser.parse(open(url).read().lstrip())
+    self.assertEqual(0, strict['hints']['loose'])
+
+  def testStreamingParse(self):
+    """Test that feeds are parsed as they are read when the hints allow."""
+    data = open('../test_data/google_developer_blog_rss.xml').read().lstrip()
+    first = feedparser.parse(data)
+    reads = []
+    class RecordingFile(StringIO):
+      def read(self, size=-1):
+        reads.append(size)
+        return StringIO.read(self, size)
+    streamed = feedparser.parse(RecordingFile(data), hints=first['hints'])
+    self.assertEqual(first['entries'], streamed['entries'])
+    self.assertEqual(first['feed'], streamed['feed'])
+    self.assertEqual(first['hints'], streamed['hints'])
+    self.assertTrue(len(reads) > 2)
+    self.assertFalse(-1 in reads)
+    # A feed that the strict parser fails on midway is parsed again.
+    broken = data.replace('</feed>', '<broken></feed>')
+    streamed = feedparser.parse(StringIO(broken), hints=first['hints'])
+    self.assertEqual(feedparser.parse(broken)['entries'],
+                     streamed['entries'])
+    self.assertEqual(1, streamed['hints']['loose'])
+
+  def testStreamingParseBoundsBuffer(self):
+    """Test that a feed that cannot be rewound is buffered up to a limit."""
+    data = open('../test_data/google_developer_blog_rss.xml').read().lstrip()
+    hints = feedparser.parse(data)['hints']
+    broken = data.replace('</feed>', '<broken></feed>')
+    reads = []
+    class UnseekableFile(object):
+      def __init__(self, data):
+        self.data = StringIO(data)
+      def read(self, size=-1):
+        reads.append(size)
+        return self.data.read(size)
+    # Within the limit, the raw feed is kept and parsed again.
+    streamed = feedparser.parse(UnseekableFile(broken), hints=hints)
+    self.assertEqual(feedparser.parse(broken)['entries'],
+                     streamed['entries'])
+    self.assertTrue(-1 in reads)
+    reads = []
+    max_buffer = feedparser.MAX_STREAM_BUFFER
+    feedparser.MAX_STREAM_BUFFER = feedparser.STREAM_CHUNK_SIZE
+    try:
+      streamed = feedparser.parse(UnseekableFile(broken), hints=hints)
+    finally:
+      feedparser.MAX_STREAM_BUFFER = max_buffer
+    # Past it, the feed is not parsed again, and what was parsed before the
+    # error is kept.
+    self.assertFalse(-1 in reads)
+    self.assertEqual(25, len(streamed['entries']))
+    self.assertTrue(isinstance(streamed['bozo_exception'],
+                               xml.sax.SAXParseException))
+    self.assertEqual(1, streamed['hints']['loose'])
+
+  def testResolveEncoding(self):
+    """Test that documents convert to utf-8 from the encoding that fits."""
+    body = u'<rss version="2.0"><channel><title>Caf\xe9</title></channel></rss>'
+    utf8 = '<?xml version="1.0" encoding="utf-8"?>' + body.encode('utf-8')
+    encoding, data = feedparser._resolveEncoding(utf8, [u'us-ascii', u'utf-8'])
+    self.assertEqual(u'utf-8', encoding)
+    self.assertEqual("<?xml version='1.0' encoding='utf-8'?>" +
+                     body.encode('utf-8'), data)
+    encoding, data = feedparser._resolveEncoding(body.encode('windows-1252'),
+                                                 [u'utf-8', u'windows-1252'])
+    self.assertEqual(u'windows-1252', encoding)
+    self.assertEqual(body.encode('utf-8'), data.split('\n', 1)[1])
+
+  def testSniffEncodingAcrossSurrogatePair(self):
+    """Test that a sample ending inside a surrogate pair still decodes."""
+    decl = u'<?xml version="1.0" encoding="utf-16"?><rss><title>'
+    # The sample of the encoded document ends between the two halves of the
+    # surrogate pair.
+    padding = u'x' * (feedparser._XML_DECLARATION_SAMPLE_SIZE / 2 - 1 -
+                      len(decl))
+    doc = (decl + padding + u'\U0001f600</title></rss>').encode('utf-16le')
+    self.assertEqual(u'utf-16le',
+                     feedparser._getCharacterEncoding({}, doc)[2])
+
+  def testSanitizeTextWithoutMarkup(self):
+    """Test that text without markup is sanitized like markup would be."""
+    texts = [u'Plain text', u'  Padded\r\ntext ', u'AT&T', u'AT&T rocks',
+             u'&amp; &lt; &apos; &nosuch; &nosuch', u'&#39;&#34;&#150;&#x41;',
+             u'&#65 &a.b &x-y; caf\xe9 & ;']
+    for text in texts:
+      sanitizer = feedparser._HTMLSanitizer('utf-8', u'text/html')
+      sanitizer.feed(text)
+      expected = sanitizer.output().strip().replace('\r\n', '\n')
+      self.assertEqual(expected.decode('utf-8'),
+                       feedparser._sanitizeHTML(text, 'utf-8', u'text/html'))
+      resolver = feedparser._RelativeURIResolver('http://example.com/',
+                                                 'utf-8', u'text/html')
+      resolver.feed(text)
+      self.assertEqual(resolver.output().decode('utf-8'),
+                       feedparser._resolveRelativeURIs(
+                           text, 'http://example.com/', 'utf-8',
+                           u'text/html'))
+
+  def testTimings(self):
+    """Test that parse timings are only recorded when asked for."""
+    # Without its leading blank line, the strict parser accepts the test
+    # feed, which can then be streamed.
+    data = open('../test_data/google_developer_blog_rss.xml').read().lstrip()
+    self.assertFalse('timings' in feedparser.parse(data))
+    result = feedparser.parse(data, timings=1)
+    timings = result['timings']
+    self.assertEqual(['dates', 'encoding', 'fetch', 'parse', 'sanitize'],
+                     sorted(timings))
+    self.assertEqual(len(data), timings['fetch'][1])
+    self.assertEqual(25, timings['parse'][1])
+    self.assertEqual(51, timings['dates'][1])
+    for seconds, unused_count in timings.values():
+      self.assertTrue(seconds >= 0)
+    # A streamed feed records the same phases, but nothing is sanitized in
+    # a lean parse.
+    timings = feedparser.parse(StringIO(data), lean=1, hints=result['hints'],
+                               timings=1)['timings']
+    self.assertEqual(['dates', 'encoding', 'fetch', 'parse'], sorted(timings))
+    self.assertEqual(len(data), timings['fetch'][1])
+    self.assertEqual(25, timings['parse'][1])
+
+  def testDecompressAsRead(self):
+    """Test that compressed feeds are decompressed up to a maximum size."""
+    data = open('../test_data/google_developer_blog_rss.xml').read().lstrip()
+    compressed = zlib.compress(data)
+    headers = {'content-encoding': 'deflate'}
+    hints = feedparser.parse(data)['hints']
+    for feed_hints in (None, hints):
+      result = feedparser.parse(StringIO(compressed), hints=feed_hints,
+                                response_headers=headers)
+      self.assertEqual(25, len(result['entries']))
+      self.assertEqual(len(compressed), result['bytes_received'])
+      self.assertEqual(len(data), result['bytes_decoded'])
+    max_size = feedparser.MAX_DECOMPRESSED_SIZE
+    feedparser.MAX_DECOMPRESSED_SIZE = len(data) - 1
+    try:
+      for feed_hints in (None, hints):
+        result = feedparser.parse(StringIO(compressed), hints=feed_hints,
+                                  response_headers=headers)
+        self.assertEqual([], result['entries'])
+        self.assertTrue(isinstance(result['bozo_exception'],
+                                   feedparser.FeedTooLarge))
+    finally:
+      feedparser.MAX_DECOMPRESSED_SIZE = max_size
+
+  def testDecompressGzipMembers(self):
+    """Test that every member of a gzip response is decompressed."""
+    data = open('../test_data/google_developer_blog_rss.xml').read().lstrip()
+    compressed = ''
+    for part in (data[:len(data) // 2], data[len(data) // 2:]):
+      output = StringIO()
+      member = gzip.GzipFile(fileobj=output, mode='wb')
+      member.write(part)
+      member.close()
+      compressed += output.getvalue()
+    headers = {'content-encoding': 'gzip'}
+    hints = feedparser.parse(data)['hints']
+    for feed_hints in (None, hints):
+      result = feedparser.parse(StringIO(compressed), hints=feed_hints,
+                                response_headers=headers)
+      self.assertEqual(25, len(result['entries']))
+      self.assertEqual(len(data), result['bytes_decoded'])
+
+  def testParseDate(self):
+    """Test that common date formats parse the same with the fast path."""
+    for date_string in ('Thu, 29 Mar 2012 17:00:12 GMT',
+                        '29 Mar 2012 10:00:12 -0700',
+                        '2012-03-29T17:00:12Z',
+                        '2012-03-29T19:00:12+02:00',
+                        'Thu, 2012/03/29 17:00:12 GMT'):
+      parsed = feedparser._parse_date(date_string)
+      self.assertEqual((2012, 3, 29, 17, 0, 12), tuple(parsed)[:6])
+      self.assertEqual(parsed, feedparser._parse_date(date_string))
+    self.assertEqual(None, feedparser._parse_date('next Thursday'))
+
+  def testDateCacheForgetsLeastRecentlyUsed(self):
+    """Test that the date cache stays within its size."""
+    cache = feedparser._LRUCache(2)
+    cache['a'] = 1
+    cache['b'] = 2
+    self.assertEqual(1, cache.get('a'))
+    cache['c'] = 3
+    self.assertEqual(2, len(cache))
+    self.assertEqual(None, cache.get('b'))
+    self.assertEqual(1, cache.get('a'))
+    self.assertEqual(3, cache.get('c'))
+
+
+class FeedSchedulerTests(unittest.TestCase):
+  """Tests for FeedScheduler."""
+
+  def setUp(self):
+    """Set up for App Engine service stubs."""
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+
+  def tearDown(self):
+    """Clean up testbed."""
+    self.testbed.deactivate()
+
+  def testFetchIntervalIsBounded(self):
+    """Test that the fetch interval follows the publish rate within bounds."""
+    s = FeedScheduler()
+    self.assertEqual(feed_scheduler.HOURLY_FETCH_INTERVAL,
+                     s.FetchInterval(None))
+    self.assertEqual(feed_scheduler.MAX_FETCH_INTERVAL, s.FetchInterval(0))
+    self.assertEqual(feed_scheduler.MAX_FETCH_INTERVAL, s.FetchInterval(0.1))
+    self.assertEqual(180, s.FetchInterval(8))
+    self.assertEqual(feed_scheduler.MIN_FETCH_INTERVAL, s.FetchInterval(1000))
+
+  def testReschedule(self):
+    """Test that a fetched feed is scheduled by its publish rate."""
+    MAR30 = datetime.datetime(2012, 3, 30)
+    f = Feed(name='Google Developer Blog',
+             url='../test_data/google_developer_blog_rss.xml')
+    entries = feedparser.parse(f.url)['entries']
+    s = FeedScheduler()
+    s.Reschedule(f, entries, MAR30)
+    self.assertTrue(f.publish_rate > 0)
+    self.assertEqual(MAR30, f.last_fetched_at)
+    self.assertEqual(MAR30 + datetime.timedelta(minutes=f.fetch_interval),
+                     f.next_fetch_at)
+    # Nothing new was published, so the rate goes down.
+    rate = f.publish_rate
+    s.Reschedule(f, entries, MAR30 + datetime.timedelta(days=1))
+    self.assertTrue(f.publish_rate < rate)
+
+  def testBackoff(self):
+    """Test that failing feeds are backed off and eventually suspended."""
+    MAR30 = datetime.datetime(2012, 3, 30)
+    f = Feed(name='Google', url='http://google.com/rss.xml', fetch_interval=60)
+    s = FeedScheduler()
+    s.Backoff(f, MAR30)
+    self.assertEqual(MAR30 + datetime.timedelta(hours=2), f.next_fetch_at)
+    s.Backoff(f, MAR30)
+    self.assertEqual(MAR30 + datetime.timedelta(hours=4), f.next_fetch_at)
+    for unused_i in range(feed_scheduler.MAX_FAILURES - 3):
+      s.Backoff(f, MAR30)
+    self.assertFalse(f.suspended)
+    self.assertEqual(MAR30 + datetime.timedelta(
+        minutes=feed_scheduler.MAX_BACKOFF_INTERVAL), f.next_fetch_at)
+    s.Backoff(f, MAR30)
+    self.assertTrue(f.suspended)
+    self.assertEqual(feed_scheduler.SUSPENDED_UNTIL, f.next_fetch_at)
+    s.Resume(f, MAR30)
+    self.assertFalse(f.suspended)
+    self.assertEqual(0, f.failure_count)
+    self.assertEqual(MAR30, f.next_fetch_at)
+    # A feed that is gone is suspended at once.
+    s.Backoff(f, MAR30, gone=True)
+    self.assertTrue(f.suspended)
+
+  def testDailyFetches(self):
+    """Test the comparison of the schedule with hourly polling."""
+    f1 = Feed(name='Busy', url='http://busy.com/rss', fetch_interval=15)
+    f2 = Feed(name='Quiet', url='http://quiet.com/rss', fetch_interval=1440)
+    expected = {
+        'feeds': 2,
+        'hourlyFetchesPerDay': 48,
+        'scheduledFetchesPerDay': 97,
+        'savedFetchesPerDay': -49,
+    }
+    self.assertEqual(expected, FeedScheduler().DailyFetches([f1, f2]))
+
+  def testDailyFetchesSkipsSuspendedFeeds(self):
+    """Test that suspended feeds are left out of the daily fetches."""
+    f1 = Feed(name='Busy', url='http://busy.com/rss', fetch_interval=15)
+    f2 = Feed(name='Gone', url='http://gone.com/rss', fetch_interval=15,
+              suspended=True)
+    fetches = FeedScheduler().DailyFetches([f1, f2])
+    self.assertEqual(1, fetches['feeds'])
+    self.assertEqual(96, fetches['scheduledFetchesPerDay'])
+
+  def testPriorityTiers(self):
+    """Test that feeds with more visitors are fetched more often."""
+    s = FeedScheduler()
+    MAR30 = datetime.datetime(2012, 3, 30, 12)
+    intervals = []
+    for visitors in (None, 20000, 2000000):
+      f = Feed(name='Quiet', url='http://quiet.com/rss',
+               monthly_visitors=visitors, publish_rate=0.0,
+               last_fetched_at=MAR30 - datetime.timedelta(days=1))
+      s.Reschedule(f, [], MAR30)
+      self.assertEqual(s.Tier(f).max_fetch_interval, f.fetch_interval)
+      intervals.append(f.fetch_interval)
+    self.assertEqual([feed_scheduler.MAX_FETCH_INTERVAL, 6 * 60, 60],
+                     intervals)
+    self.assertEqual(['low', 'medium', 'high'],
+                     [s.Tier(Feed(name='Feed', url='http://feed.com/rss',
+                                  monthly_visitors=v)).name
+                      for v in (9999, 10000, 1000000)])
+    self.assertEqual(30, s.FetchInterval(None, 30))
+    self.assertEqual(feed_scheduler.MIN_FETCH_INTERVAL,
+                     s.FetchInterval(1000, 60))
+
+  def testDispatchOffset(self):
+    """Test that hosts keep their offset and are spread over the interval."""
+    scheduler = FeedScheduler()
+    feeds = [Feed(name='Feed', url='http://host%d.com/rss' % i)
+             for i in range(1, 1501)]
+    offsets = [scheduler.DispatchOffset(f) for f in feeds]
+    self.assertEqual(offsets, [scheduler.DispatchOffset(f) for f in feeds])
+    for minute in range(feed_scheduler.DISPATCH_INTERVAL):
+      self.assertTrue(70 < offsets.count(minute) < 130)
+
+  def testLoadProfile(self):
+    """Test the fetches per day started in each minute of a dispatch."""
+    f1 = Feed(name='Busy', url='http://busy.com/rss', fetch_interval=15)
+    f1.put()
+    f2 = Feed(name='Quiet', url='http://quiet.com/rss', fetch_interval=1440)
+    f2.put()
+    scheduler = FeedScheduler()
+    profile = scheduler.LoadProfile([f1, f2])
+    minutes = profile['fetchesPerDayByMinute']
+    self.assertEqual(feed_scheduler.DISPATCH_INTERVAL, len(minutes))
+    busy = scheduler.DispatchOffset(f1)
+    quiet = scheduler.DispatchOffset(f2)
+    self.assertEqual(96 + (busy == quiet), minutes[busy])
+    self.assertEqual(97, sum(minutes))
+    self.assertEqual(97, profile['burstPeakFetchesPerDay'])
+    self.assertEqual(max(minutes), profile['spreadPeakFetchesPerDay'])
+
+
 class ModelTests(unittest.TestCase):
   """Tests for model class methods."""
 
@@ -243,6 +1425,14 @@ class ModelTests(unittest.TestCase):
                      'countPastSevenDays': 12}
     self.assertEquals(expected_dict, topic.ToDict())
 
+  def testArticleKeyNameForUrl(self):
+    """Test that equivalent URLs give articles the same key name."""
+    key_name = Article.KeyNameForUrl('http://google.com/')
+    self.assertEqual(key_name, Article.KeyNameForUrl('HTTP://Google.COM:80'))
+    self.assertEqual(key_name, Article.KeyNameForUrl(' http://google.com/#top'))
+    self.assertNotEqual(key_name, Article.KeyNameForUrl('https://google.com/'))
+    self.assertNotEqual(key_name, Article.KeyNameForUrl('http://google.com/?a'))
+
 
 class ScuttlebuttServiceTests(unittest.TestCase):
   """Test methods for ScuttlebuttService."""
@@ -653,6 +1843,62 @@ class ScuttlebuttServiceTests(unittest.TestCase):
     self.assertEqual(expected, result)
 
 
+class TopicMatcherTests(unittest.TestCase):
+  """Test methods for TopicMatcher."""
+
+  def setUp(self):
+    """Set up for App Engine service stubs."""
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+
+  def tearDown(self):
+    """Clean up testbed."""
+    self.testbed.deactivate()
+
+  def testMatchIsCaseInsensitive(self):
+    """Test that topics match regardless of case, in any of the texts."""
+    chrome = Topic(name='Google Chrome')
+    android = Topic(name='android')
+    m = TopicMatcher([chrome, android])
+    self.assertEqual([chrome], m.Match('Released: GOOGLE chrome 18'))
+    self.assertEqual([chrome, android],
+                     m.Match('Chrome for Android', 'google chrome beta'))
+    self.assertEqual([], m.Match('Nothing to see here'))
+
+  def testOverlappingNames(self):
+    """Test that topics whose names overlap all match."""
+    go = Topic(name='Go')
+    google = Topic(name='Google')
+    goo = Topic(name='oogle')
+    m = TopicMatcher([go, google, goo])
+    self.assertEqual([go, google, goo], m.Match('Googlers'))
+    self.assertEqual([go], m.Match('Gopher'))
+
+  def testNoMatchAcrossTexts(self):
+    """Test that a topic does not match across two texts."""
+    m = TopicMatcher([Topic(name='title summary')])
+    self.assertEqual([], m.Match('A title', 'summary'))
+
+  def testAutomatonMatchesLikeSearch(self):
+    """Test that the automaton for many topics matches like the search."""
+    topics = [Topic(name=name) for name in
+              ('Go', 'Google', 'oogle', 'Google Chrome', 'android', '')]
+    texts = [('Googlers',), ('Gopher', None), ('Chrome for Android', ''),
+             ('Released: GOOGLE chrome 18', 'google chrome beta'), ()]
+    search = TopicMatcher(topics)
+    min_topics = topic_matcher.AUTOMATON_MIN_TOPICS
+    topic_matcher.AUTOMATON_MIN_TOPICS = 0
+    try:
+      automaton = TopicMatcher(topics)
+    finally:
+      topic_matcher.AUTOMATON_MIN_TOPICS = min_topics
+    self.assertEqual(None, search._goto)
+    self.assertNotEqual(None, automaton._goto)
+    for text in texts:
+      self.assertEqual(search.Match(*text), automaton.Match(*text))
+
+
 class HelpersTests(unittest.TestCase):
   """Test methods for helpers.py."""
 
@@ -704,6 +1950,37 @@ class HelpersTests(unittest.TestCase):
     self.assertEqual(0, vertical_id)
 
 
+class FakeFetcher(object):
+  """Stand-in for FeedFetcher that returns canned parse results."""
+
+  def __init__(self, results):
+    self.results = results
+
+  def FetchAll(self, feeds, entry_filter=None, topics_fingerprint=None):
+    self.topics_fingerprint = topics_fingerprint
+    for feed in feeds:
+      yield feed, self.results[feed.url]
+
+
+class RecordingTaskQueue(object):
+  """Stand-in for TaskQueueWrapper that records the tasks it is given."""
+
+  def __init__(self):
+    self.calls = []
+    self.countdowns = []
+    self.queue_names = []
+
+  def Download(self, feed_id_batches, countdown=0, queue_name='download',
+               dispatched_at=None):
+    self.calls.append(('Download', feed_id_batches))
+    self.countdowns.append(countdown)
+    self.queue_names.append(queue_name)
+    self.dispatched_at = dispatched_at
+
+  def Dispatch(self, batch_size, now, cursor, spread=False):
+    self.calls.append(('Dispatch', (batch_size, now, cursor, spread)))
+
+
 class MockRequest:
   def __init__(self, key, value):
     self.key = key
@@ -0,0 +1,164 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+"""Defines the TopicMatcher class used to find topics mentioned in articles.
+
+  The matcher compiles the names of all topics into a single Aho-Corasick
+  automaton, so that every topic mentioned in a text is found in one pass over
+  that text instead of one pass per topic. The automaton runs in Python while
+  a substring search runs in C, so with few topics it is faster to search the
+  text for each topic name in turn, and the matcher does that instead.
+"""
+
+__author__ = ('momander@google.com (Martin Omander)',
+              'shamjeff@google.com (Jeff Sham)')
+
+import hashlib
+
+# The fewest topics the automaton is built for. The benchmarks in
+# benchmarks/benchmarks.py put the point where it becomes faster than
+# searching for each name in turn at 500 to 700 topics.
+AUTOMATON_MIN_TOPICS = 500
+
+
+class TopicMatcher(object):
+  """Finds all topics whose names occur in a piece of text.
+
+  Matching is case insensitive and a topic matches wherever its name occurs as
+  a substring of the text, just like a string.find() on the upper-cased text
+  and name would.
+  """
+
+  def __init__(self, topics):
+    """Prepares the topic names for matching.
+
+    The names are compiled into an automaton if there are at least
+    AUTOMATON_MIN_TOPICS of them.
+
+    Args:
+      topics: iterable An iterable of objects with a name attribute, typically
+          Topic model objects.
+    """
+    self.topics = [t for t in topics if t.name is not None]
+    self.fingerprint = self._Fingerprint()
+    # Topics with an empty name are found in any text, like string.find does.
+    self._always = []
+    # The index and normalized name of the other topics.
+    self._names = []
+    for index, topic in enumerate(self.topics):
+      name = self._Normalize(topic.name)
+      if name:
+        self._names.append((index, name))
+      else:
+        self._always.append(index)
+    # The automaton's transitions, or None if there is none.
+    self._goto = None
+    if len(self._names) >= AUTOMATON_MIN_TOPICS:
+      self._BuildAutomaton()
+
+  def _BuildAutomaton(self):
+    """Compiles the topic names into the goto, failure and output tables."""
+    # State 0 is the root. For each state we keep the outgoing transitions,
+    # the failure link and the indexes of the topics that end in the state.
+    self._goto = [{}]
+    self._fail = [0]
+    self._output = [[]]
+    for index, name in self._names:
+      state = 0
+      for char in name:
+        next_state = self._goto[state].get(char)
+        if next_state is None:
+          next_state = len(self._goto)
+          self._goto.append({})
+          self._fail.append(0)
+          self._output.append([])
+          self._goto[state][char] = next_state
+        state = next_state
+      self._output[state].append(index)
+    self._BuildFailureLinks()
+
+  def _Fingerprint(self):
+    """Returns a digest of the topic names, which changes with the topics."""
+    names = sorted(t.name for t in self.topics)
+    return hashlib.md5(u'\n'.join(names).encode('utf-8')).hexdigest()
+
+  def _BuildFailureLinks(self):
+    """Computes failure links breadth-first and merges outputs along them."""
+    queue = list(self._goto[0].values())
+    head = 0
+    while head < len(queue):
+      state = queue[head]
+      head += 1
+      for char, next_state in self._goto[state].iteritems():
+        queue.append(next_state)
+        fallback = self._fail[state]
+        while fallback and char not in self._goto[fallback]:
+          fallback = self._fail[fallback]
+        target = self._goto[fallback].get(char, 0)
+        if target == next_state:
+          target = 0
+        self._fail[next_state] = target
+        self._output[next_state] = (self._output[next_state] +
+                                    self._output[target])
+
+  def _Normalize(self, text):
+    """Returns the text in the form used for matching."""
+    return text.upper()
+
+  def _Search(self, text, found):
+    """Adds the indexes of all topics occurring in text to the found set.
+
+    Searches the text for each topic name in turn, for few topics.
+
+    Args:
+      text: str The text to search.
+      found: set Set of topic indexes to add matches to.
+    """
+    text = self._Normalize(text)
+    for index, name in self._names:
+      if name in text:
+        found.add(index)
+
+  def _Scan(self, text, found):
+    """Adds the indexes of all topics occurring in text to the found set.
+
+    Args:
+      text: str The text to scan.
+      found: set Set of topic indexes to add matches to.
+    """
+    goto = self._goto
+    fail = self._fail
+    output = self._output
+    state = 0
+    for char in self._Normalize(text):
+      next_state = goto[state].get(char)
+      while next_state is None and state:
+        state = fail[state]
+        next_state = goto[state].get(char)
+      if next_state is None:
+        continue
+      state = next_state
+      if output[state]:
+        found.update(output[state])
+
+  def Match(self, *texts):
+    """Finds the topics mentioned in any of the given texts.
+
+    Each text is scanned separately, so a topic name never matches across the
+    boundary between two texts.
+
+    Args:
+      texts: str One or more texts to scan, e.g. the title and summary of an
+          entry.
+
+    Returns:
+      A list of matching topics, in the order they were given to the matcher.
+    """
+    found = set(self._always)
+    for text in texts:
+      if not text:
+        continue
+      if self._goto is None:
+        self._Search(text, found)
+      else:
+        self._Scan(text, found)
+    return [self.topics[index] for index in sorted(found)]